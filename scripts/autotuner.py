@@ -0,0 +1,386 @@
+"""
+Concurrency Autotuner for DocuSearch_AI
+Adjusts the concurrency of each pipeline stage at runtime.
+
+- Every stage (EXIF, geocode, caption, thumbnail, upload) has its own limit, resized
+  between configured bounds from what its completed calls show
+- Additive increase: +1 when the limit is actually binding (callers wait)
+  and latency stays near its baseline
+- Multiplicative decrease on 429s or an error burst
+- Latency gradient: when the window's median latency rises well above
+  the baseline (queueing in the dependency), the limit drops to the
+  Little's-law estimate: throughput x baseline latency
+- Decisions are logged as JSON lines and kept for stats
+"""
+
+import os
+import sys
+import json
+import time
+import threading
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+import requests
+from dotenv import load_dotenv
+
+
+# Load environment variables
+load_dotenv()
+
+# Stage bounds (min:max) when AUTOTUNE_LIMITS is not set
+DEFAULT_STAGE_BOUNDS = {
+    "exif": (1, 8),
+    "geocode": (1, 2),
+    "caption": (1, 32),
+    "thumbnail": (1, 4),
+    "upload": (1, 8),
+}
+
+# Error strings of geocoder results that mean "slow down"
+THROTTLE_MARKERS = ("429", "Too Many Requests", "OVER_QUERY_LIMIT", "RESOURCE_EXHAUSTED")
+
+
+def is_throttle(error: Any) -> bool:
+    """Check whether an exception or error message is a rate-limit response."""
+    if isinstance(error, requests.HTTPError) and error.response is not None:
+        return error.response.status_code == 429
+    return any(marker in str(error) for marker in THROTTLE_MARKERS)
+
+
+def log_decision(decision: Dict[str, Any]):
+    """Default decision log: one JSON line on stderr."""
+    print(json.dumps(decision, ensure_ascii=False), file=sys.stderr)
+
+
+class Slot:
+    """Outcome of one call inside a stage (see AdaptiveLimit.slot)."""
+
+    __slots__ = ("error", "throttled")
+
+    def __init__(self):
+        self.error = False
+        self.throttled = False
+
+    def fail(self, error: Any = None):
+        """Mark the call as failed (a throttle if error is a 429 or quota error)."""
+        self.error = True
+        self.throttled = self.throttled or (error is not None and is_throttle(error))
+
+
+class AdaptiveLimit:
+    """
+    Resizable concurrency limit of one stage.
+
+    Samples are collected in windows (window_size calls or window_seconds,
+    whichever ends first); one decision is made per window. Calls admitted
+    before the last change are left out of the next window, so a change is
+    judged by its own effect and not by calls still running under the old
+    limit.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        min_limit: int = 1,
+        max_limit: int = 8,
+        initial: Optional[int] = None,
+        window_size: int = 20,
+        window_seconds: float = 10.0,
+        tolerance: float = 1.5,
+        backoff: float = 0.7,
+        error_rate: float = 0.2,
+        baseline_windows: int = 30,
+        settle_latencies: float = 4.0,
+        throttle_cooldown: int = 50,
+        log: Optional[Callable[[Dict[str, Any]], None]] = log_decision
+    ):
+        """
+        Initialize stage limit.
+
+        Args:
+            name: Stage name (used in logs)
+            min_limit: Lower bound
+            max_limit: Upper bound
+            initial: Starting limit (default: min_limit + 1, within bounds)
+            window_size: Calls per decision window
+            window_seconds: Maximum window length in seconds
+            tolerance: Median latency / baseline ratio treated as queueing
+            backoff: Multiplier on 429s and error bursts
+            error_rate: Failed fraction of a window counted as an error burst
+            baseline_windows: Windows the baseline (lowest median) is taken over,
+                              so it follows lasting changes of the dependency
+            settle_latencies: Minimum window length in baseline latencies
+            throttle_cooldown: Windows during which the limit stays below
+                               the last value that drew 429s
+            log: Called with every limit change (None to disable)
+        """
+        self.name = name
+        self.min_limit = max(1, min_limit)
+        self.max_limit = max(self.min_limit, max_limit)
+        start = initial if initial is not None else self.min_limit + 1
+        self.limit = min(max(start, self.min_limit), self.max_limit)
+        self.window_size = window_size
+        self.window_seconds = window_seconds
+        self.tolerance = tolerance
+        self.backoff = backoff
+        self.error_rate = error_rate
+        self.settle_latencies = settle_latencies
+        self.throttle_cooldown = throttle_cooldown
+        self.log = log
+
+        self._cond = threading.Condition()
+        self.inflight = 0
+        self.waiting = 0
+        self._medians = deque(maxlen=baseline_windows)
+        self.decisions: deque = deque(maxlen=100)
+        self.completed = 0
+        self.failures = 0
+        self.throttles = 0
+        self.generation = 0
+        self._ceiling = self.max_limit
+        self._cooldown = 0
+        self._reset_window(time.monotonic())
+
+    def _reset_window(self, now: float):
+        self._completions = 0
+        self._calls = 0
+        self._latencies: List[float] = []
+        self._errors = 0
+        self._throttled = 0
+        self._binding = False
+        self._window_start = now
+
+    def acquire(self, timeout: Optional[float] = None) -> bool:
+        """
+        Wait for a free slot.
+
+        Returns:
+            False if timeout passed without a slot
+        """
+        end = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            if self.inflight >= self.limit:
+                self._binding = True
+            self.waiting += 1
+            try:
+                while self.inflight >= self.limit:
+                    remaining = None if end is None else end - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        return False
+                    self._cond.wait(remaining)
+            finally:
+                self.waiting -= 1
+            self.inflight += 1
+            return True
+
+    def release(
+        self,
+        latency: float,
+        error: bool = False,
+        throttled: bool = False,
+        generation: Optional[int] = None
+    ):
+        """
+        Free a slot and record the call's outcome.
+
+        Args:
+            latency: Seconds the call took
+            error: Whether the call failed
+            throttled: Whether the failure was a 429 / quota error
+            generation: Limit generation when the slot was acquired
+                        (calls from an older generation are not sampled)
+        """
+        with self._cond:
+            self.inflight -= 1
+            self.completed += 1
+            self.failures += error
+            self.throttles += throttled
+            self._completions += not error
+
+            if generation is None or generation == self.generation:
+                self._calls += 1
+                if error:
+                    self._errors += 1
+                else:
+                    # Failures return early; only successes show the dependency's latency
+                    self._latencies.append(latency)
+                self._throttled += throttled
+
+            # A window spans several baseline latencies, so calls that queued
+            # after a change finish inside it (early finishers are the fast ones)
+            now = time.monotonic()
+            elapsed = now - self._window_start
+            settled = elapsed >= self.settle_latencies * (min(self._medians) if self._medians else 0)
+            if (self._calls >= self.window_size and settled) or (self._calls and elapsed >= self.window_seconds):
+                self._decide(now)
+            self._cond.notify_all()
+
+    @contextmanager
+    def slot(self, timeout: Optional[float] = None) -> Iterator[Slot]:
+        """
+        Run a call inside the stage limit.
+
+        Exceptions count as failures (429s as throttles) and are re-raised;
+        callers mark soft failures with Slot.fail().
+
+        Raises:
+            TimeoutError: No slot within timeout
+        """
+        if not self.acquire(timeout):
+            raise TimeoutError(f"No {self.name} slot within {timeout:.1f}s")
+        outcome = Slot()
+        generation = self.generation
+        start = time.monotonic()
+        try:
+            yield outcome
+        except Exception as e:
+            outcome.fail(e)
+            raise
+        finally:
+            self.release(time.monotonic() - start, outcome.error, outcome.throttled, generation)
+
+    def _decide(self, now: float):
+        """Close the window and resize the limit (called with the lock held)."""
+        latencies = sorted(self._latencies)
+        median = latencies[len(latencies) // 2] if latencies else None
+        elapsed = max(now - self._window_start, 1e-6)
+        throughput = self._completions / elapsed
+        if median is not None:
+            # Lowest recent median: queueing only raises medians, and a dependency
+            # that became slower for good shows up once older windows expire.
+            # At the lower bound there is no queueing of ours to blame: restart
+            if self.limit == self.min_limit:
+                self._medians.clear()
+            self._medians.append(median)
+        baseline = min(self._medians) if self._medians else None
+
+        old = self.limit
+        self._cooldown = max(self._cooldown - 1, 0)
+        if not self._cooldown:
+            self._ceiling = self.max_limit
+
+        if self._throttled:
+            reason = "throttled"
+            new = int(old * self.backoff)
+            # Do not probe the value that drew 429s again for a while
+            self._ceiling = max(old - 1, self.min_limit)
+            self._cooldown = self.throttle_cooldown
+        elif self._errors and self._errors >= self.error_rate * self._calls:
+            reason = "errors"
+            new = int(old * self.backoff)
+        elif median is not None and median > baseline * self.tolerance:
+            # Little's law: concurrency the dependency sustains at baseline latency
+            reason = "latency"
+            new = min(old - 1, int(throughput * baseline) + 1)
+        elif (self._binding or self.waiting) and old < self._ceiling:
+            reason = "increase"
+            new = old + 1
+        else:
+            reason = None
+            new = old
+
+        self.limit = min(max(new, self.min_limit), self.max_limit)
+        if self.limit != old:
+            self.generation += 1
+            decision = {
+                "stage": self.name,
+                "time": round(time.time(), 3),
+                "from": old,
+                "to": self.limit,
+                "reason": reason,
+                "median_ms": round(median * 1000, 1) if median is not None else None,
+                "baseline_ms": round(baseline * 1000, 1) if baseline is not None else None,
+                "throughput": round(throughput, 2),
+                "errors": self._errors,
+                "throttled": self._throttled,
+                "waiting": self.waiting,
+                "calls": self._calls
+            }
+            self.decisions.append(decision)
+            if self.log:
+                self.log(decision)
+        self._reset_window(now)
+
+    def stats(self) -> Dict[str, Any]:
+        """Current limit, load and totals."""
+        with self._cond:
+            return {
+                "limit": self.limit,
+                "bounds": [self.min_limit, self.max_limit],
+                "inflight": self.inflight,
+                "waiting": self.waiting,
+                "completed": self.completed,
+                "failures": self.failures,
+                "throttles": self.throttles,
+                "baseline_ms": round(min(self._medians) * 1000, 1) if self._medians else None,
+                "last_decision": self.decisions[-1] if self.decisions else None
+            }
+
+
+class Autotuner:
+    """Adaptive limits for the stages of the ingest pipeline."""
+
+    def __init__(
+        self,
+        bounds: Optional[Dict[str, tuple]] = None,
+        **kwargs
+    ):
+        """
+        Initialize autotuner.
+
+        Args:
+            bounds: Stage name -> (min, max) concurrency
+            **kwargs: Passed to every AdaptiveLimit (window_size, tolerance, log, ...)
+        """
+        self.stages = {
+            name: AdaptiveLimit(name, min_limit, max_limit, **kwargs)
+            for name, (min_limit, max_limit) in (bounds or DEFAULT_STAGE_BOUNDS).items()
+        }
+
+    @contextmanager
+    def stage(self, name: str, timeout: Optional[float] = None) -> Iterator[Slot]:
+        """
+        Run a call inside a stage's limit (no limit for unknown stages).
+
+        Yields:
+            Slot for marking soft failures
+        """
+        limit = self.stages.get(name)
+        if limit is None:
+            yield Slot()
+            return
+        with limit.slot(timeout) as outcome:
+            yield outcome
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        """Stats of every stage."""
+        return {name: limit.stats() for name, limit in self.stages.items()}
+
+
+def parse_bounds(value: str) -> Dict[str, tuple]:
+    """Parse 'stage=min:max,...' (missing stages keep their defaults)."""
+    bounds = dict(DEFAULT_STAGE_BOUNDS)
+    for item in value.split(','):
+        name, _, limits = item.strip().partition('=')
+        if limits:
+            low, _, high = limits.partition(':')
+            bounds[name.strip()] = (int(low), int(high or low))
+    return bounds
+
+
+def get_autotuner() -> Autotuner:
+    """
+    Factory function to create Autotuner instance.
+
+    Uses AUTOTUNE_LIMITS (e.g. 'caption=2:48,upload=1:4') and
+    AUTOTUNE_WINDOW (calls per decision, default 20).
+
+    Returns:
+        Autotuner instance
+    """
+    return Autotuner(
+        bounds=parse_bounds(os.environ.get('AUTOTUNE_LIMITS', '')),
+        window_size=int(os.environ.get('AUTOTUNE_WINDOW', 20))
+    )
@@ -0,0 +1,112 @@
+"""
+Deadline Propagation for DocuSearch_AI
+A per-item latency budget passed through the pipeline stages
+(geocoding, vision caption, Dify upload).
+
+Each stage derives its request timeout from the remaining budget instead
+of a hard-coded value; optional stages are skipped when too little time
+is left. Process-wide counters report exceeded budgets and skipped stages.
+"""
+
+import time
+import threading
+from typing import Dict, Any
+
+
+DEFAULT_BUDGET_SECONDS = 60.0
+
+_stats_lock = threading.Lock()
+_stats: Dict[str, Any] = {"started": 0, "exceeded": 0, "skipped": {}}
+
+
+class DeadlineExceeded(TimeoutError):
+    """Raised when a stage has no budget left."""
+
+
+class Deadline:
+    """Absolute deadline with helpers for per-stage timeouts."""
+
+    __slots__ = ("expires_at", "_root", "_exceeded")
+
+    def __init__(self, seconds: float = DEFAULT_BUDGET_SECONDS):
+        """
+        Start a budget.
+
+        Args:
+            seconds: Budget from now
+        """
+        self.expires_at = time.monotonic() + seconds
+        self._root = self
+        self._exceeded = False
+        with _stats_lock:
+            _stats["started"] += 1
+
+    def remaining(self) -> float:
+        """Seconds left (negative when past the deadline)."""
+        return self.expires_at - time.monotonic()
+
+    def expired(self) -> bool:
+        """Whether the deadline has passed."""
+        if self.remaining() > 0:
+            return False
+        self._check_exceeded()
+        return True
+
+    def allows(self, seconds: float) -> bool:
+        """Whether at least `seconds` remain."""
+        return self.remaining() >= seconds
+
+    def timeout(self, cap: float, floor: float = 0.0) -> float:
+        """
+        Timeout for a stage: the remaining budget, capped.
+
+        Args:
+            cap: Upper bound (the stage's usual timeout)
+            floor: Lower bound for mandatory stages; with floor 0 an
+                   exhausted budget raises instead
+
+        Raises:
+            DeadlineExceeded: No budget left and no floor
+        """
+        remaining = self.remaining()
+        if remaining <= 0:
+            self._check_exceeded()
+            if floor <= 0:
+                raise DeadlineExceeded("Deadline exceeded")
+        return max(floor, min(cap, remaining))
+
+    def sub(self, seconds: float) -> "Deadline":
+        """Child deadline ending after `seconds` or at this deadline, whichever is first."""
+        child = object.__new__(Deadline)
+        child.expires_at = min(self.expires_at, time.monotonic() + seconds)
+        child._root = self._root
+        child._exceeded = False
+        return child
+
+    def cancel(self):
+        """End this deadline now (pending stages on it give up; the parent is unaffected)."""
+        self.expires_at = min(self.expires_at, time.monotonic())
+
+    def skip(self, stage: str):
+        """Record that an optional stage was skipped for lack of budget."""
+        with _stats_lock:
+            _stats["skipped"][stage] = _stats["skipped"].get(stage, 0) + 1
+
+    def _check_exceeded(self):
+        # A child hitting its own cap is not an exceeded budget
+        root = self._root
+        if not root._exceeded and root.remaining() <= 0:
+            root._exceeded = True
+            with _stats_lock:
+                _stats["exceeded"] += 1
+
+    @property
+    def exceeded(self) -> bool:
+        """Whether the overall budget ran out."""
+        return self._root._exceeded
+
+
+def deadline_stats() -> Dict[str, Any]:
+    """Budgets started and exceeded, and skipped stages, in this process."""
+    with _stats_lock:
+        return {**_stats, "skipped": dict(_stats["skipped"])}
@@ -0,0 +1,531 @@
+"""
+Near-Duplicate Index for DocuSearch_AI
+MinHash/LSH suppression of repeated chunks before they are embedded.
+
+- Chunks are shingled into character 5-grams (whitespace removed, so it
+  works for Japanese) and summarized by a 64-value one-permutation MinHash
+  signature
+- LSH banding (16 bands x 4 rows) finds candidates; a chunk whose
+  estimated Jaccard similarity to an indexed chunk of the dataset reaches
+  the threshold is not uploaded (shared headers, footers, template text,
+  unchanged sections of revised documents)
+- Whole-document signatures (element-wise minimum of the chunk signatures)
+  report near-duplicate documents
+- The index is persistent (SQLite) and updated incrementally per document;
+  documents whose suppressed chunks depended on a removed document are
+  returned so they can be re-indexed
+- A document's chunks are staged in a private temporary database while
+  it uploads and enter the index only once the upload succeeded
+  (set_document), so a failed upload never suppresses other documents
+- Embedding tokens and chunks saved are counted per upload and in total
+"""
+
+import os
+import json
+import zlib
+import sqlite3
+import hashlib
+import threading
+from array import array
+from typing import Optional, Dict, Any, List, Iterable, Iterator, Tuple
+from dotenv import load_dotenv
+
+
+# Load environment variables
+load_dotenv()
+
+DEFAULT_INDEX_PATH = os.environ.get('DEDUP_INDEX_PATH', 'dedup_index.sqlite3')
+
+SHINGLE_SIZE = 5
+NUM_PERM = 64
+NUM_BANDS = 16
+
+_MASK = (1 << 64) - 1
+_EMPTY = _MASK
+_GOLDEN = 0x9E3779B97F4A7C15
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough embedding token count: ~4 ASCII characters or 1 CJK character per token."""
+    ascii_chars = sum(1 for c in text if c < "\x80")
+    return (ascii_chars + 3) // 4 + len(text) - ascii_chars
+
+
+def shingles(text: str, size: int = SHINGLE_SIZE) -> set:
+    """Hashed (CRC-32) character n-grams of text with whitespace removed."""
+    compact = "".join(text.split())
+    if len(compact) <= size:
+        return {zlib.crc32(compact.encode("utf-8"))} if compact else set()
+    return {zlib.crc32(compact[i:i + size].encode("utf-8")) for i in range(len(compact) - size + 1)}
+
+
+class MinHasher:
+    """
+    One-permutation MinHash with densification.
+
+    Each shingle is hashed once into one of num_perm bins; a bin keeps its
+    minimum. Empty bins borrow the next non-empty bin's value (offset by the
+    distance), which keeps the estimator valid for short texts. O(n) per
+    signature instead of O(n * num_perm).
+    """
+
+    def __init__(self, num_perm: int = NUM_PERM, seed: int = 1):
+        """
+        Args:
+            num_perm: Signature length (power of two)
+            seed: Hash salt (must stay fixed for a persistent index)
+        """
+        if num_perm & (num_perm - 1):
+            raise ValueError("num_perm must be a power of two")
+        self.num_perm = num_perm
+        self.shift = num_perm.bit_length() - 1
+        self.salt = (seed * _GOLDEN) & _MASK
+
+    def signature(self, hashed: Iterable[int]) -> Tuple[int, ...]:
+        """
+        MinHash signature of a set of hashed shingles.
+
+        Returns:
+            num_perm unsigned 64-bit values (all _EMPTY for an empty set)
+        """
+        bins = [_EMPTY] * self.num_perm
+        mask = self.num_perm - 1
+        shift = self.shift
+        salt = self.salt
+        for x in hashed:
+            # splitmix64 finalizer spreads the 32-bit shingle hash over 64 bits
+            x = ((x ^ salt) + _GOLDEN) & _MASK
+            x = ((x ^ (x >> 30)) * 0xBF58476D1CE4E5B9) & _MASK
+            x = ((x ^ (x >> 27)) * 0x94D049BB133111EB) & _MASK
+            x ^= x >> 31
+            slot = x & mask
+            value = x >> shift
+            if value < bins[slot]:
+                bins[slot] = value
+
+        if all(v == _EMPTY for v in bins):
+            return tuple(bins)
+
+        # Densify: borrow from the next filled bin, tagged with the distance
+        step = 1 << (64 - shift)
+        filled = [v != _EMPTY for v in bins]
+        result = list(bins)
+        for i in range(self.num_perm):
+            distance = 0
+            while not filled[(i + distance) & mask]:
+                distance += 1
+            result[i] = bins[(i + distance) & mask] + distance * step
+        return tuple(result)
+
+
+def similarity(a: Tuple[int, ...], b: Tuple[int, ...]) -> float:
+    """Estimated Jaccard similarity of two signatures."""
+    return sum(1 for x, y in zip(a, b) if x == y) / len(a)
+
+
+ITEMS_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS items (
+        id INTEGER PRIMARY KEY, name TEXT, kind TEXT, digest TEXT, signature BLOB
+    );
+    CREATE INDEX IF NOT EXISTS items_name ON items (name);
+    CREATE INDEX IF NOT EXISTS items_digest ON items (digest);
+    CREATE TABLE IF NOT EXISTS buckets (
+        bucket INTEGER, item INTEGER
+    );
+    CREATE INDEX IF NOT EXISTS buckets_bucket ON buckets (bucket);
+    CREATE INDEX IF NOT EXISTS buckets_item ON buckets (item);
+"""
+
+
+class _Staging:
+    """Chunks of one document being uploaded (temporary database, spills to disk)."""
+
+    def __init__(self):
+        self.db = sqlite3.connect("", check_same_thread=False)
+        self.db.executescript(ITEMS_SCHEMA)
+        self.owners = set()
+
+    def close(self):
+        self.db.close()
+
+
+class DedupIndex:
+    """Persistent MinHash/LSH index of uploaded chunks and documents."""
+
+    def __init__(
+        self,
+        path: str = DEFAULT_INDEX_PATH,
+        chunk_threshold: float = 0.9,
+        document_threshold: float = 0.8,
+        num_perm: int = NUM_PERM,
+        bands: int = NUM_BANDS
+    ):
+        """
+        Initialize the index.
+
+        Args:
+            path: SQLite database path (':memory:' for a throwaway index)
+            chunk_threshold: Similarity at which a chunk is not uploaded again
+            document_threshold: Similarity reported as a near-duplicate document
+            num_perm: Signature length (fixed once the index has data)
+            bands: LSH bands; num_perm / bands rows each
+        """
+        if num_perm % bands:
+            raise ValueError("num_perm must be a multiple of bands")
+
+        self.path = path
+        self.chunk_threshold = chunk_threshold
+        self.document_threshold = document_threshold
+        self.hasher = MinHasher(num_perm)
+        self.bands = bands
+        self.rows = num_perm // bands
+        self._lock = threading.Lock()
+        self._staged: Dict[str, _Staging] = {}
+        self._db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._db.executescript(ITEMS_SCHEMA + """
+            CREATE TABLE IF NOT EXISTS documents (
+                name TEXT PRIMARY KEY, document_id TEXT, path TEXT, content_hash TEXT,
+                chunks INTEGER, suppressed INTEGER, tokens_saved INTEGER, similar_to TEXT
+            );
+            CREATE TABLE IF NOT EXISTS dependencies (
+                name TEXT, owner TEXT
+            );
+            CREATE INDEX IF NOT EXISTS dependencies_owner ON dependencies (owner);
+            CREATE TABLE IF NOT EXISTS counters (
+                key TEXT PRIMARY KEY, value INTEGER
+            );
+        """)
+
+    def _bucket_keys(self, kind: str, signature: Tuple[int, ...]) -> List[int]:
+        keys = []
+        for band in range(self.bands):
+            rows = signature[band * self.rows:(band + 1) * self.rows]
+            raw = f"{kind}:{band}:" + ",".join(map(str, rows))
+            keys.append(int.from_bytes(hashlib.blake2b(raw.encode(), digest_size=8).digest(), "big", signed=True))
+        return keys
+
+    def _candidates(
+        self,
+        kind: str,
+        signature: Tuple[int, ...],
+        db: Optional[sqlite3.Connection] = None
+    ) -> List[Tuple[str, float]]:
+        """Indexed (or staged, with db) items of kind sharing an LSH bucket with signature: (name, similarity)."""
+        keys = self._bucket_keys(kind, signature)
+        rows = (db or self._db).execute(
+            f"SELECT DISTINCT items.name, items.signature FROM buckets JOIN items ON items.id = buckets.item "
+            f"WHERE buckets.bucket IN ({','.join('?' * len(keys))}) AND items.kind = ?",
+            (*keys, kind)
+        ).fetchall()
+        return [(name, similarity(signature, tuple(array("Q", blob)))) for name, blob in rows]
+
+    def _query(
+        self,
+        kind: str,
+        signature: Tuple[int, ...],
+        threshold: float,
+        exclude: Optional[str] = None,
+        db: Optional[sqlite3.Connection] = None
+    ) -> Optional[Tuple[str, float]]:
+        """Best indexed item of kind at or above threshold: (name, similarity)."""
+        matches = [m for m in self._candidates(kind, signature, db) if m[0] != exclude and m[1] >= threshold]
+        return max(matches, key=lambda m: m[1]) if matches else None
+
+    def _insert(
+        self,
+        name: str,
+        kind: str,
+        digest: Optional[str],
+        signature: Tuple[int, ...],
+        db: Optional[sqlite3.Connection] = None
+    ):
+        db = db or self._db
+        cursor = db.execute(
+            "INSERT INTO items (name, kind, digest, signature) VALUES (?, ?, ?, ?)",
+            (name, kind, digest, array("Q", signature).tobytes())
+        )
+        db.executemany(
+            "INSERT INTO buckets (bucket, item) VALUES (?, ?)",
+            [(key, cursor.lastrowid) for key in self._bucket_keys(kind, signature)]
+        )
+
+    def _remove(self, name: str) -> List[str]:
+        dependents = [row[0] for row in self._db.execute(
+            "SELECT DISTINCT name FROM dependencies WHERE owner = ? AND name != ?", (name, name)
+        )]
+        self._db.execute("DELETE FROM buckets WHERE item IN (SELECT id FROM items WHERE name = ?)", (name,))
+        self._db.execute("DELETE FROM items WHERE name = ?", (name,))
+        self._db.execute("DELETE FROM dependencies WHERE name = ? OR owner = ?", (name, name))
+        self._db.execute("DELETE FROM documents WHERE name = ?", (name,))
+        return dependents
+
+    def filter_chunks(
+        self,
+        name: str,
+        chunks: Iterable[str],
+        prefix: str = "",
+        stats: Optional[Dict[str, Any]] = None
+    ) -> Iterator[str]:
+        """
+        Yield the chunks of a document that are not already in the dataset.
+
+        The first chunk is always kept (it carries the document header). A
+        chunk is dropped when an identical or near-identical chunk is
+        indexed for another document, or was kept earlier in this one. The
+        document's previous version is not matched (it is being replaced).
+
+        Nothing is written to the index here: kept chunks are staged and
+        enter the index with set_document() after the upload succeeded
+        (discard() drops them if it failed).
+
+        Args:
+            name: Document name (relative path)
+            chunks: Chunk texts in upload order
+            prefix: Text at the start of the first chunk that is not
+                    content (the document header); ignored for matching
+            stats: Updated in place with chunks, suppressed, tokens_saved
+                   and, once exhausted, similar_to / similarity
+
+        Yields:
+            Chunks to upload
+        """
+        stats = stats if stats is not None else {}
+        stats.update({"chunks": 0, "suppressed": 0, "tokens_saved": 0})
+        staging = _Staging()
+        with self._lock:
+            previous = self._staged.pop(name, None)
+            self._staged[name] = staging
+        if previous:
+            previous.close()
+        document_signature = None
+
+        for i, chunk in enumerate(chunks):
+            body = chunk[len(prefix):] if i == 0 and prefix and chunk.startswith(prefix) else chunk
+            digest = hashlib.blake2b("".join(body.split()).encode("utf-8"), digest_size=16).hexdigest()
+            signature = self.hasher.signature(shingles(body))
+            stats["chunks"] += 1
+            document_signature = signature if document_signature is None else tuple(
+                map(min, document_signature, signature)
+            )
+
+            match = None
+            if i > 0 and body.strip():
+                with self._lock:
+                    row = self._db.execute(
+                        "SELECT name FROM items WHERE digest = ? AND kind = 'chunk' AND name != ? LIMIT 1",
+                        (digest, name)
+                    ).fetchone()
+                    match = (row[0], 1.0) if row else self._query(
+                        "chunk", signature, self.chunk_threshold, exclude=name
+                    )
+                if match is None and (
+                    staging.db.execute("SELECT 1 FROM items WHERE digest = ? LIMIT 1", (digest,)).fetchone()
+                    or self._query("chunk", signature, self.chunk_threshold, db=staging.db)
+                ):
+                    match = (name, 1.0)
+
+            if match:
+                stats["suppressed"] += 1
+                stats["tokens_saved"] += estimate_tokens(chunk)
+                staging.owners.add(match[0])
+                continue
+
+            self._insert(name, "chunk", digest, signature, db=staging.db)
+            yield chunk
+
+        if document_signature is not None:
+            with self._lock:
+                similar = self._query("document", document_signature, self.document_threshold, exclude=name)
+            if similar:
+                stats["similar_to"], stats["similarity"] = similar[0], round(similar[1], 3)
+            self._insert(name, "document", None, document_signature, db=staging.db)
+
+    def discard(self, name: str):
+        """Drop the staged chunks of a document whose upload failed."""
+        with self._lock:
+            staging = self._staged.pop(name, None)
+        if staging:
+            staging.close()
+
+    def set_document(
+        self,
+        name: str,
+        document_id: Optional[str],
+        path: Optional[str] = None,
+        content_hash: Optional[str] = None,
+        stats: Optional[Dict[str, Any]] = None
+    ):
+        """
+        Record the uploaded document for a name passed through filter_chunks.
+
+        Replaces the document's previous entries with the staged ones in a
+        single transaction. Documents that skipped chunks held by the
+        previous version lose that content; they are put in
+        stats['dependents'] (re-index them, see pop_documents).
+
+        Args:
+            name: Document name
+            document_id: Dify document ID
+            path: Local file path (needed to re-index dependents)
+            content_hash: Content hash of the file
+            stats: Stats dictionary filled by filter_chunks
+        """
+        stats = stats if stats is not None else {}
+        with self._lock:
+            staging = self._staged.pop(name, None)
+            stats["dependents"] = self._remove(name)
+            if staging:
+                for kind, digest, blob in staging.db.execute("SELECT kind, digest, signature FROM items ORDER BY id"):
+                    self._insert(name, kind, digest, tuple(array("Q", blob)))
+                self._db.executemany(
+                    "INSERT INTO dependencies (name, owner) VALUES (?, ?)",
+                    [(name, owner) for owner in staging.owners if owner != name]
+                )
+                for key in ("chunks", "suppressed", "tokens_saved"):
+                    self._db.execute(
+                        "INSERT INTO counters (key, value) VALUES (?, ?) "
+                        "ON CONFLICT(key) DO UPDATE SET value = value + excluded.value",
+                        (key, stats.get(key, 0))
+                    )
+            self._db.execute(
+                "INSERT OR REPLACE INTO documents VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (name, document_id, path, content_hash, stats.get("chunks", 0),
+                 stats.get("suppressed", 0), stats.get("tokens_saved", 0), stats.get("similar_to"))
+            )
+            self._db.commit()
+        if staging:
+            staging.close()
+
+    def remove(self, name: str) -> List[Dict[str, Any]]:
+        """
+        Forget a deleted document.
+
+        Documents that skipped chunks because this one held them no longer
+        have that content in the dataset; they are returned (and forgotten)
+        so the caller can re-index them in full.
+
+        Returns:
+            Dependent documents: name, document_id, path, content_hash
+        """
+        with self._lock:
+            names = self._remove(name)
+            dependents = self._pop_documents(names)
+            self._db.commit()
+        return dependents
+
+    def pop_documents(self, names: List[str]) -> List[Dict[str, Any]]:
+        """Forget documents (e.g. dependents about to be re-indexed) and return their records."""
+        with self._lock:
+            documents = self._pop_documents(names)
+            self._db.commit()
+        return documents
+
+    def _pop_documents(self, names: List[str]) -> List[Dict[str, Any]]:
+        documents = []
+        for name in names:
+            row = self._db.execute(
+                "SELECT document_id, path, content_hash FROM documents WHERE name = ?", (name,)
+            ).fetchone()
+            if row:
+                documents.append({"name": name, "document_id": row[0], "path": row[1], "content_hash": row[2]})
+                self._remove(name)
+        return documents
+
+    def rename(self, old_name: str, new_name: str):
+        """Re-key a moved/renamed document."""
+        with self._lock:
+            self._db.execute("UPDATE items SET name = ? WHERE name = ?", (new_name, old_name))
+            self._db.execute("UPDATE dependencies SET name = ? WHERE name = ?", (new_name, old_name))
+            self._db.execute("UPDATE dependencies SET owner = ? WHERE owner = ?", (new_name, old_name))
+            self._db.execute("UPDATE documents SET name = ? WHERE name = ?", (new_name, old_name))
+            self._db.execute("UPDATE documents SET similar_to = ? WHERE similar_to = ?", (new_name, old_name))
+            self._db.commit()
+
+    def similar_documents(self, name: str) -> List[Dict[str, Any]]:
+        """Indexed documents similar to name (document_threshold and above)."""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT signature FROM items WHERE name = ? AND kind = 'document'", (name,)
+            ).fetchone()
+            if not row:
+                return []
+            candidates = self._candidates("document", tuple(array("Q", row[0])))
+
+        return [
+            {"name": other, "similarity": round(score, 3)}
+            for other, score in sorted(candidates, key=lambda m: -m[1])
+            if other != name and score >= self.document_threshold
+        ]
+
+    def stats(self) -> Dict[str, Any]:
+        """Totals: documents and chunks indexed, chunks suppressed and embedding tokens saved."""
+        with self._lock:
+            counters = dict(self._db.execute("SELECT key, value FROM counters"))
+            documents = self._db.execute("SELECT COUNT(*) FROM documents").fetchone()[0]
+            indexed = self._db.execute("SELECT COUNT(*) FROM items WHERE kind = 'chunk'").fetchone()[0]
+        return {
+            "documents": documents,
+            "indexed_chunks": indexed,
+            "chunks_seen": counters.get("chunks", 0),
+            "chunks_suppressed": counters.get("suppressed", 0),
+            "tokens_saved": counters.get("tokens_saved", 0)
+        }
+
+    def close(self):
+        """Close the database."""
+        with self._lock:
+            self._db.close()
+
+
+def get_dedup_index(path: Optional[str] = None) -> DedupIndex:
+    """
+    Factory function to create DedupIndex instance.
+
+    Args:
+        path: SQLite path (uses DEDUP_INDEX_PATH env var if not provided)
+
+    Returns:
+        DedupIndex instance
+    """
+    return DedupIndex(
+        path=path or DEFAULT_INDEX_PATH,
+        chunk_threshold=float(os.environ.get('DEDUP_CHUNK_THRESHOLD', 0.9)),
+        document_threshold=float(os.environ.get('DEDUP_DOCUMENT_THRESHOLD', 0.8))
+    )
+
+
+# For standalone usage
+if __name__ == "__main__":
+    import sys
+
+    command = sys.argv[1] if len(sys.argv) > 1 else ""
+
+    if command == "check" and len(sys.argv) >= 3:
+        # Dry run: how much of these files would be uploaded (throwaway index)
+        from text_chunker import document_header, iter_chunks
+
+        index = DedupIndex(":memory:")
+        report = []
+        for file_path in sys.argv[2:]:
+            stats: Dict[str, Any] = {}
+            header = document_header(file_path)
+            chunks = iter_chunks(file_path, header=header)
+            for _ in index.filter_chunks(file_path, chunks, prefix=header, stats=stats):
+                pass
+            index.set_document(file_path, None, file_path, stats=stats)
+            stats.pop("dependents")
+            report.append({"file": file_path, **stats})
+        print(json.dumps({"files": report, "total": index.stats()}, ensure_ascii=False, indent=2))
+    elif command == "similar" and len(sys.argv) >= 3:
+        print(json.dumps(get_dedup_index().similar_documents(sys.argv[2]), ensure_ascii=False, indent=2))
+    elif command == "stats":
+        print(json.dumps(get_dedup_index().stats(), ensure_ascii=False, indent=2))
+    else:
+        print("Usage: python dedup_index.py check <text_file> [...]")
+        print("       python dedup_index.py similar <relative_path>")
+        print("       python dedup_index.py stats")
+        print("\nEnvironment variables:")
+        print("  DEDUP_INDEX_PATH - Index SQLite path (default: dedup_index.sqlite3)")
+        print("  DEDUP_CHUNK_THRESHOLD - Similarity at which chunks are skipped (default: 0.9)")
+        print("  DEDUP_DOCUMENT_THRESHOLD - Similarity reported as near-duplicate (default: 0.8)")
+        sys.exit(1)
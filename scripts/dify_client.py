@@ -0,0 +1,347 @@
+"""
+Dify Knowledge API client for DocuSearch_AI
+Thin wrapper over the dataset endpoints used by the sync pipeline.
+"""
+
+import os
+import json
+import time
+import requests
+from typing import Optional, Dict, Any, List
+from dotenv import load_dotenv
+
+
+# Load environment variables
+load_dotenv()
+
+
+class DifyClient:
+    """Client for Dify dataset (Knowledge Base) document APIs."""
+
+    def __init__(
+        self,
+        api_url: Optional[str] = None,
+        api_key: Optional[str] = None,
+        dataset_id: Optional[str] = None,
+        timeout: float = 120
+    ):
+        """
+        Initialize Dify client.
+
+        Args:
+            api_url: Dify service API base URL (e.g. http://dify-api:5001/v1)
+            api_key: Knowledge API key (dataset-xxxx)
+            dataset_id: Default dataset ID
+            timeout: Request timeout in seconds
+        """
+        self.api_url = (api_url or os.environ.get('DIFY_API_URL', 'http://dify-api:5001/v1')).rstrip('/')
+        self.api_key = api_key or os.environ.get('DIFY_KNOWLEDGE_API_KEY')
+        self.dataset_id = dataset_id or os.environ.get('DIFY_DATASET_ID')
+        self.timeout = timeout
+
+    def _headers(self) -> Dict[str, str]:
+        """Build authorization headers."""
+        if not self.api_key:
+            raise ValueError("Dify API key required. Set DIFY_KNOWLEDGE_API_KEY env var or pass api_key parameter.")
+        return {
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json"
+        }
+
+    def _dataset_url(self, path: str, dataset_id: Optional[str] = None) -> str:
+        """Build a URL under /datasets/{dataset_id}."""
+        dataset_id = dataset_id or self.dataset_id
+        if not dataset_id:
+            raise ValueError("Dify dataset ID required. Set DIFY_DATASET_ID env var or pass dataset_id parameter.")
+        return f"{self.api_url}/datasets/{dataset_id}{path}"
+
+    def list_documents(
+        self,
+        dataset_id: Optional[str] = None,
+        limit: int = 100
+    ) -> List[Dict[str, Any]]:
+        """
+        List all documents in a dataset (follows pagination).
+
+        Args:
+            dataset_id: Dataset ID (defaults to client dataset)
+            limit: Page size
+
+        Returns:
+            List of document dictionaries (id, name, ...)
+        """
+        documents = []
+        page = 1
+
+        while True:
+            response = requests.get(
+                self._dataset_url("/documents", dataset_id),
+                headers=self._headers(),
+                params={"limit": limit, "page": page},
+                timeout=self.timeout
+            )
+            response.raise_for_status()
+            data = response.json()
+
+            documents.extend(data.get("data", []))
+            if not data.get("has_more"):
+                break
+            page += 1
+
+        return documents
+
+    def create_by_text(
+        self,
+        name: str,
+        text: str,
+        process_rule: Optional[Dict[str, Any]] = None,
+        dataset_id: Optional[str] = None,
+        timeout: Optional[float] = None
+    ) -> Dict[str, Any]:
+        """
+        Create a document from text.
+
+        Args:
+            name: Document name (relative path, e.g. images/2025/IMG_1234.jpg)
+            text: Document text
+            process_rule: Dify process rule (defaults to automatic)
+            dataset_id: Dataset ID (defaults to client dataset)
+            timeout: Request timeout overriding the client default
+
+        Returns:
+            Dify response containing 'document' and 'batch'
+        """
+        payload = {
+            "name": name,
+            "text": text,
+            "indexing_technique": "high_quality",
+            "process_rule": process_rule or {"mode": "automatic"}
+        }
+
+        response = requests.post(
+            self._dataset_url("/document/create-by-text", dataset_id),
+            headers=self._headers(),
+            json=payload,
+            timeout=timeout or self.timeout
+        )
+        response.raise_for_status()
+        return response.json()
+
+    def indexing_status(
+        self,
+        batch: str,
+        dataset_id: Optional[str] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        Get the indexing status of an upload batch.
+
+        Args:
+            batch: Batch ID returned by create_by_text
+            dataset_id: Dataset ID (defaults to client dataset)
+
+        Returns:
+            List of per-document status dictionaries (indexing_status, ...)
+        """
+        response = requests.get(
+            self._dataset_url(f"/documents/{batch}/indexing-status", dataset_id),
+            headers=self._headers(),
+            timeout=self.timeout
+        )
+        response.raise_for_status()
+        return response.json().get("data", [])
+
+    def wait_for_indexing(
+        self,
+        batch: str,
+        dataset_id: Optional[str] = None,
+        poll_interval: float = 1.0,
+        max_wait: float = 600.0
+    ) -> float:
+        """
+        Block until every document of a batch finished indexing.
+
+        Args:
+            batch: Batch ID returned by create_by_text
+            dataset_id: Dataset ID (defaults to client dataset)
+            poll_interval: Seconds between status checks
+            max_wait: Give up after this many seconds
+
+        Returns:
+            Seconds spent waiting
+
+        Raises:
+            RuntimeError: Indexing failed or did not finish in time
+        """
+        start = time.time()
+        while True:
+            statuses = self.indexing_status(batch, dataset_id)
+            states = {s.get("indexing_status") for s in statuses}
+
+            if "error" in states:
+                raise RuntimeError(f"Indexing failed: {[s.get('error') for s in statuses]}")
+            if statuses and states <= {"completed"}:
+                return time.time() - start
+            if time.time() - start > max_wait:
+                raise RuntimeError(f"Indexing did not finish within {max_wait}s")
+
+            time.sleep(poll_interval)
+
+    def add_segments(
+        self,
+        document_id: str,
+        segments: List[str],
+        dataset_id: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """
+        Append pre-built chunks to an existing document.
+
+        Args:
+            document_id: Dify document ID (indexing must be completed)
+            segments: Chunk texts
+            dataset_id: Dataset ID (defaults to client dataset)
+
+        Returns:
+            Dify response
+        """
+        response = requests.post(
+            self._dataset_url(f"/documents/{document_id}/segments", dataset_id),
+            headers=self._headers(),
+            json={"segments": [{"content": content} for content in segments]},
+            timeout=self.timeout
+        )
+        response.raise_for_status()
+        return response.json()
+
+    def update_by_text(
+        self,
+        document_id: str,
+        name: str,
+        text: str,
+        process_rule: Optional[Dict[str, Any]] = None,
+        dataset_id: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """
+        Replace the text of an existing document (re-indexed under the same ID).
+
+        Args:
+            document_id: Dify document ID
+            name: Document name (required by Dify together with text)
+            text: New document text
+            process_rule: Dify process rule (defaults to automatic)
+            dataset_id: Dataset ID (defaults to client dataset)
+
+        Returns:
+            Dify response containing 'document' and 'batch'
+        """
+        response = requests.post(
+            self._dataset_url(f"/documents/{document_id}/update-by-text", dataset_id),
+            headers=self._headers(),
+            json={
+                "name": name,
+                "text": text,
+                "process_rule": process_rule or {"mode": "automatic"}
+            },
+            timeout=self.timeout
+        )
+        response.raise_for_status()
+        return response.json()
+
+    def rename_document(
+        self,
+        document_id: str,
+        name: str,
+        text: str,
+        process_rule: Optional[Dict[str, Any]] = None,
+        dataset_id: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """
+        Rename a document, replacing its text (whose header names the path).
+
+        Uses update-by-text with name and text, which keeps the document ID.
+        If Dify rejects it (or the document is gone), the document is
+        deleted and created again under the new name.
+
+        Args:
+            document_id: Dify document ID
+            name: New document name (relative path)
+            text: Document text rendered for the new name
+            process_rule: Dify process rule (defaults to automatic)
+            dataset_id: Dataset ID (defaults to client dataset)
+
+        Returns:
+            Dify response containing 'document' (a new ID after the fallback)
+        """
+        try:
+            return self.update_by_text(document_id, name, text, process_rule, dataset_id)
+        except requests.HTTPError as e:
+            if e.response is None or e.response.status_code >= 500:
+                raise
+
+        try:
+            self.delete_document(document_id, dataset_id)
+        except requests.HTTPError as e:
+            if e.response is None or e.response.status_code != 404:
+                raise
+        return self.create_by_text(name, text, process_rule, dataset_id)
+
+    def delete_document(
+        self,
+        document_id: str,
+        dataset_id: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """
+        Delete a document.
+
+        Args:
+            document_id: Dify document ID
+            dataset_id: Dataset ID (defaults to client dataset)
+
+        Returns:
+            Dify response
+        """
+        response = requests.delete(
+            self._dataset_url(f"/documents/{document_id}", dataset_id),
+            headers=self._headers(),
+            timeout=self.timeout
+        )
+        response.raise_for_status()
+        return response.json() if response.content else {}
+
+
+def get_dify_client(
+    api_key: Optional[str] = None,
+    dataset_id: Optional[str] = None
+) -> DifyClient:
+    """
+    Factory function to create DifyClient instance.
+
+    Args:
+        api_key: Knowledge API key (uses env var if not provided)
+        dataset_id: Dataset ID (uses env var if not provided)
+
+    Returns:
+        DifyClient instance
+    """
+    return DifyClient(api_key=api_key, dataset_id=dataset_id)
+
+
+# For standalone usage
+if __name__ == "__main__":
+    import sys
+
+    client = get_dify_client()
+
+    if len(sys.argv) >= 2 and sys.argv[1] == "list":
+        docs = client.list_documents()
+        print(json.dumps(
+            [{"id": d.get("id"), "name": d.get("name")} for d in docs],
+            ensure_ascii=False,
+            indent=2
+        ))
+    else:
+        print("Usage: python dify_client.py list")
+        print("\nEnvironment variables:")
+        print("  DIFY_API_URL - Dify service API URL (default: http://dify-api:5001/v1)")
+        print("  DIFY_KNOWLEDGE_API_KEY - Knowledge API key")
+        print("  DIFY_DATASET_ID - Target dataset ID")
+        sys.exit(1)
@@ -0,0 +1,168 @@
+"""
+Directory Scanner for DocuSearch_AI
+Metadata-only listing of the watch folders.
+
+- os.scandir: names and file types come from the directory listing, plus
+  one stat() per matching file; file contents are never opened
+- Subdirectories are scanned in parallel by a thread pool (directory
+  reads and stats release the GIL, which matters on network mounts)
+- Results are streamed (generator or JSONL) as path, size, mtime and
+  inode, so scan time and memory do not depend on file sizes
+- Same extension globs as folder_sync / the n8n folder monitor
+"""
+
+import os
+import json
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, Iterator, List, NamedTuple, TextIO
+
+
+DEFAULT_SCAN_WORKERS = 8
+
+_DONE = object()
+
+
+def has_extension(name: str, extensions: Iterable[str]) -> bool:
+    """Check whether a file name ends with one of the extensions (case-insensitive)."""
+    lower = name.lower()
+    return any(lower.endswith(f".{ext}") for ext in extensions)
+
+
+class ScannedFile(NamedTuple):
+    """
+    One file found by scan_files.
+
+    Field names follow os.stat_result, so an entry can be passed wherever
+    hash_cache expects a stat result.
+    """
+
+    path: str
+    relative_path: str
+    st_size: int
+    st_mtime_ns: int
+    st_ino: int
+    st_dev: int
+
+    def as_dict(self) -> dict:
+        """JSON form (relative path as used for Dify document names)."""
+        return {
+            "path": self.path,
+            "relativePath": self.relative_path,
+            "size": self.st_size,
+            "mtime_ns": self.st_mtime_ns,
+            "inode": self.st_ino,
+            "device": self.st_dev
+        }
+
+
+def scan_files(
+    watch_root: str,
+    subdir: str,
+    extensions: Iterable[str],
+    max_workers: int = DEFAULT_SCAN_WORKERS
+) -> Iterator[ScannedFile]:
+    """
+    Stream files under watch_root/subdir matching the extensions.
+
+    Directories are listed concurrently; files are yielded in no
+    particular order as soon as their directory has been read.
+
+    Args:
+        watch_root: Watch root (e.g. /watch)
+        subdir: Sub directory ('images' or 'documents')
+        extensions: Allowed extensions without dot
+        max_workers: Threads listing directories
+
+    Yields:
+        ScannedFile entries (relative paths use '/')
+    """
+    suffixes = tuple(f".{ext.lower()}" for ext in extensions)
+    watch_root = watch_root.rstrip('/')
+    results: "queue.Queue" = queue.Queue()
+    lock = threading.Lock()
+    outstanding = [1]
+    stopped = threading.Event()
+    pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="scan")
+
+    def finish():
+        with lock:
+            outstanding[0] -= 1
+            if outstanding[0] == 0:
+                results.put(_DONE)
+
+    def walk(directory: str, relative_dir: str):
+        batch: List[ScannedFile] = []
+        try:
+            if stopped.is_set():
+                return
+            prefix = f"{relative_dir}/" if relative_dir else ""
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    if stopped.is_set():
+                        break
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            with lock:
+                                outstanding[0] += 1
+                            pool.submit(walk, entry.path, prefix + entry.name)
+                        elif entry.name.lower().endswith(suffixes) and entry.is_file():
+                            st = entry.stat()
+                            batch.append(ScannedFile(
+                                entry.path, prefix + entry.name,
+                                st.st_size, st.st_mtime_ns, st.st_ino, st.st_dev
+                            ))
+                    except OSError:
+                        # Vanished or unreadable while scanning
+                        continue
+        except OSError:
+            pass
+        finally:
+            if batch:
+                results.put(batch)
+            finish()
+
+    pool.submit(walk, os.path.join(watch_root, subdir), subdir.strip('/'))
+    try:
+        while True:
+            batch = results.get()
+            if batch is _DONE:
+                break
+            yield from batch
+    finally:
+        stopped.set()
+        pool.shutdown(wait=True)
+
+
+def write_jsonl(entries: Iterable[ScannedFile], out: TextIO) -> int:
+    """
+    Write entries as JSON lines.
+
+    Returns:
+        Number of entries written
+    """
+    count = 0
+    for entry in entries:
+        out.write(json.dumps(entry.as_dict(), ensure_ascii=False) + "\n")
+        count += 1
+    return count
+
+
+# For standalone usage
+if __name__ == "__main__":
+    import sys
+
+    from folder_sync import MEDIA_TYPES, WATCH_ROOT
+
+    watch_root = sys.argv[1] if len(sys.argv) > 1 else WATCH_ROOT
+    media_types = sys.argv[2:] or list(MEDIA_TYPES)
+
+    if any(media_type not in MEDIA_TYPES for media_type in media_types):
+        print("Usage: python dir_scanner.py [watch_root] [image|document ...]")
+        print("Example: python dir_scanner.py /watch image > images.jsonl")
+        sys.exit(1)
+
+    for media_type in media_types:
+        subdir, extensions, _ = MEDIA_TYPES[media_type]
+        write_jsonl(scan_files(watch_root, subdir, extensions), sys.stdout)
@@ -1,6 +1,7 @@
 """
 EXIF Metadata Extractor for DocuSearch_AI
 Extracts datetime and GPS coordinates from images.
+Supports JPEG, PNG, WebP and HEIC/HEIF without decoding pixels.
 """
 
 from PIL import Image
@@ -9,6 +10,13 @@ import io
 import json
 from typing import Dict, Any, Tuple, Optional
 
+from metadata_reader import detect_container, find_exif_payload, map_file
+
+
+# IFD pointer tags inside IFD0
+EXIF_IFD_POINTER = 0x8769
+GPS_IFD_POINTER = 0x8825
+
 
 def dms_to_decimal(dms: Tuple, ref: str) -> float:
     """
@@ -39,10 +47,156 @@ def dms_to_decimal(dms: Tuple, ref: str) -> float:
     return round(decimal, 6)
 
 
+def _empty_result() -> Dict[str, Any]:
+    """Create the result dictionary shared by all extraction paths."""
+    return {
+        "datetime": None,
+        "datetime_original": None,
+        "latitude": None,
+        "longitude": None,
+        "altitude": None,
+        "has_gps": False,
+        "camera_make": None,
+        "camera_model": None,
+        "orientation": 1,
+        "error": None
+    }
+
+
+def _parse_exif_tags(exif_data: Dict[int, Any], result: Dict[str, Any]) -> None:
+    """
+    Parse a flat EXIF tag dictionary (as returned by _getexif) into result.
+
+    Args:
+        exif_data: Mapping of tag ID to value, with GPSInfo as a nested mapping
+        result: Result dictionary to update in place
+    """
+    # Parse standard EXIF tags
+    for tag_id, value in exif_data.items():
+        tag_name = TAGS.get(tag_id, str(tag_id))
+
+        if tag_name == "DateTime":
+            result["datetime"] = value
+        elif tag_name == "DateTimeOriginal":
+            result["datetime_original"] = value
+        elif tag_name == "Make":
+            result["camera_make"] = str(value).strip()
+        elif tag_name == "Model":
+            result["camera_model"] = str(value).strip()
+        elif tag_name == "Orientation":
+            result["orientation"] = value
+        elif tag_name == "GPSInfo":
+            # Parse GPS data
+            gps_data = {}
+            for gps_tag_id in value:
+                gps_tag_name = GPSTAGS.get(gps_tag_id, str(gps_tag_id))
+                gps_data[gps_tag_name] = value[gps_tag_id]
+
+            # Extract latitude
+            if "GPSLatitude" in gps_data and "GPSLatitudeRef" in gps_data:
+                try:
+                    result["latitude"] = dms_to_decimal(
+                        gps_data["GPSLatitude"],
+                        gps_data["GPSLatitudeRef"]
+                    )
+                except (TypeError, ValueError, ZeroDivisionError):
+                    pass
+
+            # Extract longitude
+            if "GPSLongitude" in gps_data and "GPSLongitudeRef" in gps_data:
+                try:
+                    result["longitude"] = dms_to_decimal(
+                        gps_data["GPSLongitude"],
+                        gps_data["GPSLongitudeRef"]
+                    )
+                except (TypeError, ValueError, ZeroDivisionError):
+                    pass
+
+            # Extract altitude
+            if "GPSAltitude" in gps_data:
+                try:
+                    alt = gps_data["GPSAltitude"]
+                    if isinstance(alt, tuple):
+                        result["altitude"] = float(alt[0]) / float(alt[1]) if alt[1] != 0 else None
+                    else:
+                        result["altitude"] = float(alt)
+
+                    # Check altitude reference (0 = above sea level, 1 = below)
+                    if gps_data.get("GPSAltitudeRef") == 1 and result["altitude"]:
+                        result["altitude"] = -result["altitude"]
+                except (TypeError, ValueError):
+                    pass
+
+            if result["latitude"] is not None and result["longitude"] is not None:
+                result["has_gps"] = True
+
+    # Use original datetime if available, otherwise use datetime
+    if result["datetime_original"]:
+        result["datetime"] = result["datetime_original"]
+
+    # Format datetime for consistency (YYYY:MM:DD HH:MM:SS -> YYYY-MM-DD HH:MM:SS)
+    if result["datetime"]:
+        try:
+            result["datetime"] = result["datetime"].replace(":", "-", 2)
+        except AttributeError:
+            pass
+
+
+def _exif_payload_to_tags(payload: bytes) -> Dict[int, Any]:
+    """
+    Decode a TIFF-structured EXIF payload into the flat layout of _getexif().
+
+    Only the IFD tables are parsed; no image is opened.
+    """
+    exif = Image.Exif()
+    exif.load(payload)
+
+    tags = dict(exif)
+    tags.update(exif.get_ifd(EXIF_IFD_POINTER))
+
+    gps_info = exif.get_ifd(GPS_IFD_POINTER)
+    if gps_info:
+        tags[GPS_IFD_POINTER] = gps_info
+    else:
+        tags.pop(GPS_IFD_POINTER, None)
+
+    return tags
+
+
+def parse_exif_payload(payload: bytes) -> Dict[str, Any]:
+    """
+    Extract metadata from a raw EXIF payload (TIFF header onwards).
+
+    Args:
+        payload: EXIF bytes as returned by metadata_reader.find_exif_payload
+
+    Returns:
+        Same dictionary as extract_exif
+    """
+    result = _empty_result()
+
+    try:
+        exif_data = _exif_payload_to_tags(payload)
+
+        if not exif_data:
+            result["error"] = "No EXIF data found"
+            return result
+
+        _parse_exif_tags(exif_data, result)
+
+    except Exception as e:
+        result["error"] = str(e)
+
+    return result
+
+
 def extract_exif(image_binary: bytes) -> Dict[str, Any]:
     """
     Extract EXIF metadata from image binary data.
 
+    JPEG, PNG, WebP and HEIC/HEIF are handled by walking container headers
+    (see metadata_reader); other formats fall back to Pillow.
+
     Args:
         image_binary: Raw image bytes
 
@@ -56,18 +210,15 @@ def extract_exif(image_binary: bytes) -> Dict[str, Any]:
         - camera_model: Camera model
         - orientation: Image orientation value
     """
-    result = {
-        "datetime": None,
-        "datetime_original": None,
-        "latitude": None,
-        "longitude": None,
-        "altitude": None,
-        "has_gps": False,
-        "camera_make": None,
-        "camera_model": None,
-        "orientation": 1,
-        "error": None
-    }
+    if detect_container(image_binary):
+        payload = find_exif_payload(image_binary)
+        if payload is None:
+            result = _empty_result()
+            result["error"] = "No EXIF data found"
+            return result
+        return parse_exif_payload(payload)
+
+    result = _empty_result()
 
     try:
         image = Image.open(io.BytesIO(image_binary))
@@ -77,75 +228,7 @@ def extract_exif(image_binary: bytes) -> Dict[str, Any]:
             result["error"] = "No EXIF data found"
             return result
 
-        # Parse standard EXIF tags
-        for tag_id, value in exif_data.items():
-            tag_name = TAGS.get(tag_id, str(tag_id))
-
-            if tag_name == "DateTime":
-                result["datetime"] = value
-            elif tag_name == "DateTimeOriginal":
-                result["datetime_original"] = value
-            elif tag_name == "Make":
-                result["camera_make"] = str(value).strip()
-            elif tag_name == "Model":
-                result["camera_model"] = str(value).strip()
-            elif tag_name == "Orientation":
-                result["orientation"] = value
-            elif tag_name == "GPSInfo":
-                # Parse GPS data
-                gps_data = {}
-                for gps_tag_id in value:
-                    gps_tag_name = GPSTAGS.get(gps_tag_id, str(gps_tag_id))
-                    gps_data[gps_tag_name] = value[gps_tag_id]
-
-                # Extract latitude
-                if "GPSLatitude" in gps_data and "GPSLatitudeRef" in gps_data:
-                    try:
-                        result["latitude"] = dms_to_decimal(
-                            gps_data["GPSLatitude"],
-                            gps_data["GPSLatitudeRef"]
-                        )
-                    except (TypeError, ValueError, ZeroDivisionError):
-                        pass
-
-                # Extract longitude
-                if "GPSLongitude" in gps_data and "GPSLongitudeRef" in gps_data:
-                    try:
-                        result["longitude"] = dms_to_decimal(
-                            gps_data["GPSLongitude"],
-                            gps_data["GPSLongitudeRef"]
-                        )
-                    except (TypeError, ValueError, ZeroDivisionError):
-                        pass
-
-                # Extract altitude
-                if "GPSAltitude" in gps_data:
-                    try:
-                        alt = gps_data["GPSAltitude"]
-                        if isinstance(alt, tuple):
-                            result["altitude"] = float(alt[0]) / float(alt[1]) if alt[1] != 0 else None
-                        else:
-                            result["altitude"] = float(alt)
-
-                        # Check altitude reference (0 = above sea level, 1 = below)
-                        if gps_data.get("GPSAltitudeRef") == 1 and result["altitude"]:
-                            result["altitude"] = -result["altitude"]
-                    except (TypeError, ValueError):
-                        pass
-
-                if result["latitude"] is not None and result["longitude"] is not None:
-                    result["has_gps"] = True
-
-        # Use original datetime if available, otherwise use datetime
-        if result["datetime_original"]:
-            result["datetime"] = result["datetime_original"]
-
-        # Format datetime for consistency (YYYY:MM:DD HH:MM:SS -> YYYY-MM-DD HH:MM:SS)
-        if result["datetime"]:
-            try:
-                result["datetime"] = result["datetime"].replace(":", "-", 2)
-            except AttributeError:
-                pass
+        _parse_exif_tags(exif_data, result)
 
     except Exception as e:
         result["error"] = str(e)
@@ -157,12 +240,29 @@ def extract_exif_from_file(file_path: str) -> Dict[str, Any]:
     """
     Extract EXIF metadata from an image file.
 
+    Known containers are read through a bounded mmap so only the header
+    pages are touched; other formats are read in full.
+
     Args:
         file_path: Path to the image file
 
     Returns:
         EXIF metadata dictionary
     """
+    try:
+        with map_file(file_path) as buf:
+            if detect_container(buf):
+                payload = find_exif_payload(buf)
+                if payload is None:
+                    result = _empty_result()
+                    result["error"] = "No EXIF data found"
+                    return result
+                return parse_exif_payload(payload)
+    except (OSError, ValueError) as e:
+        result = _empty_result()
+        result["error"] = str(e)
+        return result
+
     with open(file_path, 'rb') as f:
         image_binary = f.read()
     return extract_exif(image_binary)
@@ -0,0 +1,276 @@
+"""
+Folder Sync for DocuSearch_AI
+Compares the watch folders with the documents registered in Dify and
+produces add/update/rename/delete actions (Python port of local-folder-monitor.json).
+"""
+
+import os
+import json
+from typing import Optional, Dict, Any, List, Iterable
+
+from dify_client import DifyClient, get_dify_client
+from dir_scanner import ScannedFile, has_extension, scan_files
+from hash_cache import HashCache
+
+
+WATCH_ROOT = os.environ.get('LOCAL_WATCH_PATH', '/watch')
+
+# Same extension globs as the n8n folder monitor
+IMAGE_EXTENSIONS = ('jpg', 'jpeg', 'png', 'webp', 'heic', 'heif')
+DOCUMENT_EXTENSIONS = ('txt', 'md', 'mdx', 'pdf', 'html', 'htm', 'xlsx', 'xls', 'docx', 'csv', 'vtt', 'properties')
+
+# Extensions treated as documents when detecting deletions
+DOCUMENT_DELETE_EXTENSIONS = ('txt', 'md', 'mdx', 'csv', 'json', 'xml', 'html', 'htm', 'yaml', 'yml',
+                              'properties', 'pdf', 'docx', 'xlsx', 'xls', 'vtt')
+
+MEDIA_TYPES = {
+    "image": ("images", IMAGE_EXTENSIONS, IMAGE_EXTENSIONS),
+    "document": ("documents", DOCUMENT_EXTENSIONS, DOCUMENT_DELETE_EXTENSIONS),
+}
+
+
+def top_level_folder(relative_path: str) -> str:
+    """
+    Return the top-level watch folder of a file (fair-share group, shard key).
+
+    Examples:
+        images/2024-trip/IMG_1.jpg -> images/2024-trip
+        documents/minutes.md       -> documents
+    """
+    parts = relative_path.split('/')
+    return '/'.join(parts[:2]) if len(parts) > 2 else parts[0]
+
+
+def list_local_files(watch_root: str, subdir: str, extensions: Iterable[str]) -> List[str]:
+    """
+    List files under watch_root/subdir matching the extensions.
+
+    Metadata only (see dir_scanner.scan_files); no file is opened.
+
+    Args:
+        watch_root: Watch root (e.g. /watch)
+        subdir: Sub directory ('images' or 'documents')
+        extensions: Allowed extensions without dot
+
+    Returns:
+        Sorted relative paths from watch_root (e.g. images/2025/IMG_1234.jpg)
+    """
+    return sorted(entry.relative_path for entry in scan_files(watch_root, subdir, extensions))
+
+
+def diff_actions(
+    media_type: str,
+    local_paths: Iterable[str],
+    existing_docs: List[Dict[str, Any]],
+    watch_root: str = WATCH_ROOT
+) -> List[Dict[str, Any]]:
+    """
+    Compute add/delete actions for one media type.
+
+    Args:
+        media_type: 'image' or 'document'
+        local_paths: Relative paths currently in the watch folder
+        existing_docs: Documents registered in Dify (id, name)
+        watch_root: Watch root used to build absolute paths
+
+    Returns:
+        List of actions in the same shape as the n8n filter nodes:
+        {path, name, relativePath, type, action[, documentId]}
+    """
+    subdir, _, delete_extensions = MEDIA_TYPES[media_type]
+    existing = {doc.get("name") or "": doc.get("id") for doc in existing_docs}
+    current = set()
+    actions = []
+
+    for relative_path in local_paths:
+        current.add(relative_path)
+        if relative_path not in existing:
+            actions.append({
+                "path": f"{watch_root}/{relative_path}",
+                "name": os.path.basename(relative_path),
+                "relativePath": relative_path,
+                "type": media_type,
+                "action": "add"
+            })
+
+    for doc_name, doc_id in existing.items():
+        is_media = has_extension(doc_name, delete_extensions) or doc_name.startswith(f"{subdir}/")
+        if is_media and doc_name not in current:
+            actions.append({
+                "path": f"{watch_root}/{doc_name}",
+                "name": doc_name,
+                "relativePath": doc_name,
+                "type": media_type,
+                "action": "delete",
+                "documentId": doc_id
+            })
+
+    return actions
+
+
+class FolderSync:
+    """Plan sync actions between the watch folders and a Dify dataset (or its shards)."""
+
+    def __init__(
+        self,
+        watch_root: str = WATCH_ROOT,
+        client: Optional[DifyClient] = None,
+        hash_cache: Optional[HashCache] = None,
+        router=None
+    ):
+        """
+        Initialize folder sync.
+
+        Args:
+            watch_root: Watch root containing images/ and documents/
+            client: DifyClient instance (auto-created if None)
+            hash_cache: HashCache for content hashes and modification
+                        detection (names only if None)
+            router: shard_router.ShardRouter; documents of every shard are
+                    compared and actions carry their dataset (datasetId)
+        """
+        self.watch_root = watch_root.rstrip('/')
+        self.client = client or get_dify_client()
+        self.hash_cache = hash_cache
+        self.router = router
+
+    def plan(self) -> List[Dict[str, Any]]:
+        """
+        Compute add/update/rename/delete actions for images and documents.
+
+        Returns:
+            List of action dictionaries
+        """
+        if self.router:
+            existing_docs = self.router.list_documents(self.client)
+        else:
+            existing_docs = self.client.list_documents()
+        actions = []
+
+        for media_type, (subdir, extensions, _) in MEDIA_TYPES.items():
+            # One metadata-only scan; its stat data also feeds the hash cache
+            scanned = {entry.path: entry for entry in scan_files(self.watch_root, subdir, extensions)}
+            local_paths = sorted(entry.relative_path for entry in scanned.values())
+            media_actions = diff_actions(media_type, local_paths, existing_docs, self.watch_root)
+            if self.hash_cache:
+                media_actions = self._apply_hashes(media_type, local_paths, media_actions, existing_docs, scanned)
+            actions.extend(media_actions)
+
+        if self.router:
+            self.router.assign(actions, existing_docs)
+        return actions
+
+    def _apply_hashes(
+        self,
+        media_type: str,
+        local_paths: List[str],
+        actions: List[Dict[str, Any]],
+        existing_docs: List[Dict[str, Any]],
+        scanned: Optional[Dict[str, ScannedFile]] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        Attach content hashes to add actions and detect modified files.
+
+        Files already in Dify whose content differs from the digest last
+        submitted for indexing become 'update' actions. A touch or copy
+        keeps the digest, so it causes no work. Unchanged files are
+        answered from the stat cache without being read; with scanner
+        entries they are not even stat'ed again.
+        """
+        scanned = scanned or {}
+        # Where each new file was last seen (same inode), before hashing updates it
+        known_paths = {
+            action["path"]: self.hash_cache.known_path(action["path"], scanned.get(action["path"]))
+            for action in actions if action["action"] == "add"
+        }
+        digests = self.hash_cache.hash_files([f"{self.watch_root}/{p}" for p in local_paths], scanned)
+        existing = {doc.get("name") or "": doc.get("id") for doc in existing_docs}
+
+        for action in actions:
+            if action["action"] == "add" and action["path"] in digests:
+                action["content_hash"] = digests[action["path"]]
+
+        for relative_path in local_paths:
+            digest = digests.get(f"{self.watch_root}/{relative_path}")
+            if digest is None or relative_path not in existing:
+                continue
+
+            previous = self.hash_cache.indexed_digest(relative_path)
+            if previous is None:
+                # First pass over a document indexed elsewhere: record a baseline
+                self.hash_cache.set_indexed(relative_path, digest)
+            elif previous != digest:
+                actions.append({
+                    "path": f"{self.watch_root}/{relative_path}",
+                    "name": os.path.basename(relative_path),
+                    "relativePath": relative_path,
+                    "type": media_type,
+                    "action": "update",
+                    "documentId": existing[relative_path],
+                    "content_hash": digest
+                })
+
+        return self._pair_moves(actions, known_paths)
+
+    def _pair_moves(
+        self,
+        actions: List[Dict[str, Any]],
+        known_paths: Dict[str, Optional[str]]
+    ) -> List[Dict[str, Any]]:
+        """
+        Turn delete + add pairs of the same file into 'rename' actions.
+
+        A new file pairs with a vanished document when it is the same inode
+        (moved within the filesystem) or has the digest last submitted for
+        that document (copied across filesystems). Renames reuse the
+        processed content, skipping captioning and geocoding; only the
+        document name and the path in its text change.
+        """
+        deletes = {a["path"]: a for a in actions if a["action"] == "delete"}
+        if not deletes:
+            return actions
+
+        submitted = {path: self.hash_cache.indexed_digest(a["relativePath"]) for path, a in deletes.items()}
+        by_digest: Dict[str, List[str]] = {}
+        for path, digest in submitted.items():
+            if digest:
+                by_digest.setdefault(digest, []).append(path)
+
+        paired = set()
+        result = []
+        for action in actions:
+            if action["action"] != "add" or not action.get("content_hash"):
+                result.append(action)
+                continue
+
+            digest = action["content_hash"]
+            old_path = known_paths.get(action["path"])
+            same_inode = old_path in deletes and old_path not in paired and submitted[old_path] in (None, digest)
+            if not same_inode:
+                old_path = next((p for p in by_digest.get(digest, []) if p not in paired), None)
+
+            if old_path is None:
+                result.append(action)
+                continue
+
+            paired.add(old_path)
+            old = deletes[old_path]
+            result.append({
+                **action,
+                "action": "rename",
+                "documentId": old["documentId"],
+                "oldRelativePath": old["relativePath"]
+            })
+
+        return [a for a in result if not (a["action"] == "delete" and a["path"] in paired)]
+
+
+# For standalone usage
+if __name__ == "__main__":
+    import sys
+
+    from hash_cache import get_hash_cache
+
+    watch_root = sys.argv[1] if len(sys.argv) > 1 else WATCH_ROOT
+    actions = FolderSync(watch_root=watch_root, hash_cache=get_hash_cache()).plan()
+    print(json.dumps(actions, ensure_ascii=False, indent=2))
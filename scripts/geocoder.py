@@ -5,10 +5,104 @@ Supports Nominatim (free) and Google Maps Geocoding API.
 """
 
 import os
+import math
 import time
 import json
+import threading
 import requests
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, List, Tuple, Sequence
+
+from deadline import Deadline, DeadlineExceeded
+from rate_limiter import SharedRateLimiter, get_rate_limiter
+from records import GeoResult
+from single_flight import SingleFlight
+
+
+METERS_PER_DEGREE = 111320.0
+
+
+def _distance_m(a: Tuple[float, float], b: Tuple[float, float]) -> float:
+    """Equirectangular distance in metres (accurate at clustering scales)."""
+    scale = math.cos(math.radians((a[0] + b[0]) / 2))
+    return METERS_PER_DEGREE * math.hypot(a[0] - b[0], (a[1] - b[1]) * scale)
+
+
+def cluster_points(
+    points: Sequence[Optional[Tuple[float, float]]],
+    radius_m: float = 50.0
+) -> List[List[int]]:
+    """
+    Group coordinates so that points within radius_m of each other share a cluster.
+
+    Single pass: points are hashed into a grid of cells at most
+    radius/sqrt(2) metres wide (longitude width is set per latitude row),
+    so points sharing a cell are always within the radius. Only cells in
+    neighbouring rows/columns need distance checks (single linkage, like
+    DBSCAN with min_samples=1).
+
+    Args:
+        points: (lat, lon) tuples; None entries are ignored
+        radius_m: Linking distance in metres
+
+    Returns:
+        Clusters as lists of indices into points
+    """
+    cell_m = radius_m / math.sqrt(2)
+    lat_step = cell_m / METERS_PER_DEGREE
+    widths: Dict[int, float] = {}
+    cells: Dict[Tuple[int, int], List[int]] = {}
+
+    def row_cos(row: int, widest: bool) -> float:
+        # cos(lat) at the row edge nearest to (widest) or farthest from the equator
+        edges = (abs(row * lat_step), abs((row + 1) * lat_step))
+        lat = min(edges) if widest else min(max(edges), 90.0)
+        return max(math.cos(math.radians(lat)), 1e-6)
+
+    def row_width(row: int) -> float:
+        if row not in widths:
+            # Narrowest where the row is widest in metres: cell never exceeds cell_m
+            widths[row] = cell_m / (METERS_PER_DEGREE * row_cos(row, widest=True))
+        return widths[row]
+
+    for i, point in enumerate(points):
+        if point is None:
+            continue
+        row = math.floor(point[0] / lat_step)
+        cells.setdefault((row, math.floor(point[1] / row_width(row))), []).append(i)
+
+    # Union-find over cells (members of a cell are always linked)
+    parent = {cell: cell for cell in cells}
+
+    def find(cell):
+        while parent[cell] != cell:
+            parent[cell] = parent[parent[cell]]
+            cell = parent[cell]
+        return cell
+
+    for cell, members in cells.items():
+        row, col = cell
+        width = row_width(row)
+        for other_row in range(row - 2, row + 3):
+            # Longitude reach of the radius at the poleward edge of both rows
+            reach = radius_m / (METERS_PER_DEGREE * min(row_cos(row, False), row_cos(other_row, False)))
+            other_width = row_width(other_row)
+            first = math.floor((col * width - reach) / other_width)
+            last = math.floor(((col + 1) * width + reach) / other_width)
+            for other_col in range(first, last + 1):
+                other = (other_row, other_col)
+                if other <= cell or other not in cells or find(other) == find(cell):
+                    continue
+                if any(
+                    _distance_m(points[a], points[b]) <= radius_m
+                    for a in members for b in cells[other]
+                ):
+                    parent[find(other)] = find(cell)
+
+    clusters: Dict[Tuple[int, int], List[int]] = {}
+    for cell, members in cells.items():
+        clusters.setdefault(find(cell), []).extend(members)
+
+    return [sorted(members) for members in clusters.values()]
 
 
 class Geocoder:
@@ -18,7 +112,8 @@ class Geocoder:
         self,
         provider: str = "nominatim",
         api_key: Optional[str] = None,
-        cache_enabled: bool = True
+        cache_enabled: bool = True,
+        rate_limiter: Optional[SharedRateLimiter] = None
     ):
         """
         Initialize geocoder.
@@ -27,32 +122,75 @@ class Geocoder:
             provider: 'nominatim' (free) or 'google' (requires API key)
             api_key: Google Maps API key (required for google provider)
             cache_enabled: Whether to cache results (in-memory)
+            rate_limiter: Limiter shared with other processes (per-process
+                          limiting if None)
         """
         self.provider = provider
         self.api_key = api_key or os.environ.get('GOOGLE_MAPS_API_KEY')
         self.cache_enabled = cache_enabled
-        self._cache: Dict[str, Dict[str, Any]] = {}
+        # Compact slotted records (raw provider data is not kept)
+        self._cache: Dict[str, GeoResult] = {}
         self.last_request_time = 0
         self.rate_limit_delay = 1.0  # Nominatim requires 1 req/sec
 
-    def _rate_limit(self):
-        """Enforce rate limiting for API calls."""
-        elapsed = time.time() - self.last_request_time
-        if elapsed < self.rate_limit_delay:
-            time.sleep(self.rate_limit_delay - elapsed)
-        self.last_request_time = time.time()
+        # Provider endpoints (overridable for self-hosted Nominatim or local stubs)
+        self.nominatim_endpoint = "https://nominatim.openstreetmap.org/reverse"
+        self.google_endpoint = "https://maps.googleapis.com/maps/api/geocode/json"
+        self.request_timeout = 10.0
+        self._rate_lock = threading.Lock()
+        self.rate_limiter = rate_limiter
+
+        # Concurrent lookups of the same point share one request
+        self.single_flight = SingleFlight()
+        self.last_batch_stats: Dict[str, int] = {}
+
+    def _rate_limit(self, deadline: Optional[Deadline] = None):
+        """
+        Enforce rate limiting for API calls (shared across threads, and
+        across processes with a rate_limiter).
+
+        Raises:
+            DeadlineExceeded: The wait for a request slot would outlast the deadline
+        """
+        if self.rate_limiter:
+            self.rate_limiter.acquire(deadline)
+            self.last_request_time = time.time()
+            return
+
+        if not self._rate_lock.acquire(timeout=max(deadline.remaining(), 0) if deadline else -1):
+            raise DeadlineExceeded("Deadline exceeded waiting for rate limit")
+        try:
+            wait = self.rate_limit_delay - (time.time() - self.last_request_time)
+            if wait > 0:
+                if deadline and not deadline.allows(wait):
+                    raise DeadlineExceeded("Deadline exceeded waiting for rate limit")
+                time.sleep(wait)
+            self.last_request_time = time.time()
+        finally:
+            self._rate_lock.release()
 
     def _get_cache_key(self, lat: float, lon: float) -> str:
         """Generate cache key from coordinates (rounded to 5 decimal places)."""
         return f"{round(lat, 5)}:{round(lon, 5)}"
 
-    def reverse_geocode(self, lat: float, lon: float) -> Dict[str, Any]:
+    def is_cached(self, lat: float, lon: float) -> bool:
+        """Check whether reverse_geocode would answer from the cache."""
+        return self.cache_enabled and self._get_cache_key(lat, lon) in self._cache
+
+    def reverse_geocode(
+        self,
+        lat: float,
+        lon: float,
+        deadline: Optional[Deadline] = None
+    ) -> Dict[str, Any]:
         """
         Convert coordinates to address.
 
         Args:
             lat: Latitude in decimal degrees
             lon: Longitude in decimal degrees
+            deadline: Budget for rate-limit waits and the request; when it
+                      runs out an error result is returned instead
 
         Returns:
             Dictionary containing:
@@ -66,26 +204,156 @@ class Geocoder:
             - raw: Raw response data
         """
         # Check cache
-        if self.cache_enabled:
-            cache_key = self._get_cache_key(lat, lon)
-            if cache_key in self._cache:
-                return self._cache[cache_key]
+        cache_key = self._get_cache_key(lat, lon)
+        if self.cache_enabled and cache_key in self._cache:
+            return self._cache[cache_key].to_dict()
 
-        # Call appropriate provider
-        if self.provider == "nominatim":
-            result = self._nominatim_reverse(lat, lon)
-        elif self.provider == "google":
-            result = self._google_reverse(lat, lon)
-        else:
-            raise ValueError(f"Unknown provider: {self.provider}")
+        if deadline and deadline.expired():
+            return self._deadline_result(lat, lon)
+
+        # Concurrent misses for the same point wait for one request
+        try:
+            return self.single_flight.do(
+                cache_key, self._lookup, lat, lon, cache_key, deadline,
+                timeout=deadline.remaining() if deadline else None
+            )
+        except TimeoutError:
+            return self._deadline_result(lat, lon)
+
+    async def reverse_geocode_async(
+        self,
+        lat: float,
+        lon: float,
+        deadline: Optional[Deadline] = None
+    ) -> Dict[str, Any]:
+        """
+        Async variant of reverse_geocode (request runs in the default executor).
+
+        Args:
+            lat: Latitude in decimal degrees
+            lon: Longitude in decimal degrees
+            deadline: Budget (see reverse_geocode)
+
+        Returns:
+            Same dictionary as reverse_geocode
+        """
+        cache_key = self._get_cache_key(lat, lon)
+        if self.cache_enabled and cache_key in self._cache:
+            return self._cache[cache_key].to_dict()
+
+        if deadline and deadline.expired():
+            return self._deadline_result(lat, lon)
+
+        try:
+            return await self.single_flight.do_async(
+                cache_key, self._lookup, lat, lon, cache_key, deadline,
+                timeout=deadline.remaining() if deadline else None
+            )
+        except TimeoutError:
+            return self._deadline_result(lat, lon)
+
+    def _deadline_result(self, lat: float, lon: float) -> Dict[str, Any]:
+        """Degraded result when the budget ran out."""
+        return {
+            "error": "Deadline exceeded",
+            "formatted": f"座標: {lat}, {lon}"
+        }
+
+    def reverse_geocode_batch(
+        self,
+        points: Sequence[Optional[Tuple[float, float]]],
+        radius_m: float = 50.0,
+        refine_outliers: bool = False,
+        outlier_m: Optional[float] = None
+    ) -> List[Optional[Dict[str, Any]]]:
+        """
+        Reverse geocode many coordinates with one request per place.
+
+        Points are clustered (see cluster_points), the member closest to
+        each cluster centroid is geocoded and its result is shared by all
+        members. Results are cached under every member's key, so later
+        reverse_geocode calls for these photos hit the cache.
+
+        Args:
+            points: (lat, lon) tuples; None entries (no GPS) yield None
+            radius_m: Clustering radius in metres
+            refine_outliers: Geocode members far from their representative
+                             individually (single linkage can chain along roads)
+            outlier_m: Distance from the representative that counts as an
+                       outlier (default: 2 * radius_m)
+
+        Returns:
+            Results aligned with points
+        """
+        outlier_m = outlier_m if outlier_m is not None else 2 * radius_m
+        results: List[Optional[Dict[str, Any]]] = [None] * len(points)
+        requests_before = self.single_flight.stats()["executed"]
+        clusters = cluster_points(points, radius_m)
+        refined = 0
+
+        for members in clusters:
+            centroid = (
+                sum(points[i][0] for i in members) / len(members),
+                sum(points[i][1] for i in members) / len(members)
+            )
+            representative = min(members, key=lambda i: _distance_m(points[i], centroid))
+            result = self.reverse_geocode(*points[representative])
+
+            for i in members:
+                if refine_outliers and _distance_m(points[i], points[representative]) > outlier_m:
+                    results[i] = self.reverse_geocode(*points[i])
+                    refined += 1
+                    continue
+                results[i] = result
+                if self.cache_enabled and "error" not in result:
+                    self._cache.setdefault(self._get_cache_key(*points[i]), GeoResult.from_dict(result))
+
+        self.last_batch_stats = {
+            "points": sum(1 for p in points if p is not None),
+            "clusters": len(clusters),
+            "refined": refined,
+            "requests": self.single_flight.stats()["executed"] - requests_before
+        }
+        return results
+
+    def _lookup(
+        self,
+        lat: float,
+        lon: float,
+        cache_key: str,
+        deadline: Optional[Deadline] = None
+    ) -> Dict[str, Any]:
+        """Call the provider and cache the result."""
+        if self.cache_enabled and cache_key in self._cache:
+            return self._cache[cache_key].to_dict()
+
+        result = self._fetch(lat, lon, deadline)
 
         # Cache result
         if self.cache_enabled and "error" not in result:
-            self._cache[cache_key] = result
+            self._cache[cache_key] = GeoResult.from_dict(result)
 
         return result
 
-    def _nominatim_reverse(self, lat: float, lon: float) -> Dict[str, Any]:
+    def _fetch(
+        self,
+        lat: float,
+        lon: float,
+        deadline: Optional[Deadline] = None
+    ) -> Dict[str, Any]:
+        """Call the configured provider (no cache)."""
+        if self.provider == "nominatim":
+            return self._nominatim_reverse(lat, lon, deadline)
+        if self.provider == "google":
+            return self._google_reverse(lat, lon, deadline)
+        raise ValueError(f"Unknown provider: {self.provider}")
+
+    def _nominatim_reverse(
+        self,
+        lat: float,
+        lon: float,
+        deadline: Optional[Deadline] = None
+    ) -> Dict[str, Any]:
         """
         Use OpenStreetMap Nominatim for reverse geocoding (free).
 
@@ -94,9 +362,10 @@ class Geocoder:
         - Valid User-Agent header
         - Attribution to OpenStreetMap
         """
-        self._rate_limit()
+        self._rate_limit(deadline)
+        timeout = deadline.timeout(self.request_timeout) if deadline else self.request_timeout
 
-        url = "https://nominatim.openstreetmap.org/reverse"
+        url = self.nominatim_endpoint
         params = {
             "lat": lat,
             "lon": lon,
@@ -110,7 +379,7 @@ class Geocoder:
         }
 
         try:
-            response = requests.get(url, params=params, headers=headers, timeout=10)
+            response = requests.get(url, params=params, headers=headers, timeout=timeout)
             response.raise_for_status()
             data = response.json()
 
@@ -138,7 +407,12 @@ class Geocoder:
                 "formatted": f"座標: {lat}, {lon}"
             }
 
-    def _google_reverse(self, lat: float, lon: float) -> Dict[str, Any]:
+    def _google_reverse(
+        self,
+        lat: float,
+        lon: float,
+        deadline: Optional[Deadline] = None
+    ) -> Dict[str, Any]:
         """
         Use Google Maps Geocoding API.
 
@@ -147,7 +421,9 @@ class Geocoder:
         if not self.api_key:
             raise ValueError("Google Maps API key required. Set GOOGLE_MAPS_API_KEY env var or pass api_key parameter.")
 
-        url = "https://maps.googleapis.com/maps/api/geocode/json"
+        timeout = deadline.timeout(self.request_timeout) if deadline else self.request_timeout
+
+        url = self.google_endpoint
         params = {
             "latlng": f"{lat},{lon}",
             "key": self.api_key,
@@ -156,7 +432,7 @@ class Geocoder:
         }
 
         try:
-            response = requests.get(url, params=params, timeout=10)
+            response = requests.get(url, params=params, timeout=timeout)
             response.raise_for_status()
             data = response.json()
 
@@ -224,6 +500,10 @@ def get_geocoder(provider: Optional[str] = None, api_key: Optional[str] = None)
     """
     Factory function to create geocoder instance.
 
+    Returns a hedged_geocoder.HedgedGeocoder (cache, offline data,
+    Nominatim hedged with Google) when GEOCODER_HEDGE is enabled and no
+    provider is given.
+
     Args:
         provider: 'nominatim' or 'google'. If None, auto-selects based on API key availability.
         api_key: Google Maps API key (optional)
@@ -233,18 +513,47 @@ def get_geocoder(provider: Optional[str] = None, api_key: Optional[str] = None)
     """
     api_key = api_key or os.environ.get('GOOGLE_MAPS_API_KEY')
 
+    if provider is None and os.environ.get('GEOCODER_HEDGE', '').lower() in ('1', 'true', 'yes'):
+        from hedged_geocoder import get_hedged_geocoder
+        return get_hedged_geocoder(api_key=api_key)
+
     if provider is None:
         # Auto-select based on API key availability
         provider = "google" if api_key else "nominatim"
 
-    return Geocoder(provider=provider, api_key=api_key)
+    rate_limiter = get_rate_limiter("nominatim", 1.0) if provider == "nominatim" else None
+    return Geocoder(provider=provider, api_key=api_key, rate_limiter=rate_limiter)
 
 
 # For standalone usage
 if __name__ == "__main__":
     import sys
 
-    if len(sys.argv) >= 3:
+    if len(sys.argv) >= 3 and sys.argv[1] == "batch":
+        from exif_extractor import extract_exif_from_file
+
+        image_dir = sys.argv[2]
+        files = sorted(
+            os.path.join(dirpath, name)
+            for dirpath, _, names in os.walk(image_dir)
+            for name in names
+        )
+        points = []
+        for file_path in files:
+            exif = extract_exif_from_file(file_path)
+            has_coords = exif.get("has_gps") and exif.get("latitude") and exif.get("longitude")
+            points.append((exif["latitude"], exif["longitude"]) if has_coords else None)
+
+        geocoder = get_geocoder()
+        results = geocoder.reverse_geocode_batch(points, refine_outliers="--refine" in sys.argv)
+        print(json.dumps({
+            "stats": geocoder.last_batch_stats,
+            "files": {
+                os.path.relpath(f, image_dir): r.get("formatted") if r else None
+                for f, r in zip(files, results)
+            }
+        }, ensure_ascii=False, indent=2))
+    elif len(sys.argv) >= 3:
         lat = float(sys.argv[1])
         lon = float(sys.argv[2])
         api_key = sys.argv[3] if len(sys.argv) > 3 else None
@@ -254,5 +563,6 @@ if __name__ == "__main__":
         print(json.dumps(result, ensure_ascii=False, indent=2))
     else:
         print("Usage: python geocoder.py <latitude> <longitude> [google_api_key]")
+        print("       python geocoder.py batch <image_dir> [--refine]")
         print("Example: python geocoder.py 35.6895 139.6917")
         sys.exit(1)
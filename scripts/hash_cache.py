@@ -0,0 +1,356 @@
+"""
+Content Hash Cache for DocuSearch_AI
+Fast change detection for the watch tree.
+
+- Files are hashed through mmap in large blocks (BLAKE2b), in a thread
+  pool across files (hashlib releases the GIL on large buffers)
+- Digests are cached persistently (SQLite) keyed on
+  (device, inode, size, mtime_ns): unchanged files are never re-read,
+  so a steady-state pass costs one stat() per file
+- The digest last submitted for indexing is remembered per path, which
+  separates real modifications from touches and copies (the sync
+  manifest; it also records the dataset shard of each path)
+- Processing results can be stored per digest so identical content is
+  not processed twice (compact records.ImageRecord bytes)
+"""
+
+import os
+import json
+import mmap
+import sqlite3
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Dict, Any, List, Tuple
+from dotenv import load_dotenv
+
+from records import ImageRecord
+
+
+# Load environment variables
+load_dotenv()
+
+DEFAULT_CACHE_PATH = os.environ.get('HASH_CACHE_PATH', 'hash_cache.sqlite3')
+
+HASH_BLOCK_SIZE = 8 * 1024 * 1024
+
+
+def hash_file(file_path: str, block_size: int = HASH_BLOCK_SIZE) -> str:
+    """
+    Hash a file via mmap in large blocks.
+
+    Args:
+        file_path: Path to the file
+        block_size: Bytes fed to the hash per update
+
+    Returns:
+        BLAKE2b-256 hex digest
+    """
+    digest = hashlib.blake2b(digest_size=32)
+
+    with open(file_path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if size == 0:
+            return digest.hexdigest()
+
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            view = memoryview(mapped)
+            try:
+                for offset in range(0, size, block_size):
+                    digest.update(view[offset:offset + block_size])
+            finally:
+                view.release()
+
+    return digest.hexdigest()
+
+
+def _stat_key(st: os.stat_result) -> Tuple[int, int, int, int]:
+    """Cache key of a stat result."""
+    return (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns)
+
+
+class HashCache:
+    """Persistent content hash cache keyed on file identity and stat data."""
+
+    def __init__(self, path: str = DEFAULT_CACHE_PATH, max_workers: int = 8):
+        """
+        Initialize hash cache.
+
+        Args:
+            path: SQLite database path (':memory:' for a throwaway cache)
+            max_workers: Threads used to hash files in parallel
+        """
+        self.path = path
+        self.max_workers = max_workers
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS file_hashes (
+                dev INTEGER, ino INTEGER, size INTEGER, mtime_ns INTEGER,
+                path TEXT, digest TEXT,
+                PRIMARY KEY (dev, ino)
+            );
+            CREATE TABLE IF NOT EXISTS indexed (
+                path TEXT PRIMARY KEY, digest TEXT, dataset_id TEXT
+            );
+            CREATE TABLE IF NOT EXISTS results (
+                digest TEXT PRIMARY KEY, result TEXT
+            );
+        """)
+        # Manifests written before sharding have no dataset column
+        columns = [row[1] for row in self._db.execute("PRAGMA table_info(indexed)")]
+        if "dataset_id" not in columns:
+            self._db.execute("ALTER TABLE indexed ADD COLUMN dataset_id TEXT")
+            self._db.commit()
+
+        # The whole stat table is kept in memory: lookups must be stat-time only
+        self._entries: Dict[Tuple[int, int], Tuple[int, int, str, str]] = {
+            (dev, ino): (size, mtime_ns, path, digest)
+            for dev, ino, size, mtime_ns, path, digest in self._db.execute(
+                "SELECT dev, ino, size, mtime_ns, path, digest FROM file_hashes"
+            )
+        }
+
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(self, file_path: str, st: Optional[os.stat_result] = None) -> Optional[str]:
+        """
+        Return the cached digest if the file is unchanged since it was hashed.
+
+        Args:
+            file_path: Path to the file
+            st: stat result (taken if not given)
+
+        Returns:
+            Digest or None if the file is new or changed
+        """
+        st = st or os.stat(file_path)
+        dev, ino, size, mtime_ns = _stat_key(st)
+        entry = self._entries.get((dev, ino))
+        if entry and entry[0] == size and entry[1] == mtime_ns:
+            return entry[3]
+        return None
+
+    def known_path(self, file_path: str, st: Optional[os.stat_result] = None) -> Optional[str]:
+        """
+        Path under which this file (same device and inode, unchanged) was last hashed.
+
+        A different path means the file was moved or renamed since.
+
+        Args:
+            file_path: Path to the file
+            st: stat result or dir_scanner.ScannedFile (taken if not given)
+        """
+        try:
+            st = st or os.stat(file_path)
+        except OSError:
+            return None
+        dev, ino, size, mtime_ns = _stat_key(st)
+        entry = self._entries.get((dev, ino))
+        if entry and entry[0] == size and entry[1] == mtime_ns:
+            return entry[2]
+        return None
+
+    def _store(self, file_path: str, st: os.stat_result, digest: str):
+        dev, ino, size, mtime_ns = _stat_key(st)
+        with self._lock:
+            self._entries[(dev, ino)] = (size, mtime_ns, file_path, digest)
+            self._db.execute(
+                "INSERT OR REPLACE INTO file_hashes VALUES (?, ?, ?, ?, ?, ?)",
+                (dev, ino, size, mtime_ns, file_path, digest)
+            )
+
+    def hash_file(self, file_path: str) -> str:
+        """
+        Get the digest of a single file, hashing only on cache miss.
+
+        Args:
+            file_path: Path to the file
+
+        Returns:
+            Hex digest
+        """
+        return self.hash_files([file_path])[file_path]
+
+    def hash_files(
+        self,
+        file_paths: List[str],
+        stats: Optional[Dict[str, os.stat_result]] = None
+    ) -> Dict[str, str]:
+        """
+        Get digests for many files.
+
+        Unchanged files are answered from the cache; changed or new files
+        are hashed in parallel.
+
+        Args:
+            file_paths: Paths to hash
+            stats: stat results (or dir_scanner.ScannedFile entries) already
+                   taken, by path; other paths are stat'ed here
+
+        Returns:
+            Mapping of path to hex digest (unreadable files are omitted)
+        """
+        digests: Dict[str, str] = {}
+        to_hash: List[Tuple[str, os.stat_result]] = []
+        moved = False
+        stats = stats or {}
+
+        for file_path in file_paths:
+            try:
+                st = stats.get(file_path) or os.stat(file_path)
+            except OSError:
+                continue
+
+            cached = self.lookup(file_path, st)
+            if cached:
+                digests[file_path] = cached
+                self.hits += 1
+                if self._entries[(st.st_dev, st.st_ino)][2] != file_path:
+                    # Moved: keep the inode entry pointing at the current path
+                    self._store(file_path, st, cached)
+                    moved = True
+            else:
+                to_hash.append((file_path, st))
+                self.misses += 1
+
+        if to_hash:
+            def work(item):
+                file_path, st = item
+                try:
+                    return file_path, st, hash_file(file_path)
+                except OSError:
+                    return file_path, st, None
+
+            if len(to_hash) == 1:
+                results = [work(to_hash[0])]
+            else:
+                with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+                    results = list(pool.map(work, to_hash))
+
+            for file_path, st, digest in results:
+                if digest is None:
+                    continue
+                digests[file_path] = digest
+                self._store(file_path, st, digest)
+
+        if to_hash or moved:
+            self.commit()
+
+        return digests
+
+    def indexed_digest(self, relative_path: str) -> Optional[str]:
+        """Digest last submitted for indexing under this path, if any."""
+        row = self._db.execute(
+            "SELECT digest FROM indexed WHERE path = ?", (relative_path,)
+        ).fetchone()
+        return row[0] if row else None
+
+    def indexed_dataset(self, relative_path: str) -> Optional[str]:
+        """Dataset (shard) the path was last submitted to, if recorded."""
+        row = self._db.execute(
+            "SELECT dataset_id FROM indexed WHERE path = ?", (relative_path,)
+        ).fetchone()
+        return row[0] if row else None
+
+    def indexed_datasets(self) -> Dict[str, str]:
+        """Path -> dataset of every path with a recorded shard."""
+        return dict(self._db.execute(
+            "SELECT path, dataset_id FROM indexed WHERE dataset_id IS NOT NULL"
+        ))
+
+    def set_indexed(self, relative_path: str, digest: Optional[str], dataset_id: Optional[str] = None):
+        """
+        Remember (or forget, if digest is None) the digest submitted for a path.
+
+        Args:
+            relative_path: Document name
+            digest: Content digest, or None to drop the entry
+            dataset_id: Dataset the path was submitted to (kept if None)
+        """
+        with self._lock:
+            if digest is None:
+                self._db.execute("DELETE FROM indexed WHERE path = ?", (relative_path,))
+            else:
+                self._db.execute(
+                    "INSERT INTO indexed (path, digest, dataset_id) VALUES (?, ?, ?) "
+                    "ON CONFLICT(path) DO UPDATE SET digest = excluded.digest, "
+                    "dataset_id = COALESCE(excluded.dataset_id, indexed.dataset_id)",
+                    (relative_path, digest, dataset_id)
+                )
+            self._db.commit()
+
+    def get_result(self, digest: str) -> Optional[Dict[str, Any]]:
+        """Return a stored processing result for this content, if any."""
+        row = self._db.execute(
+            "SELECT result FROM results WHERE digest = ?", (digest,)
+        ).fetchone()
+        if not row:
+            return None
+        # Caches written before records were used hold JSON text
+        return ImageRecord.from_bytes(row[0]).to_dict() if isinstance(row[0], bytes) else json.loads(row[0])
+
+    def put_result(self, digest: str, result: Dict[str, Any]):
+        """Store an image processing result for this content."""
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO results VALUES (?, ?)",
+                (digest, ImageRecord.from_dict(result).to_bytes())
+            )
+            self._db.commit()
+
+    def commit(self):
+        """Flush pending writes to disk."""
+        with self._lock:
+            self._db.commit()
+
+    def close(self):
+        """Commit and close the database."""
+        self.commit()
+        self._db.close()
+
+
+def get_hash_cache(path: Optional[str] = None) -> HashCache:
+    """
+    Factory function to create HashCache instance.
+
+    Args:
+        path: SQLite path (uses HASH_CACHE_PATH env var if not provided)
+
+    Returns:
+        HashCache instance
+    """
+    return HashCache(path=path or DEFAULT_CACHE_PATH)
+
+
+# For standalone usage
+if __name__ == "__main__":
+    import sys
+    import time
+
+    if len(sys.argv) >= 2:
+        root = sys.argv[1]
+        paths = [
+            os.path.join(dirpath, name)
+            for dirpath, _, names in os.walk(root)
+            for name in names
+        ]
+
+        cache = get_hash_cache()
+        start = time.time()
+        digests = cache.hash_files(paths)
+        elapsed = time.time() - start
+
+        print(json.dumps({
+            "files": len(digests),
+            "cache_hits": cache.hits,
+            "hashed": cache.misses,
+            "seconds": round(elapsed, 3)
+        }, ensure_ascii=False, indent=2))
+        cache.close()
+    else:
+        print("Usage: python hash_cache.py <directory>")
+        print("\nEnvironment variables:")
+        print("  HASH_CACHE_PATH - SQLite cache path (default: hash_cache.sqlite3)")
+        sys.exit(1)
@@ -0,0 +1,465 @@
+"""
+Hedged Reverse Geocoding for DocuSearch_AI
+Composite geocoder that keeps slow provider calls off the critical path.
+
+- Cheapest source first: in-memory cache, then offline place data
+  (GeoNames dump, if configured), then the primary provider (Nominatim)
+- When the primary has not answered within its recent p90 latency, a
+  hedged request goes to the secondary provider (Google); the first good
+  answer wins and the other call is cancelled (dropped before it is sent,
+  its result discarded if already in flight)
+- A primary error fails over to the secondary at once
+- Per-provider latency percentiles, hedge rate and the extra cost of
+  hedged requests are kept for stats
+"""
+
+import os
+import json
+import math
+import time
+import threading
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Optional, Dict, Any, List, Tuple
+
+from dotenv import load_dotenv
+
+from deadline import Deadline
+from geocoder import METERS_PER_DEGREE, Geocoder, _distance_m
+from rate_limiter import get_rate_limiter
+
+
+# Load environment variables
+load_dotenv()
+
+# Cost per request (USD) used for the hedging overhead (GEOCODER_COSTS overrides)
+DEFAULT_PROVIDER_COSTS = {"nominatim": 0.0, "google": 0.005}
+
+CJK_RANGES = ((0x3040, 0x30ff), (0x3400, 0x4dbf), (0x4e00, 0x9fff))
+
+
+def _is_japanese(name: str) -> bool:
+    """Whether a name contains kana or kanji."""
+    return any(low <= ord(ch) <= high for ch in name for low, high in CJK_RANGES)
+
+
+def _percentile(samples, pct: float) -> Optional[float]:
+    """Nearest-rank percentile of a sample collection."""
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, max(0, int(math.ceil(pct / 100.0 * len(ordered))) - 1))]
+
+
+class OfflinePlaces:
+    """
+    Nearest populated place from a GeoNames dump (e.g. cities500.txt).
+
+    admin1CodesASCII.txt and countryInfo.txt next to the dump, if present,
+    supply prefecture and country names. Answers are city level, so only
+    places within radius_m count.
+    """
+
+    def __init__(self, path: str, radius_m: float = 1000.0, cell_deg: float = 0.1):
+        """
+        Load the place index.
+
+        Args:
+            path: GeoNames tab-separated dump
+            radius_m: Maximum distance to the nearest place
+            cell_deg: Grid cell size in degrees
+        """
+        self.radius_m = radius_m
+        self.cell_deg = cell_deg
+        self._cells: Dict[Tuple[int, int], List[Tuple[float, float, str, str, str, str]]] = {}
+        self.places = 0
+
+        directory = os.path.dirname(path)
+        admin1 = self._read_names(os.path.join(directory, "admin1CodesASCII.txt"), 0, 1)
+        countries = self._read_names(os.path.join(directory, "countryInfo.txt"), 0, 4)
+
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                fields = line.rstrip("\n").split("\t")
+                if len(fields) < 11:
+                    continue
+                # Prefer the Japanese spelling among the alternate names
+                name = next((alt for alt in fields[3].split(",") if _is_japanese(alt)), fields[1])
+                lat, lon = float(fields[4]), float(fields[5])
+                country_code = fields[8]
+                place = (
+                    lat, lon, name,
+                    countries.get(country_code, country_code),
+                    admin1.get(f"{country_code}.{fields[10]}", ""),
+                    fields[0]
+                )
+                self._cells.setdefault(self._cell(lat, lon), []).append(place)
+                self.places += 1
+
+    @staticmethod
+    def _read_names(path: str, key_field: int, name_field: int) -> Dict[str, str]:
+        """Code -> name table of a GeoNames side file (empty if missing)."""
+        names = {}
+        if not os.path.exists(path):
+            return names
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                if line.startswith("#"):
+                    continue
+                fields = line.rstrip("\n").split("\t")
+                if len(fields) > max(key_field, name_field):
+                    names[fields[key_field]] = fields[name_field]
+        return names
+
+    def _cell(self, lat: float, lon: float) -> Tuple[int, int]:
+        return (int(math.floor(lat / self.cell_deg)), int(math.floor(lon / self.cell_deg)))
+
+    def lookup(self, lat: float, lon: float) -> Optional[Dict[str, Any]]:
+        """
+        Nearest place within radius_m.
+
+        Returns:
+            Result in the reverse_geocode format, or None
+        """
+        row, col = self._cell(lat, lon)
+        cos_lat = max(math.cos(math.radians(lat)), 0.01)
+        rows = int(math.ceil(self.radius_m / (METERS_PER_DEGREE * self.cell_deg)))
+        cols = int(math.ceil(self.radius_m / (METERS_PER_DEGREE * self.cell_deg * cos_lat)))
+
+        best = None
+        best_distance = self.radius_m
+        for r in range(row - rows, row + rows + 1):
+            for c in range(col - cols, col + cols + 1):
+                for place in self._cells.get((r, c), ()):
+                    distance = _distance_m((lat, lon), place[:2])
+                    if distance <= best_distance:
+                        best, best_distance = place, distance
+
+        if best is None:
+            return None
+        _, _, name, country, prefecture, geonameid = best
+        parts = [part for part in (country, prefecture, name) if part]
+        return {
+            "full_address": ", ".join(parts),
+            "country": country,
+            "prefecture": prefecture,
+            "city": name,
+            "town": "",
+            "landmark": "",
+            "formatted": ", ".join(parts),
+            "raw": {"geonameid": geonameid, "distance_m": round(best_distance, 1)}
+        }
+
+
+class ProviderStats:
+    """Call counts and recent latencies of one provider."""
+
+    def __init__(self, cost: float = 0.0, sample_size: int = 200):
+        self.cost = cost
+        self.latencies = deque(maxlen=sample_size)
+        self.sent = 0
+        self.errors = 0
+        self.wins = 0
+        self.cancelled = 0
+
+    def to_dict(self) -> Dict[str, Any]:
+        def ms(pct):
+            value = _percentile(self.latencies, pct)
+            return round(value * 1000, 1) if value is not None else None
+
+        return {
+            "sent": self.sent,
+            "errors": self.errors,
+            "wins": self.wins,
+            "cancelled": self.cancelled,
+            "p50_ms": ms(50),
+            "p90_ms": ms(90),
+            "p99_ms": ms(99),
+            "cost": round(self.sent * self.cost, 4)
+        }
+
+
+class HedgedGeocoder(Geocoder):
+    """
+    Cache -> offline data -> primary provider, hedged with a secondary.
+
+    Drop-in for Geocoder: caching, single-flight coalescing and batch
+    clustering are inherited; only the provider call (_fetch) differs.
+    """
+
+    def __init__(
+        self,
+        primary: Geocoder,
+        secondary: Optional[Geocoder] = None,
+        offline: Optional[OfflinePlaces] = None,
+        hedge_percentile: float = 90.0,
+        default_delay: float = 1.0,
+        min_delay: float = 0.05,
+        min_samples: int = 20,
+        sample_size: int = 200,
+        costs: Optional[Dict[str, float]] = None,
+        max_workers: int = 32,
+        cache_enabled: bool = True
+    ):
+        """
+        Initialize hedged geocoder.
+
+        Args:
+            primary: Provider asked first (its own cache should be off)
+            secondary: Provider for hedged and failover requests (None: no hedging)
+            offline: Offline place data answered before any provider
+            hedge_percentile: Primary latency percentile used as hedge delay
+            default_delay: Hedge delay until min_samples latencies are known
+            min_delay: Lower bound of the hedge delay in seconds
+            min_samples: Primary latencies needed before the percentile is used
+            sample_size: Latencies kept per provider
+            costs: Provider name -> cost per request (DEFAULT_PROVIDER_COSTS)
+            max_workers: Threads running provider calls (abandoned calls
+                         keep a thread until their request times out)
+            cache_enabled: Whether to cache results (in-memory)
+        """
+        super().__init__(provider="hedged", cache_enabled=cache_enabled)
+        self.primary = primary
+        self.secondary = secondary
+        self.offline = offline
+        self.hedge_percentile = hedge_percentile
+        self.default_delay = default_delay
+        self.min_delay = min_delay
+        self.min_samples = min_samples
+        self.request_timeout = max(g.request_timeout for g in (primary, secondary) if g)
+
+        costs = {**DEFAULT_PROVIDER_COSTS, **(costs or {})}
+        self.providers = {
+            "primary": ProviderStats(costs.get(primary.provider, 0.0), sample_size),
+            "secondary": ProviderStats(costs.get(secondary.provider, 0.0) if secondary else 0.0, sample_size)
+        }
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="geocode")
+        self._stats_lock = threading.Lock()
+        self.lookups = 0
+        self.offline_hits = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.failovers = 0
+        self.hedge_cost = 0.0
+
+    def hedge_delay(self) -> float:
+        """Seconds to wait for the primary before hedging (recent p90)."""
+        with self._stats_lock:
+            samples = list(self.providers["primary"].latencies)
+        if len(samples) < self.min_samples:
+            return self.default_delay
+        return min(max(_percentile(samples, self.hedge_percentile), self.min_delay), self.request_timeout)
+
+    def _call(
+        self,
+        role: str,
+        lat: float,
+        lon: float,
+        deadline: Optional[Deadline],
+        cancelled: threading.Event,
+        hedge: bool
+    ) -> Optional[Dict[str, Any]]:
+        """Run one provider call (None if cancelled before it was sent)."""
+        if cancelled.is_set():
+            return None
+        geocoder = self.primary if role == "primary" else self.secondary
+        stats = self.providers[role]
+        with self._stats_lock:
+            stats.sent += 1
+            if hedge:
+                self.hedge_cost += stats.cost
+
+        start = time.monotonic()
+        try:
+            result = geocoder._fetch(lat, lon, deadline)
+        except Exception as e:
+            result = {"error": str(e), "formatted": f"座標: {lat}, {lon}"}
+        elapsed = time.monotonic() - start
+
+        with self._stats_lock:
+            if "error" in result:
+                stats.errors += 1
+            else:
+                # Losers count too: the percentile must see the slow calls
+                stats.latencies.append(elapsed)
+        return result
+
+    def _fetch(
+        self,
+        lat: float,
+        lon: float,
+        deadline: Optional[Deadline] = None
+    ) -> Dict[str, Any]:
+        """Offline data, else race the primary against a delayed secondary."""
+        with self._stats_lock:
+            self.lookups += 1
+
+        if self.offline:
+            result = self.offline.lookup(lat, lon)
+            if result:
+                with self._stats_lock:
+                    self.offline_hits += 1
+                return result
+
+        cancelled = threading.Event()
+        children: Dict[Future, Tuple[str, Optional[Deadline]]] = {}
+
+        def launch(role: str, hedge: bool = False):
+            child = deadline.sub(deadline.remaining()) if deadline else None
+            future = self._pool.submit(self._call, role, lat, lon, child, cancelled, hedge)
+            children[future] = (role, child)
+
+        launch("primary")
+        delay = self.hedge_delay()
+        start = time.monotonic()
+        pending = set(children)
+        hedged = False
+        last_error = None
+        winner = None
+
+        while pending:
+            if self.secondary and len(children) == 1:
+                timeout = max(delay - (time.monotonic() - start), 0)
+            else:
+                timeout = max(deadline.remaining(), 0) if deadline else None
+
+            done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            if not done:
+                if self.secondary and len(children) == 1:
+                    # Primary is in its tail: hedge
+                    with self._stats_lock:
+                        self.hedges += 1
+                    hedged = True
+                    launch("secondary", hedge=True)
+                    pending = {f for f in children if not f.done()}
+                    continue
+                break
+
+            for future in done:
+                result = future.result()
+                if result and "error" not in result:
+                    winner = (children[future][0], result)
+                    break
+                last_error = result or last_error
+            if winner:
+                break
+            if self.secondary and len(children) == 1:
+                # Primary failed before the hedge delay: fail over now
+                with self._stats_lock:
+                    self.failovers += 1
+                launch("secondary")
+                pending = {f for f in children if not f.done()}
+
+        # Cancel the other call: dropped if not yet sent, its budget ended if waiting
+        cancelled.set()
+        for future, (role, child) in children.items():
+            if winner and role == winner[0]:
+                continue
+            if not future.done():
+                if child:
+                    child.cancel()
+                with self._stats_lock:
+                    self.providers[role].cancelled += 1
+
+        if winner is None:
+            if last_error is None:
+                return self._deadline_result(lat, lon)
+            return last_error
+
+        role, result = winner
+        with self._stats_lock:
+            self.providers[role].wins += 1
+            if hedged and role == "secondary":
+                self.hedge_wins += 1
+        return result
+
+    def stats(self) -> Dict[str, Any]:
+        """Per-provider latency and counts, hedge rate and hedging cost."""
+        delay = self.hedge_delay()
+        with self._stats_lock:
+            provider_lookups = self.lookups - self.offline_hits
+            return {
+                "lookups": self.lookups,
+                "offline_hits": self.offline_hits,
+                "hedge_delay_ms": round(delay * 1000, 1),
+                "hedges": self.hedges,
+                "hedge_rate": round(self.hedges / provider_lookups, 4) if provider_lookups else 0.0,
+                "hedge_wins": self.hedge_wins,
+                "failovers": self.failovers,
+                "hedge_cost": round(self.hedge_cost, 4),
+                "providers": {
+                    (geocoder.provider if geocoder else role): self.providers[role].to_dict()
+                    for role, geocoder in (("primary", self.primary), ("secondary", self.secondary))
+                    if geocoder
+                }
+            }
+
+
+def parse_costs(value: str) -> Dict[str, float]:
+    """Parse 'provider=cost,...'."""
+    costs = {}
+    for item in value.split(','):
+        name, _, cost = item.strip().partition('=')
+        if cost:
+            costs[name.strip()] = float(cost)
+    return costs
+
+
+def get_hedged_geocoder(api_key: Optional[str] = None) -> HedgedGeocoder:
+    """
+    Factory function to create HedgedGeocoder instance.
+
+    Nominatim is the primary, Google (with GOOGLE_MAPS_API_KEY) the
+    secondary. Uses GEOCODER_OFFLINE_PATH (GeoNames dump),
+    GEOCODER_OFFLINE_RADIUS_M, GEOCODER_HEDGE_PERCENTILE and
+    GEOCODER_COSTS (e.g. 'google=0.005').
+
+    Args:
+        api_key: Google Maps API key (optional)
+
+    Returns:
+        HedgedGeocoder instance
+    """
+    api_key = api_key or os.environ.get('GOOGLE_MAPS_API_KEY')
+    primary = Geocoder(
+        provider="nominatim", cache_enabled=False, rate_limiter=get_rate_limiter("nominatim", 1.0)
+    )
+    secondary = Geocoder(provider="google", api_key=api_key, cache_enabled=False) if api_key else None
+
+    offline = None
+    if os.environ.get('GEOCODER_OFFLINE_PATH'):
+        offline = OfflinePlaces(
+            os.environ['GEOCODER_OFFLINE_PATH'],
+            radius_m=float(os.environ.get('GEOCODER_OFFLINE_RADIUS_M', 1000))
+        )
+
+    return HedgedGeocoder(
+        primary,
+        secondary,
+        offline=offline,
+        hedge_percentile=float(os.environ.get('GEOCODER_HEDGE_PERCENTILE', 90)),
+        costs=parse_costs(os.environ.get('GEOCODER_COSTS', ''))
+    )
+
+
+# For standalone usage
+if __name__ == "__main__":
+    import sys
+
+    if len(sys.argv) < 3:
+        print("Usage: python hedged_geocoder.py <latitude> <longitude> [<latitude> <longitude> ...]")
+        print("\nEnvironment variables:")
+        print("  GOOGLE_MAPS_API_KEY - Secondary provider for hedged requests")
+        print("  GEOCODER_OFFLINE_PATH - GeoNames dump answered before Nominatim (e.g. cities500.txt)")
+        print("  GEOCODER_OFFLINE_RADIUS_M - Maximum distance to an offline place (default: 1000)")
+        print("  GEOCODER_HEDGE_PERCENTILE - Primary latency percentile used as hedge delay (default: 90)")
+        print("  GEOCODER_COSTS - Cost per request (e.g. google=0.005)")
+        sys.exit(1)
+
+    geocoder = get_hedged_geocoder()
+    coords = [float(value) for value in sys.argv[1:]]
+    results = [
+        geocoder.reverse_geocode(lat, lon).get("formatted")
+        for lat, lon in zip(coords[::2], coords[1::2])
+    ]
+    print(json.dumps({"results": results, "stats": geocoder.stats()}, ensure_ascii=False, indent=2))
@@ -1,17 +1,26 @@
 """
 Combined Image Processor for DocuSearch_AI
-Orchestrates EXIF extraction, geocoding, and prepares data for Dify indexing.
+Orchestrates EXIF extraction, geocoding, thumbnails, and prepares data for Dify indexing.
 """
 
 import os
 import json
+import io
 import base64
+import hashlib
 import requests
+from contextlib import nullcontext
 from typing import Dict, Any, Optional
 from dotenv import load_dotenv
 
+from autotuner import Autotuner, Slot
 from exif_extractor import extract_exif, extract_exif_from_file
 from geocoder import Geocoder, get_geocoder
+from deadline import Deadline, DEFAULT_BUDGET_SECONDS
+from hash_cache import HashCache
+from records import build_metadata_text, build_document_text
+from single_flight import SingleFlight
+from thumbnail_store import ThumbnailStore, get_thumbnail_store
 
 
 # Load environment variables
@@ -27,7 +36,10 @@ class ImageProcessor:
     def __init__(
         self,
         gemini_api_key: Optional[str] = None,
-        geocoder: Optional[Geocoder] = None
+        geocoder: Optional[Geocoder] = None,
+        hash_cache: Optional[HashCache] = None,
+        autotuner: Optional[Autotuner] = None,
+        thumbnails: Optional[ThumbnailStore] = None
     ):
         """
         Initialize image processor.
@@ -35,9 +47,28 @@ class ImageProcessor:
         Args:
             gemini_api_key: Gemini API key for vision analysis
             geocoder: Geocoder instance (auto-created if None)
+            hash_cache: HashCache for reusing results of identical files
+            autotuner: Adaptive concurrency limits for the exif, geocode,
+                       caption and thumbnail stages (unlimited if None)
+            thumbnails: ThumbnailStore the thumbnail stage writes to
+                        (no thumbnails if None)
         """
         self.gemini_api_key = gemini_api_key or os.environ.get('GEMINI_API_KEY')
         self.geocoder = geocoder or get_geocoder()
+        self.hash_cache = hash_cache
+        self.autotuner = autotuner
+        self.thumbnails = thumbnails
+
+        # Identical image bytes captioned concurrently share one Gemini call
+        self.single_flight = SingleFlight()
+
+        # Per-image latency budget and per-stage limits (seconds)
+        self.budget_seconds = float(os.environ.get('IMAGE_BUDGET_SECONDS', DEFAULT_BUDGET_SECONDS))
+        self.geocode_budget = 15.0
+        self.geocode_min_seconds = 2.0
+        self.caption_timeout = 30.0
+        self.caption_min_seconds = 5.0
+        self.caption_reserve_seconds = 10.0
 
         # Gemini API configuration
         self.gemini_endpoint = "https://generativelanguage.googleapis.com/v1beta/models/gemini-2.5-flash:generateContent"
@@ -69,19 +100,29 @@ class ImageProcessor:
         self,
         image_binary: bytes,
         filename: str,
-        generate_caption: bool = True
+        generate_caption: bool = True,
+        deadline: Optional[Deadline] = None,
+        content_hash: Optional[str] = None
     ) -> Dict[str, Any]:
         """
         Process an image file for indexing.
 
+        Stages use only the remaining budget; geocoding and the caption are
+        skipped (noted in warnings) when too little is left.
+
         Args:
             image_binary: Raw image bytes
             filename: Original filename
             generate_caption: Whether to generate vision caption
+            deadline: Latency budget (IMAGE_BUDGET_SECONDS from now if None)
+            content_hash: Digest keying the thumbnails (hashed from
+                          image_binary if None)
 
         Returns:
             Dictionary containing all extracted metadata and caption
         """
+        deadline = deadline or Deadline(self.budget_seconds)
+
         result = {
             "filename": filename,
             "datetime": None,
@@ -92,14 +133,18 @@ class ImageProcessor:
             "metadata_text": "",
             "full_document_text": "",
             "success": True,
-            "errors": []
+            "errors": [],
+            # Degraded optional stages (no EXIF, geocoding, caption, thumbnails):
+            # the result is still complete enough to cache
+            "warnings": []
         }
 
         # Step 1: Extract EXIF
-        exif = extract_exif(image_binary)
+        with self._stage("exif"):
+            exif = extract_exif(image_binary)
 
         if exif.get("error"):
-            result["errors"].append(f"EXIF extraction: {exif['error']}")
+            result["warnings"].append(f"EXIF extraction: {exif['error']}")
 
         # Parse datetime
         result["datetime"] = exif.get("datetime")
@@ -113,6 +158,11 @@ class ImageProcessor:
         if camera_parts:
             result["camera"] = " ".join(camera_parts)
 
+        # Step 1b: Thumbnails (once per content; reused for moved and copied files)
+        if self.thumbnails:
+            digest = content_hash or hashlib.blake2b(image_binary, digest_size=32).hexdigest()
+            self._add_thumbnails(result, digest, io.BytesIO(image_binary))
+
         # Step 2: Geocode if GPS available
         if exif.get("has_gps") and exif.get("latitude") and exif.get("longitude"):
             result["coordinates"] = {
@@ -120,25 +170,44 @@ class ImageProcessor:
                 "lon": exif["longitude"]
             }
 
-            try:
-                geo_result = self.geocoder.reverse_geocode(
-                    exif["latitude"],
-                    exif["longitude"]
-                )
-                if "error" not in geo_result:
-                    result["location"] = geo_result.get("formatted", "")
-                else:
-                    result["errors"].append(f"Geocoding: {geo_result['error']}")
-            except Exception as e:
-                result["errors"].append(f"Geocoding exception: {str(e)}")
+            # Leave the caption its minimum share of the budget
+            reserve = self.caption_reserve_seconds if generate_caption and self.gemini_api_key else 0
+            geocode_seconds = min(self.geocode_budget, deadline.remaining() - reserve)
+
+            if geocode_seconds < self.geocode_min_seconds:
+                deadline.skip("geocode")
+                result["warnings"].append("Geocoding skipped: deadline")
+            else:
+                try:
+                    # Cache hits skip the stage: they say nothing about the provider
+                    cached = self.geocoder.is_cached(exif["latitude"], exif["longitude"])
+                    with self._stage(None if cached else "geocode", geocode_seconds) as slot:
+                        geo_result = self.geocoder.reverse_geocode(
+                            exif["latitude"],
+                            exif["longitude"],
+                            deadline=deadline.sub(geocode_seconds)
+                        )
+                        if "error" in geo_result and geo_result["error"] != "No results found":
+                            slot.fail(geo_result["error"])
+                    if "error" not in geo_result:
+                        result["location"] = geo_result.get("formatted", "")
+                    else:
+                        result["warnings"].append(f"Geocoding: {geo_result['error']}")
+                except Exception as e:
+                    result["warnings"].append(f"Geocoding exception: {str(e)}")
 
         # Step 3: Generate vision caption
         if generate_caption and self.gemini_api_key:
-            try:
-                caption = self._generate_vision_caption(image_binary)
-                result["vision_caption"] = caption
-            except Exception as e:
-                result["errors"].append(f"Vision caption: {str(e)}")
+            if not deadline.allows(self.caption_min_seconds):
+                deadline.skip("caption")
+                result["warnings"].append("Vision caption skipped: deadline")
+            else:
+                try:
+                    with self._stage("caption", deadline.remaining()):
+                        caption = self._generate_vision_caption(image_binary, deadline)
+                    result["vision_caption"] = caption
+                except Exception as e:
+                    result["warnings"].append(f"Vision caption: {str(e)}")
 
         # Step 4: Build metadata text
         result["metadata_text"] = self._build_metadata_text(result)
@@ -151,37 +220,173 @@ class ImageProcessor:
 
         return result
 
+    def _add_thumbnails(self, result: Dict[str, Any], digest: str, source):
+        """
+        Store the thumbnails of an image and record their store keys in result.
+
+        Only the keys are kept (the URL depends on THUMBNAIL_BASE_URL, see
+        ThumbnailStore.url); they stay out of the indexed document text.
+
+        A failure is a warning: the result is still cached, and the
+        thumbnails are generated on its next reuse.
+        """
+        try:
+            with self._stage("thumbnail"):
+                keys = self.thumbnails.ensure(digest, source)
+            result["thumbnails"] = keys
+        except Exception as e:
+            result.pop("thumbnails", None)
+            result.setdefault("warnings", []).append(f"Thumbnails: {str(e)}")
+
+    def _stage(self, name: Optional[str], timeout: Optional[float] = None):
+        """Concurrency slot of a pipeline stage (no-op without autotuner or name)."""
+        if self.autotuner is None or name is None:
+            return nullcontext(Slot())
+        return self.autotuner.stage(name, timeout)
+
     def process_image_file(
         self,
         file_path: str,
-        generate_caption: bool = True
+        generate_caption: bool = True,
+        deadline: Optional[Deadline] = None
     ) -> Dict[str, Any]:
         """
         Process an image file from disk.
 
+        With a hash cache, a file whose content was already processed
+        (touched, copied or re-added) reuses the stored result instead of
+        calling geocoding and Gemini again; a result stored without a caption
+        only runs the caption stage. Its thumbnails are keyed by the same
+        digest, so they are only generated if missing. Results are stored
+        unless processing failed; degraded stages are only warnings.
+
         Args:
             file_path: Path to image file
             generate_caption: Whether to generate vision caption
+            deadline: Latency budget (see process_image)
 
         Returns:
             Processing result dictionary
         """
+        filename = os.path.basename(file_path)
+        digest = None
+
+        if self.hash_cache:
+            digest = self.hash_cache.hash_file(file_path)
+            cached = self.hash_cache.get_result(digest)
+            if cached and generate_caption and self.gemini_api_key and not cached.get("vision_caption"):
+                # Stored without a caption: only the caption stage runs
+                return self._caption_cached(cached, digest, file_path, deadline)
+            if cached:
+                cached["filename"] = filename
+                cached["warnings"] = []
+                if self.thumbnails:
+                    self._add_thumbnails(cached, digest, file_path)
+                cached["metadata_text"] = self._build_metadata_text(cached)
+                cached["full_document_text"] = self._build_document_text(cached)
+                return cached
+
         with open(file_path, 'rb') as f:
             image_binary = f.read()
 
-        filename = os.path.basename(file_path)
-        return self.process_image(image_binary, filename, generate_caption)
+        result = self.process_image(image_binary, filename, generate_caption, deadline, digest)
+
+        if digest:
+            result["content_hash"] = digest
+            if result["success"]:
+                self.hash_cache.put_result(digest, result)
+
+        return result
+
+    def caption_image_file(self, file_path: str, deadline: Optional[Deadline] = None) -> Dict[str, Any]:
+        """
+        Add the vision caption to an image processed without one.
+
+        Only the caption stage runs: date, location and thumbnails come from
+        the stored result of the first pass (hash cache), and the captioned
+        result replaces it. Without a stored result the image is processed
+        in full.
+
+        Args:
+            file_path: Path to image file
+            deadline: Latency budget (IMAGE_BUDGET_SECONDS from now if None)
 
-    def _generate_vision_caption(self, image_binary: bytes) -> str:
+        Returns:
+            Processing result dictionary (see process_image)
+        """
+        digest = self.hash_cache.hash_file(file_path) if self.hash_cache else None
+        result = self.hash_cache.get_result(digest) if digest else None
+        if result is None:
+            return self.process_image_file(file_path, generate_caption=True, deadline=deadline)
+
+        return self._caption_cached(result, digest, file_path, deadline)
+
+    def _caption_cached(
+        self,
+        result: Dict[str, Any],
+        digest: str,
+        file_path: str,
+        deadline: Optional[Deadline] = None
+    ) -> Dict[str, Any]:
+        """Run the caption stage on a stored result and store the captioned one."""
+        result["filename"] = os.path.basename(file_path)
+        result["errors"] = []
+        result["warnings"] = []
+        if self.thumbnails:
+            self._add_thumbnails(result, digest, file_path)
+
+        if not result.get("vision_caption") and self.gemini_api_key:
+            deadline = deadline or Deadline(self.budget_seconds)
+            if not deadline.allows(self.caption_min_seconds):
+                deadline.skip("caption")
+                result["warnings"].append("Vision caption skipped: deadline")
+            else:
+                with open(file_path, 'rb') as f:
+                    image_binary = f.read()
+                try:
+                    with self._stage("caption", deadline.remaining()):
+                        result["vision_caption"] = self._generate_vision_caption(image_binary, deadline)
+                except Exception as e:
+                    result["warnings"].append(f"Vision caption: {str(e)}")
+
+        result["metadata_text"] = self._build_metadata_text(result)
+        result["full_document_text"] = self._build_document_text(result)
+        if result.get("vision_caption"):
+            self.hash_cache.put_result(digest, result)
+        return result
+
+    def _generate_vision_caption(self, image_binary: bytes, deadline: Optional[Deadline] = None) -> str:
         """
         Generate image caption using Gemini Vision API.
 
+        Concurrent requests for the same image bytes are coalesced.
+
         Args:
             image_binary: Raw image bytes
+            deadline: Latency budget bounding the request and any wait
 
         Returns:
             Generated caption text
         """
+        key = hashlib.blake2b(image_binary, digest_size=16).hexdigest()
+        timeout = deadline.timeout(self.caption_timeout) if deadline else self.caption_timeout
+        return self.single_flight.do(key, self._request_vision_caption, image_binary, timeout, timeout=timeout)
+
+    async def _generate_vision_caption_async(self, image_binary: bytes, deadline: Optional[Deadline] = None) -> str:
+        """Async variant of _generate_vision_caption."""
+        key = hashlib.blake2b(image_binary, digest_size=16).hexdigest()
+        timeout = deadline.timeout(self.caption_timeout) if deadline else self.caption_timeout
+        return await self.single_flight.do_async(key, self._request_vision_caption, image_binary, timeout, timeout=timeout)
+
+    def dedup_stats(self) -> Dict[str, Dict[str, int]]:
+        """Executed and deduplicated geocode/caption call counts."""
+        return {
+            "geocode": self.geocoder.single_flight.stats(),
+            "caption": self.single_flight.stats()
+        }
+
+    def _request_vision_caption(self, image_binary: bytes, timeout: float = 30) -> str:
+        """Call the Gemini API for a caption."""
         if not self.gemini_api_key:
             raise ValueError("Gemini API key not configured")
 
@@ -216,7 +421,7 @@ class ImageProcessor:
             self.gemini_endpoint,
             headers=headers,
             json=payload,
-            timeout=30
+            timeout=timeout
         )
         response.raise_for_status()
 
@@ -231,45 +436,19 @@ class ImageProcessor:
 
     def _build_metadata_text(self, result: Dict[str, Any]) -> str:
         """Build structured metadata text from extracted data."""
-        parts = [f"■ファイル名: {result['filename']}"]
-
-        if result.get("datetime"):
-            parts.append(f"■撮影日時: {result['datetime']}")
-
-        if result.get("location"):
-            parts.append(f"■撮影場所: {result['location']}")
-        elif result.get("coordinates"):
-            coords = result["coordinates"]
-            parts.append(f"■座標: 緯度{coords['lat']}, 経度{coords['lon']}")
-
-        if result.get("camera"):
-            parts.append(f"■カメラ: {result['camera']}")
-
-        return "\n".join(parts)
+        return build_metadata_text(result)
 
     def _build_document_text(self, result: Dict[str, Any]) -> str:
-        """
-        Build the full document text for Dify Knowledge Base indexing.
-
-        Format:
-        ■ファイル名: IMG_1234.jpg
-        ■撮影場所: 芝公園, 港区, 東京都, 日本
-        ■撮影日時: 2025-01-15 14:30:00
-        ■画像内容の説明:
-        [Vision AI generated caption]
-        """
-        parts = [result["metadata_text"]]
-
-        if result.get("vision_caption"):
-            parts.append("■画像内容の説明:")
-            parts.append(result["vision_caption"])
-
-        return "\n".join(parts)
+        """Build the full document text for Dify Knowledge Base indexing."""
+        return build_document_text(result)
 
 
 def get_processor(
     gemini_api_key: Optional[str] = None,
-    geocoder: Optional[Geocoder] = None
+    geocoder: Optional[Geocoder] = None,
+    hash_cache: Optional[HashCache] = None,
+    autotuner: Optional[Autotuner] = None,
+    thumbnails: Optional[ThumbnailStore] = None
 ) -> ImageProcessor:
     """
     Factory function to create ImageProcessor instance.
@@ -277,11 +456,20 @@ def get_processor(
     Args:
         gemini_api_key: Gemini API key (uses env var if not provided)
         geocoder: Geocoder instance (auto-created if not provided)
+        hash_cache: HashCache for result reuse (disabled if not provided)
+        autotuner: Adaptive stage concurrency (unlimited if not provided)
+        thumbnails: ThumbnailStore (created from THUMBNAIL_DIR if that is
+                    set, else no thumbnails)
 
     Returns:
         ImageProcessor instance
     """
-    return ImageProcessor(gemini_api_key=gemini_api_key, geocoder=geocoder)
+    if thumbnails is None and os.environ.get('THUMBNAIL_DIR'):
+        thumbnails = get_thumbnail_store()
+    return ImageProcessor(
+        gemini_api_key=gemini_api_key, geocoder=geocoder, hash_cache=hash_cache,
+        autotuner=autotuner, thumbnails=thumbnails
+    )
 
 
 # For standalone usage
@@ -302,4 +490,5 @@ if __name__ == "__main__":
         print("\nEnvironment variables:")
         print("  GEMINI_API_KEY - Required for vision caption generation")
         print("  GOOGLE_MAPS_API_KEY - Optional, for high-accuracy geocoding")
+        print("  THUMBNAIL_DIR - Optional, writes thumbnails (see thumbnail_store.py)")
         sys.exit(1)
@@ -0,0 +1,882 @@
+"""
+Distributed Job Queue for DocuSearch_AI
+Redis Streams work queue so ingest can scale across worker containers.
+
+- Producers enqueue sync actions (see folder_sync.FolderSync)
+- Workers in a consumer group process images/documents and upload to Dify
+- Delivery is at-least-once: unacknowledged jobs are reclaimed after the
+  visibility timeout and moved to a dead-letter stream after max_deliveries
+- Jobs are idempotent by content hash: completed work is never redone
+- Optional two-phase image indexing: metadata documents are uploaded
+  immediately, captions are added later from a separate enrichment queue
+  that defers work when its backlog is deep
+- Optional worker threads with adaptive per-stage concurrency (see
+  autotuner.Autotuner)
+- Optional priority lanes (see lane_scheduler.LaneScheduler) so urgent
+  files are not stuck behind a backfill
+- Optional dataset sharding (see shard_router.ShardRouter): jobs carry
+  the dataset they write to
+- Workers can be profiled while running (SIGUSR2 or PROFILE_PORT, see
+  profiler.Profiler)
+"""
+
+import os
+import json
+import time
+import socket
+import hashlib
+import threading
+from contextlib import nullcontext
+from typing import Optional, Dict, Any, List, Tuple
+
+import redis
+import requests
+from dotenv import load_dotenv
+
+from autotuner import Autotuner
+from deadline import Deadline
+from dedup_index import DedupIndex
+from dify_client import DifyClient, get_dify_client
+from folder_sync import FolderSync
+from hash_cache import HashCache, get_hash_cache, hash_file
+from text_chunker import TEXT_EXTENSIONS, iter_chunks, upload_text_document
+
+
+# Load environment variables
+load_dotenv()
+
+STREAM_KEY = "docusearch:jobs"
+DEAD_LETTER_KEY = "docusearch:jobs:dead"
+GROUP_NAME = "docusearch-workers"
+DONE_KEY_PREFIX = "docusearch:done:"
+QUEUED_KEY_PREFIX = "docusearch:queued:"
+
+# Caption enrichment (second indexing phase)
+ENRICH_STREAM_KEY = "docusearch:enrich"
+ENRICH_DEAD_LETTER_KEY = "docusearch:enrich:dead"
+ENRICH_DEFERRED_KEY = "docusearch:enrich:deferred"
+ENRICH_GROUP_NAME = "docusearch-enrichers"
+
+# Minimum timeout for the Dify upload even when the image budget is spent
+UPLOAD_MIN_SECONDS = 10.0
+
+
+def job_key(job: Dict[str, Any]) -> str:
+    """
+    Build the idempotency key of a job.
+
+    Adds/updates are keyed by content hash and relative path, so an unchanged file
+    is indexed once while copies at other paths still get their own
+    document. Deletes are keyed by Dify document ID. Forced re-indexing
+    (see Worker._reindex) carries its own marker.
+    """
+    if job.get("action") == "delete":
+        raw = f"delete:{job.get('documentId')}"
+    else:
+        raw = f"{job.get('action')}:{job.get('relativePath')}:{job.get('content_hash')}"
+    if job.get("reindex"):
+        raw += f":reindex:{job['reindex']}"
+    return hashlib.blake2b(raw.encode('utf-8'), digest_size=32).hexdigest()
+
+
+class JobQueue:
+    """Redis Streams job queue with consumer groups and dead-lettering."""
+
+    def __init__(
+        self,
+        redis_client: Optional[redis.Redis] = None,
+        stream: str = STREAM_KEY,
+        group: str = GROUP_NAME,
+        dead_letter_stream: str = DEAD_LETTER_KEY,
+        visibility_timeout: float = 300.0,
+        max_deliveries: int = 5,
+        done_ttl: int = 30 * 24 * 3600
+    ):
+        """
+        Initialize job queue.
+
+        Args:
+            redis_client: Redis connection (auto-created from env if None)
+            stream: Stream key holding pending jobs
+            group: Consumer group name shared by all workers
+            dead_letter_stream: Stream receiving jobs that exhausted retries
+            visibility_timeout: Seconds before an unacknowledged job is reclaimed
+            max_deliveries: Deliveries before a job is dead-lettered
+            done_ttl: Seconds to remember completed idempotency keys
+        """
+        self.redis = redis_client or get_redis()
+        self.stream = stream
+        self.group = group
+        self.dead_letter_stream = dead_letter_stream
+        self.visibility_timeout = visibility_timeout
+        self.max_deliveries = max_deliveries
+        self.done_ttl = done_ttl
+        self.ensure_group()
+
+    def ensure_group(self):
+        """Create the stream and consumer group if they do not exist."""
+        try:
+            self.redis.xgroup_create(self.stream, self.group, id="0", mkstream=True)
+        except redis.exceptions.ResponseError as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+
+    def enqueue(self, job: Dict[str, Any]) -> Optional[str]:
+        """
+        Add a job unless an identical one is completed or already queued.
+
+        Args:
+            job: Sync action dictionary (see folder_sync.diff_actions),
+                 optionally with 'content_hash'
+
+        Returns:
+            Stream message ID, or None if the job was deduplicated
+        """
+        key = job_key(job)
+        job = {**job, "job_key": key}
+
+        if self.redis.exists(DONE_KEY_PREFIX + key):
+            return None
+
+        # Guard against producing the same job twice while it is in flight
+        ttl = int(self.visibility_timeout * self.max_deliveries)
+        if not self.redis.set(QUEUED_KEY_PREFIX + key, "1", nx=True, ex=max(ttl, 1)):
+            return None
+
+        return self.redis.xadd(self.stream, {"job": json.dumps(job, ensure_ascii=False)})
+
+    def claim(
+        self,
+        consumer: str,
+        count: int = 1,
+        block_ms: int = 5000
+    ) -> List[Tuple[str, Dict[str, Any]]]:
+        """
+        Claim jobs for a consumer.
+
+        Jobs left unacknowledged longer than the visibility timeout (crashed
+        or stalled workers) are reclaimed first, then new jobs are read.
+
+        Args:
+            consumer: Unique consumer (worker) name
+            count: Maximum number of jobs
+            block_ms: Milliseconds to block waiting for new jobs
+
+        Returns:
+            List of (message_id, job) tuples
+        """
+        min_idle = int(self.visibility_timeout * 1000)
+        _, messages, *_ = self.redis.xautoclaim(
+            self.stream, self.group, consumer, min_idle, start_id="0-0", count=count
+        )
+
+        if not messages:
+            response = self.redis.xreadgroup(
+                self.group, consumer, {self.stream: ">"}, count=count, block=block_ms
+            )
+            messages = response[0][1] if response else []
+
+        return [
+            (message_id, json.loads(fields["job"]))
+            for message_id, fields in messages
+            if fields
+        ]
+
+    def stream_of(self, message_id: str, job: Dict[str, Any]) -> str:
+        """Return the stream a claimed message was read from."""
+        return self.stream
+
+    def is_done(self, job: Dict[str, Any]) -> bool:
+        """Check whether a job's idempotency key is already completed."""
+        return bool(self.redis.exists(DONE_KEY_PREFIX + job["job_key"]))
+
+    def ack(self, message_id: str, job: Dict[str, Any], result: Optional[Dict[str, Any]] = None):
+        """
+        Mark a job as completed.
+
+        Args:
+            message_id: Stream message ID
+            job: Job dictionary
+            result: Optional result summary stored with the idempotency key
+        """
+        stream = self.stream_of(message_id, job)
+        pipe = self.redis.pipeline()
+        if result is not None:
+            pipe.set(DONE_KEY_PREFIX + job["job_key"], json.dumps(result, ensure_ascii=False), ex=self.done_ttl)
+        pipe.delete(QUEUED_KEY_PREFIX + job["job_key"])
+        pipe.xack(stream, self.group, message_id)
+        pipe.xdel(stream, message_id)
+        pipe.execute()
+
+    def fail(self, message_id: str, job: Dict[str, Any], error: str) -> bool:
+        """
+        Record a failed attempt.
+
+        The job stays pending and is retried after the visibility timeout,
+        unless it reached max_deliveries, in which case it is dead-lettered.
+
+        Args:
+            message_id: Stream message ID
+            job: Job dictionary
+            error: Error description
+
+        Returns:
+            True if the job was moved to the dead-letter stream
+        """
+        stream = self.stream_of(message_id, job)
+        pending = self.redis.xpending_range(
+            stream, self.group, min=message_id, max=message_id, count=1
+        )
+        deliveries = pending[0]["times_delivered"] if pending else 1
+
+        if deliveries < self.max_deliveries:
+            return False
+
+        dead = {**job, "error": error, "deliveries": deliveries, "failed_at": time.time()}
+        pipe = self.redis.pipeline()
+        pipe.xadd(self.dead_letter_stream, {"job": json.dumps(dead, ensure_ascii=False)})
+        pipe.delete(QUEUED_KEY_PREFIX + job["job_key"])
+        pipe.xack(stream, self.group, message_id)
+        pipe.xdel(stream, message_id)
+        pipe.execute()
+        return True
+
+    def stats(self) -> Dict[str, Any]:
+        """Return queue depth, pending and dead-letter counts."""
+        pending = self.redis.xpending(self.stream, self.group)
+        return {
+            "queued": self.redis.xlen(self.stream),
+            "pending": pending.get("pending", 0) if isinstance(pending, dict) else 0,
+            "dead_letter": self.redis.xlen(self.dead_letter_stream)
+        }
+
+
+class EnrichmentQueue(JobQueue):
+    """
+    Queue of caption enrichment jobs with load shedding.
+
+    When the stream is deeper than max_depth, new jobs are parked in a
+    deferred list instead, and moved back as the stream drains. Captions
+    are delayed under load; the metadata documents are already searchable.
+    """
+
+    def __init__(
+        self,
+        redis_client: Optional[redis.Redis] = None,
+        max_depth: int = 1000,
+        **kwargs
+    ):
+        """
+        Initialize enrichment queue.
+
+        Args:
+            redis_client: Redis connection (auto-created from env if None)
+            max_depth: Stream depth above which new jobs are deferred
+            **kwargs: Passed to JobQueue (visibility_timeout, max_deliveries, ...)
+        """
+        kwargs.setdefault("stream", ENRICH_STREAM_KEY)
+        kwargs.setdefault("group", ENRICH_GROUP_NAME)
+        kwargs.setdefault("dead_letter_stream", ENRICH_DEAD_LETTER_KEY)
+        super().__init__(redis_client, **kwargs)
+        self.max_depth = max_depth
+        self.deferred_key = ENRICH_DEFERRED_KEY
+
+    def schedule(self, job: Dict[str, Any]) -> str:
+        """
+        Enqueue a job, or defer it when the stream is too deep.
+
+        Returns:
+            'queued', 'deferred' or 'duplicate'
+        """
+        if self.redis.xlen(self.stream) >= self.max_depth:
+            self.redis.rpush(self.deferred_key, json.dumps(job, ensure_ascii=False))
+            return "deferred"
+        return "queued" if self.enqueue(job) else "duplicate"
+
+    def refill(self) -> int:
+        """
+        Move deferred jobs back into the stream until it is half full.
+
+        Returns:
+            Number of jobs moved
+        """
+        moved = 0
+        while self.redis.xlen(self.stream) < self.max_depth // 2:
+            raw = self.redis.lpop(self.deferred_key)
+            if raw is None:
+                break
+            if self.enqueue(json.loads(raw)):
+                moved += 1
+        return moved
+
+    def stats(self) -> Dict[str, Any]:
+        """Return queue stats including the deferred backlog."""
+        return {**super().stats(), "deferred": self.redis.llen(self.deferred_key)}
+
+
+class Worker:
+    """Queue consumer that processes sync actions and uploads to Dify."""
+
+    def __init__(
+        self,
+        queue: JobQueue,
+        processor=None,
+        client: Optional[DifyClient] = None,
+        consumer_name: Optional[str] = None,
+        listeners: Optional[List[Any]] = None,
+        enrich_queue: Optional[EnrichmentQueue] = None,
+        dedup_index: Optional[DedupIndex] = None,
+        autotuner: Optional[Autotuner] = None,
+        router=None,
+        profiler=None,
+        manifest: Optional[HashCache] = None
+    ):
+        """
+        Initialize worker.
+
+        Args:
+            queue: JobQueue instance
+            processor: ImageProcessor instance (auto-created if None)
+            client: DifyClient instance (auto-created if None)
+            consumer_name: Unique consumer name (defaults to hostname:pid)
+            listeners: Objects notified of index changes. Each may implement
+                       document_added(name, text, document_id),
+                       document_deleted(name, document_id),
+                       document_renamed(old_name, new_name, document_id) and flush()
+            enrich_queue: If set, images are indexed with metadata only and
+                          captions are added later by an EnrichmentWorker
+            dedup_index: If set, text chunks already in the dataset are not
+                         uploaded again (see dedup_index.DedupIndex)
+            autotuner: Adaptive concurrency limit for Dify uploads ('upload'
+                       stage); share it with the processor for the other stages
+            router: shard_router.ShardRouter locating the dataset of jobs
+                    without datasetId (re-index jobs, jobs queued before sharding)
+            profiler: profiler.Profiler; jobs run under cProfile during its
+                      'cprofile' sessions
+            manifest: HashCache whose sync manifest records the digest and
+                      dataset of each path once its job has succeeded
+        """
+        if processor is None:
+            from image_processor import get_processor
+            processor = get_processor()
+
+        self.queue = queue
+        self.processor = processor
+        self.client = client or get_dify_client()
+        self.consumer_name = consumer_name or f"{socket.gethostname()}:{os.getpid()}"
+        self.listeners = listeners or []
+        self.enrich_queue = enrich_queue
+        self.dedup_index = dedup_index
+        self.autotuner = autotuner
+        self.router = router
+        self.profiler = profiler
+        self.manifest = manifest
+        # Listeners are not thread-safe; worker threads call them one at a time
+        self._listener_lock = threading.Lock()
+
+    def _stage(self, name: str):
+        """Concurrency slot of a pipeline stage (no-op without autotuner)."""
+        return self.autotuner.stage(name) if self.autotuner else nullcontext()
+
+    def _dataset(self, job: Dict[str, Any]) -> Optional[str]:
+        """Dataset a job writes to (None: the client's default dataset)."""
+        if job.get("datasetId") or not self.router:
+            return job.get("datasetId")
+        return self.router.locate(job["relativePath"], job.get("path"))
+
+    def _record(self, job: Dict[str, Any]):
+        """
+        Update the sync manifest after a job succeeded.
+
+        Written only now, not when the job is queued: a job that fails or
+        is dead-lettered leaves the old entry, so the next sync detects
+        the change again.
+        """
+        if self.manifest is None:
+            return
+        if job["action"] == "delete":
+            self.manifest.set_indexed(job["relativePath"], None)
+            return
+        if job.get("content_hash"):
+            self.manifest.set_indexed(job["relativePath"], job["content_hash"], self._dataset(job))
+        if job["action"] == "rename":
+            self.manifest.set_indexed(job["oldRelativePath"], None)
+
+    def _notify(self, event: str, *args) -> List[str]:
+        """
+        Call a hook on every listener that implements it.
+
+        Listener failures are returned, not raised: the Dify side already
+        changed, so retrying the job would duplicate the upload.
+        """
+        errors = []
+        with self._listener_lock:
+            for listener in self.listeners:
+                hook = getattr(listener, event, None)
+                if hook is None:
+                    continue
+                try:
+                    hook(*args)
+                except Exception as e:
+                    errors.append(f"{type(listener).__name__}.{event}: {e}")
+        return errors
+
+    def _reindex(self, documents: List[Dict[str, Any]]) -> List[str]:
+        """
+        Queue full re-indexing of documents that skipped chunks held by a
+        document that was deleted or replaced.
+
+        Returns:
+            Names of the re-queued documents
+        """
+        requeued = []
+        for document in documents:
+            if not document["path"] or not os.path.exists(document["path"]):
+                continue
+            self.queue.enqueue({
+                "path": document["path"],
+                "name": os.path.basename(document["name"]),
+                "relativePath": document["name"],
+                "type": "document",
+                "action": "update",
+                "documentId": document["document_id"],
+                "content_hash": document["content_hash"],
+                "reindex": f"{time.time():.6f}"
+            })
+            requeued.append(document["name"])
+        return requeued
+
+    def handle(self, job: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Execute a single job.
+
+        Args:
+            job: Job dictionary
+
+        Returns:
+            Result summary (documentId, status)
+        """
+        dataset_id = self._dataset(job)
+
+        if job["action"] == "delete":
+            self.client.delete_document(job["documentId"], dataset_id)
+            errors = self._notify("document_deleted", job["relativePath"], job["documentId"])
+            summary = {"documentId": job["documentId"], "status": "deleted", "errors": errors}
+            if self.dedup_index:
+                summary["reindexed"] = self._reindex(self.dedup_index.remove(job["relativePath"]))
+            return summary
+
+        renamed_errors: List[str] = []
+        if job["action"] == "rename" and job["type"] == "image":
+            # Moved/renamed image: the text's file name is re-rendered. The
+            # cached result is reused; without one (or without its caption,
+            # whose enrichment job is skipped for the old path) the caption
+            # is generated, so the document never loses it
+            result = self.processor.caption_image_file(job["path"])
+            if not result["success"]:
+                raise RuntimeError("; ".join(result["errors"] + result.get("warnings", [])) or "Image processing failed")
+            if self.processor.gemini_api_key and not result.get("vision_caption"):
+                raise RuntimeError("; ".join(result["errors"] + result.get("warnings", [])) or "No caption generated")
+            response = self.client.rename_document(
+                job["documentId"], job["relativePath"], result["full_document_text"], dataset_id=dataset_id
+            )
+            document_id = response.get("document", {}).get("id") or job["documentId"]
+            errors = self._notify("document_renamed", job["oldRelativePath"], job["relativePath"], document_id)
+            return {"documentId": document_id, "status": "renamed", "errors": errors}
+
+        if job["action"] == "rename":
+            # Moved/renamed text document: its header names the path and it can
+            # be too large for one update request, so it is uploaded again
+            if self.dedup_index:
+                self.dedup_index.rename(job["oldRelativePath"], job["relativePath"])
+            renamed_errors = self._notify(
+                "document_renamed", job["oldRelativePath"], job["relativePath"], job["documentId"]
+            )
+
+        if job["action"] in ("update", "rename"):
+            # Modified content (or a move to another shard): replace the
+            # old document (already gone on retry)
+            try:
+                self.client.delete_document(job["documentId"], job.get("oldDatasetId") or dataset_id)
+            except requests.HTTPError as e:
+                if e.response is None or e.response.status_code != 404:
+                    raise
+
+        enrichment = None
+        deadline = None
+        dedup = None
+        if job["type"] == "image":
+            # Two-phase: metadata now (searchable by date/place), caption later
+            two_phase = self.enrich_queue is not None
+            deadline = Deadline(self.processor.budget_seconds)
+            result = self.processor.process_image_file(job["path"], generate_caption=not two_phase, deadline=deadline)
+            if not result["success"]:
+                raise RuntimeError("; ".join(result["errors"] + result.get("warnings", [])) or "Image processing failed")
+            text = result["full_document_text"]
+            # The upload is mandatory: remaining budget, but never less than UPLOAD_MIN_SECONDS
+            with self._stage("upload"):
+                response = self.client.create_by_text(
+                    job["relativePath"], text, dataset_id=dataset_id,
+                    timeout=deadline.timeout(self.client.timeout, floor=UPLOAD_MIN_SECONDS)
+                )
+            document_id = response.get("document", {}).get("id")
+
+            if two_phase and not result.get("vision_caption") and self.processor.gemini_api_key:
+                enrichment = self.enrich_queue.schedule({
+                    "path": job["path"],
+                    "name": job["name"],
+                    "relativePath": job["relativePath"],
+                    "type": "image",
+                    "action": "enrich",
+                    "documentId": document_id,
+                    "datasetId": dataset_id,
+                    "content_hash": job.get("content_hash")
+                })
+        else:
+            with self._stage("upload"):
+                upload = upload_text_document(
+                    job["path"], job["relativePath"], client=self.client,
+                    dedup=self.dedup_index, content_hash=job.get("content_hash"),
+                    dataset_id=dataset_id
+                )
+            document_id = upload["document_id"]
+            if self.dedup_index:
+                dedup = upload["dedup"]
+                dedup["reindexed"] = self._reindex(self.dedup_index.pop_documents(upload["dependents"]))
+            # Re-stream the chunks for listeners instead of holding the file
+            text = iter_chunks(job["path"])
+
+        errors = renamed_errors + self._notify("document_added", job["relativePath"], text, document_id)
+        summary = {"documentId": document_id, "status": "indexed", "errors": errors}
+        if enrichment:
+            summary["caption"] = enrichment
+        if dedup:
+            summary["dedup"] = dedup
+        if deadline is not None:
+            summary["deadline_exceeded"] = deadline.exceeded
+        return summary
+
+    def run_once(self, count: int = 1, block_ms: int = 5000) -> int:
+        """
+        Claim and process up to count jobs.
+
+        Returns:
+            Number of jobs claimed
+        """
+        jobs = self.queue.claim(self.consumer_name, count=count, block_ms=block_ms)
+
+        for message_id, job in jobs:
+            if self.queue.is_done(job):
+                # Redelivered after another worker completed it
+                self.queue.ack(message_id, job)
+                continue
+
+            try:
+                result = self.profiler.call(self.handle, job) if self.profiler else self.handle(job)
+                self.queue.ack(message_id, job, result)
+            except Exception as e:
+                self.queue.fail(message_id, job, str(e))
+                continue
+            self._record(job)
+
+        self._notify("flush")
+        return len(jobs)
+
+    def run(self, max_jobs: Optional[int] = None, threads: int = 1):
+        """
+        Process jobs until max_jobs have been claimed (forever if None).
+
+        Args:
+            max_jobs: Jobs to claim before returning (forever if None)
+            threads: Jobs processed concurrently; with an autotuner, stage
+                     limits decide how many of them call each dependency
+        """
+        processed = [0]
+        lock = threading.Lock()
+
+        def loop():
+            while True:
+                with lock:
+                    if max_jobs is not None and processed[0] >= max_jobs:
+                        return
+                claimed = self.run_once()
+                with lock:
+                    processed[0] += claimed
+
+        if threads <= 1:
+            loop()
+            return
+        workers = [threading.Thread(target=loop, name=f"worker-{i}", daemon=True) for i in range(threads)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+
+class EnrichmentWorker(Worker):
+    """
+    Second indexing phase: generate vision captions and update the
+    metadata-only documents in place.
+    """
+
+    def handle(self, job: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Caption an image and replace its document text.
+
+        Args:
+            job: Enrichment job (see Worker.handle)
+
+        Returns:
+            Result summary (documentId, status)
+        """
+        if not os.path.exists(job["path"]):
+            # Deleted or moved since phase one; its new document gets its own job
+            return {"documentId": job["documentId"], "status": "skipped"}
+
+        # Date, place and thumbnails are kept from phase one: caption only
+        result = self.processor.caption_image_file(job["path"])
+        if not result.get("vision_caption"):
+            raise RuntimeError("; ".join(result["errors"] + result.get("warnings", [])) or "No caption generated")
+
+        text = result["full_document_text"]
+        try:
+            self.client.update_by_text(job["documentId"], job["relativePath"], text, dataset_id=self._dataset(job))
+        except requests.HTTPError as e:
+            if e.response is not None and e.response.status_code == 404:
+                return {"documentId": job["documentId"], "status": "skipped"}
+            raise
+
+        errors = self._notify("document_added", job["relativePath"], text, job["documentId"])
+        return {"documentId": job["documentId"], "status": "enriched", "errors": errors}
+
+    def _record(self, job: Dict[str, Any]):
+        """Captions do not change what the manifest records (a newer update may have)."""
+
+    def run_once(self, count: int = 1, block_ms: int = 5000) -> int:
+        """Refill deferred jobs, then claim and process up to count jobs."""
+        self.queue.refill()
+        return super().run_once(count=count, block_ms=block_ms)
+
+
+def is_queueable(action: Dict[str, Any]) -> bool:
+    """Check whether a worker can handle the action (images and text documents, any deletion)."""
+    if action["action"] == "delete" or action["type"] == "image":
+        return True
+    return action["relativePath"].rsplit('.', 1)[-1].lower() in TEXT_EXTENSIONS
+
+
+def enqueue_actions(
+    queue: JobQueue,
+    actions: List[Dict[str, Any]],
+    hash_cache: Optional[HashCache] = None
+) -> Dict[str, int]:
+    """
+    Enqueue sync actions, hashing added files for idempotency.
+
+    The sync manifest is not touched here: workers record each path once
+    its job has succeeded (see Worker._record).
+
+    Args:
+        queue: JobQueue instance
+        actions: Actions from FolderSync.plan()
+        hash_cache: HashCache used for hashing
+
+    Returns:
+        Counts of enqueued, deduplicated and skipped actions
+    """
+    counts = {"enqueued": 0, "deduplicated": 0, "skipped": 0}
+
+    for action in actions:
+        if action["action"] == "rename" and not is_queueable(action):
+            # The worker cannot re-render other documents: it deletes the
+            # old one and the new path is added like any other file
+            action = {
+                **action,
+                "action": "delete",
+                "name": action["oldRelativePath"].rsplit('/', 1)[-1],
+                "relativePath": action["oldRelativePath"]
+            }
+        elif not is_queueable(action):
+            counts["skipped"] += 1
+            continue
+
+        if action["action"] != "delete" and not action.get("content_hash"):
+            try:
+                digest = hash_cache.hash_file(action["path"]) if hash_cache else hash_file(action["path"])
+            except (OSError, KeyError):
+                counts["skipped"] += 1
+                continue
+            action = {**action, "content_hash": digest}
+
+        if queue.enqueue(action):
+            counts["enqueued"] += 1
+        else:
+            counts["deduplicated"] += 1
+
+    return counts
+
+
+def get_redis() -> redis.Redis:
+    """
+    Create a Redis connection from environment variables.
+
+    Uses REDIS_HOST, REDIS_PORT, REDIS_PASSWORD and REDIS_QUEUE_DB
+    (default 2; Dify uses 0 and Celery uses 1).
+    """
+    return redis.Redis(
+        host=os.environ.get('REDIS_HOST', 'redis'),
+        port=int(os.environ.get('REDIS_PORT', 6379)),
+        password=os.environ.get('REDIS_PASSWORD') or None,
+        db=int(os.environ.get('REDIS_QUEUE_DB', 2)),
+        decode_responses=True
+    )
+
+
+def get_enrich_queue(redis_client: Optional[redis.Redis] = None) -> EnrichmentQueue:
+    """
+    Factory function to create EnrichmentQueue instance.
+
+    Args:
+        redis_client: Redis connection (auto-created from env if None)
+
+    Returns:
+        EnrichmentQueue instance
+    """
+    return EnrichmentQueue(
+        redis_client=redis_client,
+        max_depth=int(os.environ.get('ENRICH_MAX_DEPTH', 1000)),
+        visibility_timeout=float(os.environ.get('QUEUE_VISIBILITY_TIMEOUT', 300)),
+        max_deliveries=int(os.environ.get('QUEUE_MAX_DELIVERIES', 5))
+    )
+
+
+def lanes_enabled() -> bool:
+    """Check whether PRIORITY_LANES is enabled."""
+    return os.environ.get('PRIORITY_LANES', '').lower() in ('1', 'true', 'yes')
+
+
+def get_queue(redis_client: Optional[redis.Redis] = None) -> JobQueue:
+    """
+    Factory function to create JobQueue instance.
+
+    Returns a lane_scheduler.LaneScheduler when PRIORITY_LANES is enabled
+    (producers and workers must agree on this setting).
+
+    Args:
+        redis_client: Redis connection (auto-created from env if None)
+
+    Returns:
+        JobQueue instance
+    """
+    if lanes_enabled():
+        from lane_scheduler import get_lane_scheduler
+        return get_lane_scheduler(redis_client)
+    return JobQueue(
+        redis_client=redis_client,
+        visibility_timeout=float(os.environ.get('QUEUE_VISIBILITY_TIMEOUT', 300)),
+        max_deliveries=int(os.environ.get('QUEUE_MAX_DELIVERIES', 5))
+    )
+
+
+# For standalone usage
+if __name__ == "__main__":
+    import sys
+
+    command = sys.argv[1] if len(sys.argv) > 1 else ""
+
+    if command in ("produce", "submit"):
+        queue = get_queue()
+        hash_cache = get_hash_cache()
+        router = None
+        if os.environ.get('DIFY_SHARDS'):
+            from shard_router import get_shard_router
+            router = get_shard_router(manifest=hash_cache)
+        actions = FolderSync(hash_cache=hash_cache, router=router).plan()
+        if command == "submit":
+            # Urgent files by relative path (e.g. documents/urgent.md)
+            wanted = set(sys.argv[2:])
+            actions = [action for action in actions if action["relativePath"] in wanted]
+        if lanes_enabled():
+            from lane_scheduler import assign_lanes
+            actions = assign_lanes(
+                actions,
+                lane="interactive" if command == "submit" else None,
+                backfill_threshold=int(os.environ.get('SCHEDULER_BACKFILL_THRESHOLD', 500))
+            )
+        print(json.dumps(enqueue_actions(queue, actions, hash_cache), ensure_ascii=False))
+    elif command in ("worker", "enrich"):
+        listeners = []
+        if os.environ.get('KEYWORD_INDEX_PATH'):
+            from keyword_index import get_keyword_store
+            listeners.append(get_keyword_store(os.environ['KEYWORD_INDEX_PATH']))
+        if os.environ.get('RETRIEVAL_PROXY_URL'):
+            from retrieval_proxy import CacheInvalidator
+            listeners.append(CacheInvalidator())
+        dedup_index = None
+        if os.environ.get('DEDUP_INDEX_PATH'):
+            from dedup_index import get_dedup_index
+            dedup_index = get_dedup_index()
+        autotuner = None
+        if os.environ.get('AUTOTUNE', '').lower() in ('1', 'true', 'yes'):
+            from autotuner import get_autotuner
+            autotuner = get_autotuner()
+        threads = int(os.environ.get('WORKER_THREADS', 1))
+        hash_cache = get_hash_cache() if os.environ.get('HASH_CACHE_PATH') else None
+        router = None
+        if os.environ.get('DIFY_SHARDS'):
+            from shard_router import get_shard_router
+            router = get_shard_router(manifest=hash_cache)
+        # Idle until SIGUSR2 or a request on PROFILE_PORT
+        from profiler import get_profiler
+        profiler = get_profiler()
+        profiler.install_signal(float(os.environ.get('PROFILE_SECONDS', 30)))
+        if os.environ.get('PROFILE_PORT'):
+            profiler.serve(int(os.environ['PROFILE_PORT']))
+        processor = None
+        if hash_cache is not None or autotuner:
+            from image_processor import get_processor
+            processor = get_processor(hash_cache=hash_cache, autotuner=autotuner)
+        if command == "enrich":
+            EnrichmentWorker(
+                get_enrich_queue(), processor=processor, listeners=listeners,
+                autotuner=autotuner, router=router, profiler=profiler, manifest=hash_cache
+            ).run(threads=threads)
+        else:
+            two_phase = os.environ.get('CAPTION_ENRICHMENT', '').lower() in ('1', 'true', 'yes')
+            enrich_queue = get_enrich_queue() if two_phase else None
+            Worker(
+                get_queue(), processor=processor, listeners=listeners,
+                enrich_queue=enrich_queue, dedup_index=dedup_index,
+                autotuner=autotuner, router=router, profiler=profiler, manifest=hash_cache
+            ).run(threads=threads)
+    elif command == "stats":
+        stats = {
+            "jobs": get_queue().stats(),
+            "enrich": get_enrich_queue().stats()
+        }
+        if os.environ.get('DEDUP_INDEX_PATH'):
+            from dedup_index import get_dedup_index
+            stats["dedup"] = get_dedup_index().stats()
+        print(json.dumps(stats, ensure_ascii=False))
+    else:
+        print("Usage: python job_queue.py <produce|submit <relative_path>...|worker|enrich|stats>")
+        print("\nEnvironment variables:")
+        print("  REDIS_HOST / REDIS_PORT / REDIS_PASSWORD - Redis connection")
+        print("  REDIS_QUEUE_DB - Redis DB for the queue (default: 2)")
+        print("  QUEUE_VISIBILITY_TIMEOUT - Seconds before reclaiming a job (default: 300)")
+        print("  QUEUE_MAX_DELIVERIES - Deliveries before dead-lettering (default: 5)")
+        print("  HASH_CACHE_PATH - Content hash cache (enables update detection and result reuse)")
+        print("  CAPTION_ENRICHMENT - Index images with metadata first, caption via 'enrich' workers")
+        print("  ENRICH_MAX_DEPTH - Enrichment backlog above which captions are deferred (default: 1000)")
+        print("  DEDUP_INDEX_PATH - Near-duplicate index (skips chunks already in the dataset)")
+        print("  WORKER_THREADS - Jobs processed concurrently per worker (default: 1)")
+        print("  AUTOTUNE - Adapt exif/geocode/caption/upload concurrency at runtime")
+        print("  AUTOTUNE_LIMITS - Stage bounds (e.g. caption=1:32,upload=1:8)")
+        print("  PRIORITY_LANES - interactive/incremental/backfill lanes ('submit' uses interactive)")
+        print("  SCHEDULER_LANE_CAPS - Max in-flight jobs per lane (e.g. backfill=3)")
+        print("  SCHEDULER_FOLDER_WEIGHTS - Fair-share weights per top-level folder (e.g. documents=2)")
+        print("  SCHEDULER_BACKFILL_THRESHOLD - Adds per produce run treated as backfill (default: 500)")
+        print("  DIFY_SHARDS - Spread documents over datasets (see shard_router.py)")
+        print("  PROFILE_PORT - Profiling endpoint; SIGUSR2 always starts a sampling session (see profiler.py)")
+        print("  THUMBNAIL_DIR - Write image thumbnails served by nginx (see thumbnail_store.py)")
+        sys.exit(1)
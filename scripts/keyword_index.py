@@ -0,0 +1,648 @@
+"""
+Japanese Keyword Index for DocuSearch_AI
+Local n-gram inverted index with BM25 scoring for exact lookups
+(file names, sign text, addresses) without a round trip to Dify/Weaviate.
+
+- Japanese runs are split into character bigrams and trigrams, and
+  documents also index single characters so one-character queries
+  (駅, 港) match; alphanumeric runs are kept as whole words
+- Posting lists are delta + varint encoded byte strings with a block
+  skip index, so AND queries only decode the blocks they need
+- Documents can be added and removed incrementally (tombstones with
+  periodic compaction)
+- Persistence is a shared SQLite store (KeywordStore): every worker
+  writes its own document rows, so scaled workers merge instead of
+  overwriting each other; readers apply the change log to their
+  in-memory index
+"""
+
+import os
+import re
+import json
+import math
+import time
+import zlib
+import heapq
+import bisect
+import sqlite3
+import threading
+import unicodedata
+from array import array
+from typing import Optional, Dict, Any, List, Tuple, Iterable, Union
+
+
+# Alphanumeric words vs. everything else that is not whitespace/punctuation
+WORD_PATTERN = re.compile(r"[0-9a-z]+|[^\W0-9a-z_]+")
+
+DEFAULT_INDEX_PATH = os.environ.get('KEYWORD_INDEX_PATH', 'keyword_index.sqlite3')
+
+
+def normalize_text(text: str) -> str:
+    """Normalize width and case (全角英数 -> 半角, カタカナ幅の統一)."""
+    return unicodedata.normalize("NFKC", text).lower()
+
+
+def tokenize(text: str, unigrams: bool = True) -> List[str]:
+    """
+    Tokenize text into index terms.
+
+    Args:
+        text: Raw text
+        unigrams: Also emit every character of longer Japanese runs
+                  (documents); queries leave them out, their bigrams and
+                  trigrams are more selective
+
+    Returns:
+        Terms in document order: words for alphanumeric runs, character
+        bigrams and trigrams for Japanese runs (a single character is kept
+        as a unigram)
+    """
+    terms = []
+
+    for match in WORD_PATTERN.finditer(normalize_text(text)):
+        run = match.group()
+        if run.isascii():
+            terms.append(run)
+            continue
+
+        if len(run) == 1:
+            terms.append(run)
+            continue
+
+        for n in ((1, 2, 3) if unigrams else (2, 3)):
+            for i in range(len(run) - n + 1):
+                terms.append(run[i:i + n])
+
+    return terms
+
+
+def count_terms(text: Union[str, Iterable[str]]) -> Tuple[Dict[str, int], int]:
+    """
+    Count the index terms of a document.
+
+    Args:
+        text: Document text, or an iterable of text chunks
+
+    Returns:
+        (term -> frequency, document length in terms)
+    """
+    counts: Dict[str, int] = {}
+    length = 0
+    for chunk in ([text] if isinstance(text, str) else text):
+        terms = tokenize(chunk)
+        length += len(terms)
+        for term in terms:
+            counts[term] = counts.get(term, 0) + 1
+    return counts, length
+
+
+# Entries per posting block; each block starts a fresh delta chain so
+# lookups can jump straight to the block that may hold a document
+BLOCK_SIZE = 64
+
+
+def _write_varint(out: bytearray, value: int):
+    """Append an unsigned LEB128 varint."""
+    while value >= 0x80:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _read_varint(data: bytes, pos: int) -> Tuple[int, int]:
+    """Read an unsigned LEB128 varint, returning (value, next_pos)."""
+    value = 0
+    shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, pos
+        shift += 7
+
+
+class PostingList:
+    """
+    Compressed posting list: (doc_id, tf) pairs as delta + varint bytes,
+    split into fixed-size blocks with a skip index of (first doc, offset).
+    """
+
+    __slots__ = ("data", "block_docs", "block_offsets", "count", "last_doc")
+
+    def __init__(self):
+        self.data = bytearray()
+        self.block_docs = array('I')
+        self.block_offsets = array('I')
+        self.count = 0
+        self.last_doc = 0
+
+    def append(self, doc_id: int, tf: int):
+        """Append an entry; doc_id must be greater than every existing one."""
+        if self.count % BLOCK_SIZE == 0:
+            self.block_docs.append(doc_id)
+            self.block_offsets.append(len(self.data))
+            _write_varint(self.data, 0)
+        else:
+            _write_varint(self.data, doc_id - self.last_doc)
+        _write_varint(self.data, tf)
+        self.last_doc = doc_id
+        self.count += 1
+
+    def _decode_block(self, block: int) -> List[Tuple[int, int]]:
+        """Decode a single block."""
+        data = self.data
+        pos = self.block_offsets[block]
+        end = self.block_offsets[block + 1] if block + 1 < len(self.block_offsets) else len(data)
+        doc_id = self.block_docs[block]
+        entries = []
+
+        while pos < end:
+            delta, pos = _read_varint(data, pos)
+            tf, pos = _read_varint(data, pos)
+            doc_id += delta
+            entries.append((doc_id, tf))
+
+        return entries
+
+    def decode(self) -> List[Tuple[int, int]]:
+        """Decode all (doc_id, tf) pairs."""
+        entries = []
+        for block in range(len(self.block_offsets)):
+            entries.extend(self._decode_block(block))
+        return entries
+
+    def lookup(self, doc_ids: List[int]) -> Dict[int, int]:
+        """
+        Find term frequencies for sorted doc_ids, decoding only the blocks
+        that may contain them.
+
+        Returns:
+            Mapping of doc_id to tf for the IDs present in the list
+        """
+        found = {}
+        current_block = -1
+        block_entries: Dict[int, int] = {}
+
+        for doc_id in doc_ids:
+            block = bisect.bisect_right(self.block_docs, doc_id) - 1
+            if block < 0:
+                continue
+            if block != current_block:
+                block_entries = dict(self._decode_block(block))
+                current_block = block
+            tf = block_entries.get(doc_id)
+            if tf is not None:
+                found[doc_id] = tf
+
+        return found
+
+
+class KeywordIndex:
+    """Incremental inverted index with BM25 ranking."""
+
+    def __init__(
+        self,
+        k1: float = 1.2,
+        b: float = 0.75,
+        compact_ratio: float = 0.2,
+        stop_df_ratio: float = 0.5
+    ):
+        """
+        Initialize an empty index.
+
+        Args:
+            k1: BM25 term frequency saturation
+            b: BM25 length normalization
+            compact_ratio: Fraction of deleted documents that triggers compaction
+            stop_df_ratio: Terms found in more than this fraction of documents
+                           are ignored when the query has rarer terms
+                           (ranked queries only)
+        """
+        self.k1 = k1
+        self.b = b
+        self.compact_ratio = compact_ratio
+        self.stop_df_ratio = stop_df_ratio
+        # Last KeywordStore change applied (see KeywordStore.refresh)
+        self.seq = 0
+
+        self._postings: Dict[str, PostingList] = {}
+        self._df: Dict[str, int] = {}
+
+        self._names: Dict[int, str] = {}
+        self._doc_ids: Dict[str, int] = {}
+        self._lengths: Dict[int, int] = {}
+        self._terms: Dict[int, array] = {}
+        self._term_ids: Dict[str, int] = {}
+        self._term_list: List[str] = []
+        self._deleted: set = set()
+
+        self._next_id = 1
+        self._total_length = 0
+
+    def __len__(self) -> int:
+        return len(self._doc_ids)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._doc_ids
+
+    def add(self, name: str, text: Union[str, Iterable[str]]):
+        """
+        Add or replace a document.
+
+        Args:
+            name: Document name (relative path, same as the Dify document name)
+            text: Document text, or an iterable of text chunks for large
+                  documents (only term counts are held in memory)
+        """
+        self.add_counts(name, *count_terms(text))
+
+    def add_counts(self, name: str, counts: Dict[str, int], length: int):
+        """Add or replace a document from its term counts (see count_terms)."""
+        if name in self._doc_ids:
+            self.remove(name)
+
+        doc_id = self._next_id
+        self._next_id += 1
+
+        term_ids = array('I')
+        for term, tf in counts.items():
+            # Doc IDs are monotonic, so appending keeps posting lists sorted
+            postings = self._postings.get(term)
+            if postings is None:
+                postings = self._postings[term] = PostingList()
+            postings.append(doc_id, tf)
+            self._df[term] = self._df.get(term, 0) + 1
+            term_ids.append(self._term_id(term))
+
+        self._names[doc_id] = name
+        self._doc_ids[name] = doc_id
+        self._lengths[doc_id] = length
+        self._terms[doc_id] = term_ids
+        self._total_length += length
+
+    def remove(self, name: str) -> bool:
+        """
+        Remove a document.
+
+        Args:
+            name: Document name
+
+        Returns:
+            True if the document existed
+        """
+        doc_id = self._doc_ids.pop(name, None)
+        if doc_id is None:
+            return False
+
+        for term_id in self._terms.pop(doc_id):
+            term = self._term_list[term_id]
+            self._df[term] -= 1
+
+        self._total_length -= self._lengths.pop(doc_id)
+        del self._names[doc_id]
+        self._deleted.add(doc_id)
+
+        if len(self._deleted) > self.compact_ratio * max(len(self._doc_ids), 1):
+            self.compact()
+
+        return True
+
+    def rename(self, old_name: str, new_name: str) -> bool:
+        """
+        Re-point a document to a new name without re-tokenizing it.
+
+        Args:
+            old_name: Current document name
+            new_name: New document name (replaced if it already exists)
+
+        Returns:
+            True if the document existed
+        """
+        doc_id = self._doc_ids.get(old_name)
+        if doc_id is None:
+            return False
+
+        if new_name in self._doc_ids and new_name != old_name:
+            self.remove(new_name)
+
+        del self._doc_ids[old_name]
+        self._doc_ids[new_name] = doc_id
+        self._names[doc_id] = new_name
+        return True
+
+    def compact(self):
+        """Rewrite posting lists without deleted documents."""
+        if not self._deleted:
+            return
+
+        for term in list(self._postings):
+            if self._df.get(term, 0) <= 0:
+                del self._postings[term]
+                self._df.pop(term, None)
+                continue
+
+            live = PostingList()
+            for doc_id, tf in self._postings[term].decode():
+                if doc_id not in self._deleted:
+                    live.append(doc_id, tf)
+            self._postings[term] = live
+
+        self._deleted.clear()
+
+    def search(
+        self,
+        query: str,
+        limit: int = 10,
+        match_all: bool = False
+    ) -> List[Dict[str, Any]]:
+        """
+        Rank documents for a keyword query with BM25.
+
+        Args:
+            query: Query text
+            limit: Maximum number of results
+            match_all: Only return documents containing every query term
+                       (useful for exact lookups such as addresses); a
+                       term found in no document means no results
+
+        Returns:
+            List of {name, score} sorted by descending score
+        """
+        n_docs = len(self._doc_ids)
+        query_terms = set(tokenize(query, unigrams=False))
+        if match_all and any(self._df.get(t, 0) <= 0 for t in query_terms):
+            return []
+        terms = sorted((t for t in query_terms if self._df.get(t, 0) > 0), key=lambda t: self._df[t])
+        if not terms or not n_docs:
+            return []
+
+        if not match_all:
+            # Drop near-ubiquitous n-grams (e.g. "jpg") unless nothing rarer is left
+            rare = [t for t in terms if self._df[t] <= self.stop_df_ratio * n_docs]
+            terms = rare or terms[:1]
+
+        avg_length = self._total_length / n_docs or 1.0
+        k1 = self.k1
+        b = self.b
+        lengths = self._lengths
+        deleted = self._deleted
+        scores: Dict[int, float] = {}
+
+        for i, term in enumerate(terms):
+            df = self._df[term]
+            idf = math.log(1 + (n_docs - df + 0.5) / (df + 0.5))
+            postings = self._postings[term]
+
+            if match_all and i > 0:
+                # Rarest term first: later terms only probe surviving candidates
+                entries = postings.lookup(sorted(scores)).items()
+                scores = {doc_id: scores[doc_id] for doc_id, _ in entries}
+            else:
+                entries = postings.decode()
+
+            for doc_id, tf in entries:
+                if doc_id in deleted:
+                    continue
+                norm = k1 * (1 - b + b * lengths[doc_id] / avg_length)
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (k1 + 1) / (tf + norm)
+
+            if match_all and not scores:
+                return []
+
+        top = heapq.nlargest(limit, scores.items(), key=lambda item: item[1])
+        return [{"name": self._names[doc_id], "score": round(score, 4)} for doc_id, score in top]
+
+    def document_added(self, name: str, text: Union[str, Iterable[str]], document_id: Optional[str] = None):
+        """Sync pipeline hook: a document was uploaded to Dify."""
+        self.add(name, text)
+
+    def document_deleted(self, name: str, document_id: Optional[str] = None):
+        """Sync pipeline hook: a document was deleted from Dify."""
+        self.remove(name)
+
+    def document_renamed(self, old_name: str, new_name: str, document_id: Optional[str] = None):
+        """Sync pipeline hook: a document was renamed in Dify."""
+        self.rename(old_name, new_name)
+
+    def _term_id(self, term: str) -> int:
+        """Intern a term and return its numeric ID."""
+        term_id = self._term_ids.get(term)
+        if term_id is None:
+            term_id = len(self._term_list)
+            self._term_ids[term] = term_id
+            self._term_list.append(term)
+        return term_id
+
+
+class KeywordStore:
+    """
+    Shared persistent keyword index (SQLite).
+
+    Workers write document rows (term counts, not postings) in their own
+    transactions, so any number of processes can update one store. Every
+    write is also appended to a change log that readers replay onto their
+    in-memory KeywordIndex (refresh).
+    """
+
+    def __init__(self, path: str = DEFAULT_INDEX_PATH, keep_changes: int = 100000):
+        """
+        Initialize store.
+
+        Args:
+            path: SQLite database path (':memory:' for a throwaway store)
+            keep_changes: Change log entries kept; readers further behind
+                          reload the whole index
+        """
+        self.path = path
+        self.keep_changes = keep_changes
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS documents (
+                name TEXT PRIMARY KEY, length INTEGER, terms BLOB
+            );
+            CREATE TABLE IF NOT EXISTS changes (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT
+            );
+        """)
+        self._writes = 0
+
+    def put(self, name: str, text: Union[str, Iterable[str]]):
+        """Add or replace a document."""
+        counts, length = count_terms(text)
+        terms = zlib.compress(json.dumps(counts, ensure_ascii=False).encode('utf-8'))
+        with self._lock, self._db:
+            self._db.execute("INSERT OR REPLACE INTO documents VALUES (?, ?, ?)", (name, length, terms))
+            self._changed(name)
+
+    def delete(self, name: str):
+        """Remove a document."""
+        with self._lock, self._db:
+            self._db.execute("DELETE FROM documents WHERE name = ?", (name,))
+            self._changed(name)
+
+    def rename(self, old_name: str, new_name: str):
+        """Re-point a document to a new name without re-tokenizing it."""
+        if old_name == new_name:
+            return
+        with self._lock, self._db:
+            self._db.execute("DELETE FROM documents WHERE name = ?", (new_name,))
+            self._db.execute("UPDATE documents SET name = ? WHERE name = ?", (new_name, old_name))
+            self._changed(old_name)
+            self._changed(new_name)
+
+    def _changed(self, name: str):
+        """Log a change (called inside the write transaction)."""
+        self._db.execute("INSERT INTO changes (name) VALUES (?)", (name,))
+        self._writes += 1
+        if self._writes % 1000 == 0:
+            self._db.execute(
+                "DELETE FROM changes WHERE seq <= (SELECT MAX(seq) FROM changes) - ?", (self.keep_changes,)
+            )
+
+    def _apply(self, index: KeywordIndex, name: str, row: Optional[Tuple[int, bytes]]):
+        if row is None:
+            index.remove(name)
+        else:
+            length, terms = row
+            index.add_counts(name, json.loads(zlib.decompress(terms)), length)
+
+    def load(self, **kwargs) -> KeywordIndex:
+        """
+        Build an in-memory index of every stored document.
+
+        Args:
+            **kwargs: Passed to KeywordIndex (k1, b, ...)
+        """
+        index = KeywordIndex(**kwargs)
+        with self._lock:
+            # One read transaction: the documents match the change log position
+            with self._db:
+                index.seq = self._db.execute("SELECT COALESCE(MAX(seq), 0) FROM changes").fetchone()[0]
+                rows = self._db.execute("SELECT name, length, terms FROM documents").fetchall()
+        for name, length, terms in rows:
+            self._apply(index, name, (length, terms))
+        return index
+
+    def refresh(self, index: KeywordIndex) -> KeywordIndex:
+        """
+        Bring an index loaded from this store up to date.
+
+        Returns:
+            The same index, or a reloaded one if the change log no longer
+            reaches back to it
+        """
+        with self._lock:
+            with self._db:
+                oldest = self._db.execute("SELECT MIN(seq) FROM changes").fetchone()[0]
+                changes = self._db.execute(
+                    "SELECT seq, name FROM changes WHERE seq > ? ORDER BY seq", (index.seq,)
+                ).fetchall()
+                names = {name for _, name in changes}
+                rows = {
+                    name: self._db.execute(
+                        "SELECT length, terms FROM documents WHERE name = ?", (name,)
+                    ).fetchone()
+                    for name in names
+                }
+        if oldest is not None and oldest > index.seq + 1:
+            return self.load(k1=index.k1, b=index.b)
+        for name in names:
+            self._apply(index, name, rows[name])
+        if changes:
+            index.seq = changes[-1][0]
+        return index
+
+    def document_added(self, name: str, text: Union[str, Iterable[str]], document_id: Optional[str] = None):
+        """Sync pipeline hook: a document was uploaded to Dify."""
+        self.put(name, text)
+
+    def document_deleted(self, name: str, document_id: Optional[str] = None):
+        """Sync pipeline hook: a document was deleted from Dify."""
+        self.delete(name)
+
+    def document_renamed(self, old_name: str, new_name: str, document_id: Optional[str] = None):
+        """Sync pipeline hook: a document was renamed in Dify."""
+        self.rename(old_name, new_name)
+
+    def close(self):
+        """Close the database."""
+        with self._lock:
+            self._db.close()
+
+
+def reciprocal_rank_fusion(
+    *rankings: List[Dict[str, Any]],
+    k: int = 60,
+    limit: int = 10
+) -> List[Dict[str, Any]]:
+    """
+    Merge ranked result lists (e.g. keyword + vector search) by name.
+
+    Args:
+        rankings: Lists of result dicts with a 'name' key, best first
+        k: RRF damping constant
+        limit: Maximum number of results
+
+    Returns:
+        List of {name, score} sorted by fused score
+    """
+    fused: Dict[str, float] = {}
+    for ranking in rankings:
+        for rank, item in enumerate(ranking):
+            fused[item["name"]] = fused.get(item["name"], 0.0) + 1.0 / (k + rank + 1)
+
+    top = heapq.nlargest(limit, fused.items(), key=lambda item: item[1])
+    return [{"name": name, "score": round(score, 6)} for name, score in top]
+
+
+def get_keyword_store(path: str = DEFAULT_INDEX_PATH) -> KeywordStore:
+    """
+    Factory function to open the shared keyword store.
+
+    Args:
+        path: SQLite database path
+
+    Returns:
+        KeywordStore instance
+    """
+    return KeywordStore(path)
+
+
+def get_keyword_index(path: str = DEFAULT_INDEX_PATH) -> KeywordIndex:
+    """
+    Factory function to load the keyword index from its store.
+
+    Args:
+        path: SQLite database path (an empty index if it does not exist yet)
+
+    Returns:
+        KeywordIndex instance
+    """
+    return get_keyword_store(path).load()
+
+
+# For standalone usage
+if __name__ == "__main__":
+    import sys
+
+    if len(sys.argv) >= 3 and sys.argv[1] == "search":
+        index = get_keyword_index()
+        start = time.perf_counter()
+        results = index.search(" ".join(sys.argv[2:]), match_all=True)
+        elapsed_ms = (time.perf_counter() - start) * 1000
+
+        print(json.dumps({"elapsed_ms": round(elapsed_ms, 3), "results": results}, ensure_ascii=False, indent=2))
+    elif len(sys.argv) >= 3 and sys.argv[1] == "add":
+        store = get_keyword_store()
+        for file_path in sys.argv[2:]:
+            with open(file_path, 'r', encoding='utf-8', errors='replace') as f:
+                store.put(file_path, f.read())
+        print(f"Indexed {len(sys.argv) - 2} file(s); {len(store.load())} document(s) total")
+    else:
+        print("Usage: python keyword_index.py search <query>")
+        print("       python keyword_index.py add <text_file> [...]")
+        print("\nEnvironment variables:")
+        print("  KEYWORD_INDEX_PATH - Index database path (default: keyword_index.sqlite3)")
+        sys.exit(1)
@@ -0,0 +1,392 @@
+"""
+Lane Scheduler for DocuSearch_AI
+Priority lanes and fair sharing in front of the ingest workers.
+
+- Three lanes in strict priority order: interactive (files submitted by
+  hand), incremental (regular sync runs) and backfill (large initial or
+  rebuild runs). Workers always take the highest lane with work, so an
+  urgent document waits for at most one running job, not for the backlog
+- Within a lane, top-level watch folders (e.g. images/2024-trip) share
+  workers by weight (start-time fair queuing), so one huge folder cannot
+  starve the others
+- Per-lane concurrency caps (e.g. backfill=3 with 4 workers keeps one
+  worker free for interactive and incremental jobs)
+- Per-lane queue depth, in-flight count and wait-time percentiles
+- Drop-in replacement for JobQueue: one Redis stream per lane and folder,
+  same consumer group, idempotency keys and dead-letter stream
+"""
+
+import os
+import json
+import time
+from typing import Optional, Dict, Any, List, Tuple
+
+import redis
+from dotenv import load_dotenv
+
+from folder_sync import top_level_folder
+from job_queue import (
+    DONE_KEY_PREFIX, QUEUED_KEY_PREFIX, STREAM_KEY,
+    JobQueue, job_key
+)
+
+
+# Load environment variables
+load_dotenv()
+
+LANES = ("interactive", "incremental", "backfill")
+DEFAULT_LANE = "incremental"
+
+LANE_KEY_PREFIX = "docusearch:lanes:"
+SIGNAL_KEY = LANE_KEY_PREFIX + "signal"
+
+# Wait-time samples kept per lane for percentiles
+WAIT_SAMPLES = 1000
+
+
+def parse_settings(value: str) -> Dict[str, float]:
+    """Parse 'name=number,name=number' settings (caps, weights)."""
+    settings = {}
+    for item in value.split(','):
+        name, _, number = item.strip().rpartition('=')
+        if name:
+            settings[name.strip()] = float(number)
+    return settings
+
+
+def assign_lanes(
+    actions: List[Dict[str, Any]],
+    lane: Optional[str] = None,
+    backfill_threshold: int = 500
+) -> List[Dict[str, Any]]:
+    """
+    Set the 'lane' of each sync action.
+
+    Args:
+        actions: Actions from FolderSync.plan()
+        lane: Lane for every action (classified automatically if None)
+        backfill_threshold: A run with more adds/updates than this is a
+                            backfill; deletes and renames stay incremental
+
+    Returns:
+        Actions with 'lane' set
+    """
+    if lane is None:
+        heavy = sum(1 for action in actions if action["action"] in ("add", "update"))
+        bulk = heavy > backfill_threshold
+    result = []
+    for action in actions:
+        if lane is not None:
+            action_lane = lane
+        elif bulk and action["action"] in ("add", "update"):
+            action_lane = "backfill"
+        else:
+            action_lane = DEFAULT_LANE
+        result.append({**action, "lane": action_lane})
+    return result
+
+
+def percentile(values: List[float], fraction: float) -> Optional[float]:
+    """Nearest-rank percentile (None for no values)."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class LaneScheduler(JobQueue):
+    """
+    JobQueue with priority lanes, weighted fair sharing across folders and
+    per-lane concurrency caps.
+
+    Keys per lane:
+        docusearch:jobs:<lane>:<folder>     stream of jobs of one folder
+        docusearch:lanes:<lane>:folders     all folders seen
+        docusearch:lanes:<lane>:active      folders with queued jobs, scored
+                                            by virtual time (lowest served next)
+        docusearch:lanes:<lane>:inflight    claimed messages, scored by claim time
+        docusearch:lanes:<lane>:waits       recent queue wait times (seconds)
+
+    Caps and fairness are enforced by each worker on claim, without locks,
+    so concurrent claims can briefly exceed a cap by a job or two.
+    """
+
+    def __init__(
+        self,
+        redis_client: Optional[redis.Redis] = None,
+        lane_caps: Optional[Dict[str, int]] = None,
+        folder_weights: Optional[Dict[str, float]] = None,
+        maintenance_interval: float = 10.0,
+        **kwargs
+    ):
+        """
+        Initialize lane scheduler.
+
+        Args:
+            redis_client: Redis connection (auto-created from env if None)
+            lane_caps: Maximum in-flight jobs per lane (missing or 0 = unlimited)
+            folder_weights: Share weight per top-level folder (default 1.0)
+            maintenance_interval: Seconds between reclaim/repair passes
+            **kwargs: Passed to JobQueue (visibility_timeout, max_deliveries, ...)
+        """
+        super().__init__(redis_client, **kwargs)
+        self.lane_caps = {lane: int(cap) for lane, cap in (lane_caps or {}).items() if cap}
+        self.folder_weights = folder_weights or {}
+        self.maintenance_interval = maintenance_interval
+        self._groups = set()
+        self._claimed: Dict[Tuple[str, str], Tuple[str, str]] = {}
+        self._next_maintenance = 0.0
+
+    def _key(self, lane: str, name: str) -> str:
+        return f"{LANE_KEY_PREFIX}{lane}:{name}"
+
+    def _stream(self, lane: str, folder: str) -> str:
+        return f"{STREAM_KEY}:{lane}:{folder}"
+
+    def _ensure_stream(self, stream: str):
+        """Create a folder stream and its consumer group once per process."""
+        if stream in self._groups:
+            return
+        try:
+            self.redis.xgroup_create(stream, self.group, id="0", mkstream=True)
+        except redis.exceptions.ResponseError as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+        self._groups.add(stream)
+
+    def _activate(self, lane: str, folder: str):
+        """Mark a folder as having work, starting at the lane's virtual time."""
+        vtime = float(self.redis.get(self._key(lane, "vtime")) or 0)
+        self.redis.zadd(self._key(lane, "active"), {folder: vtime}, nx=True)
+
+    def enqueue(self, job: Dict[str, Any]) -> Optional[str]:
+        """
+        Add a job to its lane unless an identical one is completed or queued.
+
+        The lane comes from job['lane'] (default: incremental). An
+        interactive job is added even if the same job already waits in a
+        lower lane; whichever copy runs second is skipped as done.
+
+        Returns:
+            Stream message ID, or None if the job was deduplicated
+        """
+        lane = job.get("lane") or DEFAULT_LANE
+        if lane not in LANES:
+            raise ValueError(f"Unknown lane: {lane}")
+        key = job_key(job)
+        job = {**job, "lane": lane, "job_key": key}
+
+        if self.redis.exists(DONE_KEY_PREFIX + key):
+            return None
+
+        ttl = max(int(self.visibility_timeout * self.max_deliveries), 1)
+        if not self.redis.set(QUEUED_KEY_PREFIX + key, "1", nx=True, ex=ttl) and lane != "interactive":
+            return None
+
+        folder = top_level_folder(job.get("relativePath") or "")
+        stream = self._stream(lane, folder)
+        self._ensure_stream(stream)
+        message_id = self.redis.xadd(stream, {"job": json.dumps(job, ensure_ascii=False)})
+        self.redis.sadd(self._key(lane, "folders"), folder)
+        self._activate(lane, folder)
+
+        # Wake one idle worker
+        pipe = self.redis.pipeline()
+        pipe.rpush(SIGNAL_KEY, lane)
+        pipe.ltrim(SIGNAL_KEY, -100, -1)
+        pipe.execute()
+        return message_id
+
+    def inflight(self, lane: str) -> int:
+        """Number of claimed, unfinished jobs of a lane (expired claims excluded)."""
+        since = time.time() - self.visibility_timeout
+        return self.redis.zcount(self._key(lane, "inflight"), since, "+inf")
+
+    def _track(self, lane: str, folder: str, message_id: str, job: Dict[str, Any]):
+        """Remember a claimed message for ack/fail and the lane's in-flight set."""
+        self._claimed[(message_id, job["job_key"])] = (lane, folder)
+        self.redis.zadd(self._key(lane, "inflight"), {f"{folder}|{message_id}": time.time()})
+
+    def _claim_lane(self, lane: str, consumer: str, count: int) -> List[Tuple[str, Dict[str, Any]]]:
+        """Claim new jobs from one lane, folder with the lowest virtual time first."""
+        cap = self.lane_caps.get(lane)
+        active_key = self._key(lane, "active")
+        jobs = []
+
+        while len(jobs) < count:
+            if cap and self.inflight(lane) >= cap:
+                break
+            head = self.redis.zrange(active_key, 0, 0, withscores=True)
+            if not head:
+                break
+            folder, vtime = head[0]
+            stream = self._stream(lane, folder)
+            self._ensure_stream(stream)
+            response = self.redis.xreadgroup(self.group, consumer, {stream: ">"}, count=1)
+            messages = response[0][1] if response else []
+            if not messages:
+                # Drained; a job enqueued meanwhile is restored by _maintain
+                self.redis.zrem(active_key, folder)
+                continue
+
+            message_id, fields = messages[0]
+            job = json.loads(fields["job"])
+            share = 1.0 / self.folder_weights.get(folder, 1.0)
+            wait = max(time.time() - int(message_id.split('-')[0]) / 1000, 0.0)
+
+            pipe = self.redis.pipeline()
+            pipe.zincrby(active_key, share, folder)
+            pipe.set(self._key(lane, "vtime"), vtime)
+            pipe.lpush(self._key(lane, "waits"), round(wait, 3))
+            pipe.ltrim(self._key(lane, "waits"), 0, WAIT_SAMPLES - 1)
+            pipe.execute()
+
+            self._track(lane, folder, message_id, job)
+            jobs.append((message_id, job))
+
+        return jobs
+
+    def _maintain(self, consumer: str, count: int) -> List[Tuple[str, Dict[str, Any]]]:
+        """
+        Periodic pass: reclaim jobs of crashed or stalled workers, drop
+        expired in-flight entries and re-activate folders that still hold
+        queued jobs.
+
+        Returns:
+            Reclaimed jobs (at most count)
+        """
+        now = time.time()
+        if now < self._next_maintenance:
+            return []
+        self._next_maintenance = now + self.maintenance_interval
+
+        min_idle = int(self.visibility_timeout * 1000)
+        reclaimed = []
+        for lane in LANES:
+            self.redis.zremrangebyscore(self._key(lane, "inflight"), "-inf", now - self.visibility_timeout)
+            active = set(self.redis.zrange(self._key(lane, "active"), 0, -1))
+            for folder in self.redis.smembers(self._key(lane, "folders")):
+                stream = self._stream(lane, folder)
+                self._ensure_stream(stream)
+                if len(reclaimed) < count:
+                    _, messages, *_ = self.redis.xautoclaim(
+                        stream, self.group, consumer, min_idle,
+                        start_id="0-0", count=count - len(reclaimed)
+                    )
+                    for message_id, fields in messages:
+                        if fields:
+                            job = json.loads(fields["job"])
+                            self._track(lane, folder, message_id, job)
+                            reclaimed.append((message_id, job))
+                if folder not in active and self.queued(lane, folder):
+                    self._activate(lane, folder)
+        return reclaimed
+
+    def claim(
+        self,
+        consumer: str,
+        count: int = 1,
+        block_ms: int = 5000
+    ) -> List[Tuple[str, Dict[str, Any]]]:
+        """
+        Claim jobs, highest lane first.
+
+        When nothing is claimable (empty, or lanes at their cap), waits up
+        to block_ms for the next enqueue signal and tries once more.
+
+        Returns:
+            List of (message_id, job) tuples
+        """
+        jobs = self._maintain(consumer, count)
+        for attempt in range(2):
+            for lane in LANES:
+                if len(jobs) >= count:
+                    return jobs
+                jobs.extend(self._claim_lane(lane, consumer, count - len(jobs)))
+            if jobs or not block_ms or attempt:
+                break
+            self.redis.blpop(SIGNAL_KEY, timeout=block_ms / 1000)
+        return jobs
+
+    def stream_of(self, message_id: str, job: Dict[str, Any]) -> str:
+        """Return the folder stream a claimed message came from."""
+        lane, folder = self._claimed[(message_id, job["job_key"])]
+        return self._stream(lane, folder)
+
+    def _release(self, message_id: str, job: Dict[str, Any]):
+        lane, folder = self._claimed.pop((message_id, job["job_key"]))
+        self.redis.zrem(self._key(lane, "inflight"), f"{folder}|{message_id}")
+
+    def ack(self, message_id: str, job: Dict[str, Any], result: Optional[Dict[str, Any]] = None):
+        """Mark a job as completed and free its lane slot."""
+        super().ack(message_id, job, result)
+        self._release(message_id, job)
+
+    def fail(self, message_id: str, job: Dict[str, Any], error: str) -> bool:
+        """
+        Record a failed attempt and free its lane slot.
+
+        The job is retried after the visibility timeout (see JobQueue.fail).
+        """
+        dead = super().fail(message_id, job, error)
+        self._release(message_id, job)
+        return dead
+
+    def queued(self, lane: str, folder: str) -> int:
+        """Number of jobs of a folder not yet delivered to a worker."""
+        stream = self._stream(lane, folder)
+        pending = self.redis.xpending(stream, self.group)
+        pending_count = pending.get("pending", 0) if isinstance(pending, dict) else 0
+        return max(self.redis.xlen(stream) - pending_count, 0)
+
+    def lane_stats(self, lane: str) -> Dict[str, Any]:
+        """Queue depth, in-flight count and wait times of one lane."""
+        depths = {
+            folder: self.queued(lane, folder)
+            for folder in self.redis.smembers(self._key(lane, "folders"))
+        }
+        waits = [float(w) for w in self.redis.lrange(self._key(lane, "waits"), 0, -1)]
+        p50 = percentile(waits, 0.5)
+        p95 = percentile(waits, 0.95)
+        return {
+            "queued": sum(depths.values()),
+            "inflight": self.inflight(lane),
+            "cap": self.lane_caps.get(lane),
+            "folders": {folder: depth for folder, depth in sorted(depths.items()) if depth},
+            "wait_p50_seconds": p50,
+            "wait_p95_seconds": p95,
+            "wait_max_seconds": max(waits) if waits else None,
+            "wait_samples": len(waits)
+        }
+
+    def stats(self) -> Dict[str, Any]:
+        """Return per-lane stats plus totals and the dead-letter count."""
+        lanes = {lane: self.lane_stats(lane) for lane in LANES}
+        return {
+            "queued": sum(lane["queued"] for lane in lanes.values()),
+            "pending": sum(lane["inflight"] for lane in lanes.values()),
+            "dead_letter": self.redis.xlen(self.dead_letter_stream),
+            "lanes": lanes
+        }
+
+
+def get_lane_scheduler(redis_client: Optional[redis.Redis] = None) -> LaneScheduler:
+    """
+    Factory function to create LaneScheduler instance.
+
+    Uses SCHEDULER_LANE_CAPS (e.g. 'backfill=3'), SCHEDULER_FOLDER_WEIGHTS
+    (e.g. 'documents=2,images/archive=0.5') and the JobQueue settings.
+
+    Args:
+        redis_client: Redis connection (auto-created from env if None)
+
+    Returns:
+        LaneScheduler instance
+    """
+    return LaneScheduler(
+        redis_client=redis_client,
+        lane_caps=parse_settings(os.environ.get('SCHEDULER_LANE_CAPS', '')),
+        folder_weights=parse_settings(os.environ.get('SCHEDULER_FOLDER_WEIGHTS', '')),
+        visibility_timeout=float(os.environ.get('QUEUE_VISIBILITY_TIMEOUT', 300)),
+        max_deliveries=int(os.environ.get('QUEUE_MAX_DELIVERIES', 5))
+    )
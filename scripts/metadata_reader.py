@@ -0,0 +1,370 @@
+"""
+Container Metadata Reader for DocuSearch_AI
+Locates the raw EXIF payload inside JPEG, PNG, WebP and HEIC/HEIF files
+by walking segment/chunk/box headers only. Pixel data is never decoded.
+"""
+
+import mmap
+import os
+import struct
+from contextlib import contextmanager
+from typing import Dict, Iterator, Optional, Tuple, Union
+
+
+# Upper bound for the region of a file we are willing to map and walk.
+# Metadata lives in the headers; anything beyond this is image payload.
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+EXIF_HEADER = b"Exif\x00\x00"
+
+Buffer = Union[bytes, bytearray, memoryview, mmap.mmap]
+
+
+def detect_container(buf: Buffer) -> Optional[str]:
+    """
+    Identify the image container from its magic bytes.
+
+    Args:
+        buf: Image bytes (at least the first 16 bytes)
+
+    Returns:
+        'jpeg', 'png', 'webp', 'heif' or None if unknown
+    """
+    head = bytes(buf[:16])
+
+    if head[:2] == b"\xff\xd8":
+        return "jpeg"
+    if head[:8] == PNG_SIGNATURE:
+        return "png"
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "webp"
+    if head[4:8] == b"ftyp":
+        return "heif"
+    return None
+
+
+def find_exif_payload(buf: Buffer) -> Optional[bytes]:
+    """
+    Find the TIFF-structured EXIF payload inside an image container.
+
+    Args:
+        buf: Image bytes, memoryview or mmap
+
+    Returns:
+        EXIF bytes starting at the TIFF header ('II*\\0' or 'MM\\0*'),
+        or None if the container has no EXIF block
+    """
+    container = detect_container(buf)
+
+    try:
+        if container == "jpeg":
+            payload = _find_jpeg_exif(buf)
+        elif container == "png":
+            payload = _find_png_exif(buf)
+        elif container == "webp":
+            payload = _find_webp_exif(buf)
+        elif container == "heif":
+            payload = _find_heif_exif(buf)
+        else:
+            return None
+    except (struct.error, IndexError, ValueError):
+        # Truncated or malformed headers
+        return None
+
+    return _strip_exif_header(payload) if payload else None
+
+
+@contextmanager
+def map_file(file_path: str, max_bytes: int = DEFAULT_MAX_BYTES) -> Iterator[Buffer]:
+    """
+    Map at most max_bytes of a file read-only.
+
+    Only the pages actually touched while walking headers are read from
+    disk, so large HEIC or PNG files cost roughly one or two page reads.
+
+    Args:
+        file_path: Path to the image file
+        max_bytes: Maximum number of bytes to map
+
+    Yields:
+        Read-only buffer over the start of the file
+    """
+    with open(file_path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if size == 0:
+            yield b""
+            return
+
+        length = min(size, max_bytes)
+        mapped = mmap.mmap(f.fileno(), length, access=mmap.ACCESS_READ)
+        try:
+            yield mapped
+        finally:
+            mapped.close()
+
+
+def read_exif_payload(file_path: str, max_bytes: int = DEFAULT_MAX_BYTES) -> Optional[bytes]:
+    """
+    Read the EXIF payload of an image file without loading the whole file.
+
+    Args:
+        file_path: Path to the image file
+        max_bytes: Maximum number of bytes to map
+
+    Returns:
+        EXIF bytes starting at the TIFF header, or None
+    """
+    with map_file(file_path, max_bytes) as buf:
+        return find_exif_payload(buf)
+
+
+def _strip_exif_header(payload: bytes) -> Optional[bytes]:
+    """Drop an optional 'Exif\\0\\0' prefix and validate the TIFF header."""
+    if payload[:6] == EXIF_HEADER:
+        payload = payload[6:]
+    if payload[:4] in (b"II*\x00", b"MM\x00*"):
+        return payload
+    return None
+
+
+def _find_jpeg_exif(buf: Buffer) -> Optional[bytes]:
+    """Walk JPEG marker segments until APP1/Exif or start of scan."""
+    offset = 2
+    end = len(buf)
+
+    while offset + 4 <= end:
+        if buf[offset] != 0xFF:
+            return None
+
+        marker = buf[offset + 1]
+
+        # Fill bytes and standalone markers carry no length
+        if marker == 0xFF:
+            offset += 1
+            continue
+        if marker in (0x01, 0xD8) or 0xD0 <= marker <= 0xD7:
+            offset += 2
+            continue
+
+        # Start of scan / end of image: headers are over
+        if marker in (0xDA, 0xD9):
+            return None
+
+        (length,) = struct.unpack_from(">H", buf, offset + 2)
+        if marker == 0xE1:
+            segment = bytes(buf[offset + 4:offset + 2 + length])
+            if segment[:6] == EXIF_HEADER:
+                return segment
+
+        offset += 2 + length
+
+    return None
+
+
+def _find_png_exif(buf: Buffer) -> Optional[bytes]:
+    """Walk PNG chunks looking for eXIf; IDAT payloads are skipped, not read."""
+    offset = len(PNG_SIGNATURE)
+    end = len(buf)
+
+    while offset + 8 <= end:
+        length, chunk_type = struct.unpack_from(">I4s", buf, offset)
+        data_start = offset + 8
+
+        if chunk_type == b"eXIf":
+            return bytes(buf[data_start:data_start + length])
+        if chunk_type == b"IEND":
+            return None
+
+        # length + type + data + CRC
+        offset = data_start + length + 4
+
+    return None
+
+
+def _find_webp_exif(buf: Buffer) -> Optional[bytes]:
+    """Walk RIFF chunks of a WebP file looking for EXIF."""
+    (riff_size,) = struct.unpack_from("<I", buf, 4)
+    offset = 12
+    end = min(len(buf), 8 + riff_size)
+
+    while offset + 8 <= end:
+        fourcc, size = struct.unpack_from("<4sI", buf, offset)
+        data_start = offset + 8
+
+        if fourcc == b"EXIF":
+            return bytes(buf[data_start:data_start + size])
+
+        # Chunks are padded to an even size
+        offset = data_start + size + (size & 1)
+
+    return None
+
+
+def _iter_boxes(buf: Buffer, start: int, end: int) -> Iterator[Tuple[bytes, int, int]]:
+    """
+    Iterate ISOBMFF boxes in [start, end).
+
+    Yields:
+        (box_type, payload_start, box_end)
+    """
+    offset = start
+    end = min(end, len(buf))
+
+    while offset + 8 <= end:
+        size, box_type = struct.unpack_from(">I4s", buf, offset)
+        header = 8
+
+        if size == 1:
+            (size,) = struct.unpack_from(">Q", buf, offset + 8)
+            header = 16
+        elif size == 0:
+            size = end - offset
+
+        if size < header:
+            return
+
+        box_end = offset + size
+        yield box_type, offset + header, min(box_end, end)
+        offset = box_end
+
+
+def _read_uint(buf: Buffer, offset: int, size: int) -> int:
+    """Read a big-endian unsigned integer of 0, 2, 4 or 8 bytes."""
+    if size == 0:
+        return 0
+    if size == 2:
+        return struct.unpack_from(">H", buf, offset)[0]
+    if size == 4:
+        return struct.unpack_from(">I", buf, offset)[0]
+    if size == 8:
+        return struct.unpack_from(">Q", buf, offset)[0]
+    raise ValueError(f"Unsupported field size: {size}")
+
+
+def _find_heif_exif(buf: Buffer) -> Optional[bytes]:
+    """
+    Locate the Exif item of a HEIC/HEIF file.
+
+    meta (FullBox)
+      ├─ iinf: item infos; the one with item_type 'Exif' gives the item ID
+      ├─ iloc: extents (file or idat offsets) for each item ID
+      └─ idat: inline item data (construction_method 1)
+    """
+    meta = None
+    for box_type, payload, box_end in _iter_boxes(buf, 0, len(buf)):
+        if box_type == b"meta":
+            meta = (payload + 4, box_end)  # skip version/flags
+            break
+
+    if meta is None:
+        return None
+
+    exif_item_id = None
+    locations: Dict[int, Tuple[int, int, list]] = {}
+    idat_start = None
+
+    for box_type, payload, box_end in _iter_boxes(buf, meta[0], meta[1]):
+        if box_type == b"iinf":
+            exif_item_id = _parse_iinf(buf, payload, box_end)
+        elif box_type == b"iloc":
+            locations = _parse_iloc(buf, payload)
+        elif box_type == b"idat":
+            idat_start = payload
+
+    if exif_item_id is None or exif_item_id not in locations:
+        return None
+
+    construction_method, base_offset, extents = locations[exif_item_id]
+    if construction_method == 0:
+        origin = 0
+    elif construction_method == 1 and idat_start is not None:
+        origin = idat_start
+    else:
+        return None
+
+    data = b"".join(
+        bytes(buf[origin + base_offset + offset:origin + base_offset + offset + length])
+        for offset, length in extents
+    )
+
+    # Exif item: 4-byte offset to the TIFF header, then the payload
+    if len(data) < 4:
+        return None
+    (tiff_offset,) = struct.unpack_from(">I", data, 0)
+    return data[4 + tiff_offset:]
+
+
+def _parse_iinf(buf: Buffer, payload: int, box_end: int) -> Optional[int]:
+    """Return the item ID of the 'Exif' item from an iinf box."""
+    version = buf[payload]
+    entries_start = payload + 4 + (2 if version == 0 else 4)
+
+    for box_type, infe, _ in _iter_boxes(buf, entries_start, box_end):
+        if box_type != b"infe":
+            continue
+
+        infe_version = buf[infe]
+        if infe_version < 2:
+            # Version 0/1 entries predate typed items
+            continue
+
+        pos = infe + 4
+        id_size = 2 if infe_version == 2 else 4
+        item_id = _read_uint(buf, pos, id_size)
+        pos += id_size + 2  # item_protection_index
+        if bytes(buf[pos:pos + 4]) == b"Exif":
+            return item_id
+
+    return None
+
+
+def _parse_iloc(buf: Buffer, payload: int) -> Dict[int, Tuple[int, int, list]]:
+    """
+    Parse an iloc box.
+
+    Returns:
+        Mapping of item ID to (construction_method, base_offset, [(offset, length)])
+    """
+    version = buf[payload]
+    pos = payload + 4
+
+    offset_size = buf[pos] >> 4
+    length_size = buf[pos] & 0x0F
+    base_offset_size = buf[pos + 1] >> 4
+    index_size = buf[pos + 1] & 0x0F if version in (1, 2) else 0
+    pos += 2
+
+    count_size = 2 if version < 2 else 4
+    item_count = _read_uint(buf, pos, count_size)
+    pos += count_size
+
+    locations = {}
+    for _ in range(item_count):
+        item_id = _read_uint(buf, pos, count_size)
+        pos += count_size
+
+        construction_method = 0
+        if version in (1, 2):
+            construction_method = _read_uint(buf, pos, 2) & 0x0F
+            pos += 2
+
+        pos += 2  # data_reference_index
+        base_offset = _read_uint(buf, pos, base_offset_size)
+        pos += base_offset_size
+
+        extent_count = _read_uint(buf, pos, 2)
+        pos += 2
+
+        extents = []
+        for _ in range(extent_count):
+            pos += index_size
+            extent_offset = _read_uint(buf, pos, offset_size)
+            pos += offset_size
+            extent_length = _read_uint(buf, pos, length_size)
+            pos += length_size
+            extents.append((extent_offset, extent_length))
+
+        locations[item_id] = (construction_method, base_offset, extents)
+
+    return locations
@@ -0,0 +1,474 @@
+"""
+On-demand Profiler for DocuSearch_AI
+Shows where a running worker spends its time, without a restart.
+
+- Idle cost is zero: no thread, hook or timer runs until a session starts
+- Triggers: SIGUSR2 (stack sampling for PROFILE_SECONDS) or the optional
+  HTTP endpoint (GET /profile?seconds=30&mode=sample|cprofile)
+- 'sample': a thread snapshots every thread's stack (sys._current_frames)
+  at a fixed interval; wall-clock, so time blocked on Dify, Gemini or
+  Redis shows up as well
+- 'cprofile': deterministic profile of the jobs handled during the
+  session (Worker.handle runs under cProfile in every worker thread)
+- Output in PROFILE_DIR: collapsed stacks (flamegraph.pl, speedscope),
+  speedscope JSON, pstats (cprofile) and a top-N summary
+"""
+
+import os
+import sys
+import json
+import time
+import pstats
+import signal
+import socket
+import cProfile
+import threading
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+
+from dotenv import load_dotenv
+
+
+# Load environment variables
+load_dotenv()
+
+MODES = ("sample", "cprofile")
+MAX_SECONDS = 600.0
+
+
+def frame_label(code) -> str:
+    """Flamegraph frame name: function (file:first line)."""
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class StackSampler:
+    """Periodic snapshots of all thread stacks."""
+
+    def __init__(self, interval: float = 0.01):
+        """
+        Initialize sampler.
+
+        Args:
+            interval: Seconds between snapshots
+        """
+        self.interval = interval
+        self._labels: Dict[Any, str] = {}
+
+    def _stack(self, frame) -> Tuple[str, ...]:
+        labels = self._labels
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            label = labels.get(code)
+            if label is None:
+                label = labels[code] = frame_label(code)
+            stack.append(label)
+            frame = frame.f_back
+        stack.reverse()
+        return tuple(stack)
+
+    def sample(self, seconds: float, exclude: Tuple[int, ...] = ()) -> Tuple[Counter, int]:
+        """
+        Sample stacks for a while (blocks the calling thread).
+
+        Args:
+            seconds: Sampling duration
+            exclude: Thread idents to leave out (the caller is always excluded)
+
+        Returns:
+            (Counter of (thread name, stack) -> samples, number of snapshots)
+        """
+        skip = set(exclude) | {threading.get_ident()}
+        counts: Counter = Counter()
+        snapshots = 0
+        end = time.monotonic() + seconds
+        next_tick = time.monotonic()
+
+        while True:
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident not in skip:
+                    counts[(names.get(ident, str(ident)), self._stack(frame))] += 1
+            snapshots += 1
+
+            next_tick += self.interval
+            now = time.monotonic()
+            if now >= end:
+                break
+            # Fixed rate; skip ticks lost to a long GIL hold instead of bursting
+            if next_tick < now:
+                next_tick = now + self.interval
+            time.sleep(min(next_tick, end) - now)
+
+        return counts, snapshots
+
+
+def collapsed_stacks(counts: Counter) -> List[str]:
+    """Brendan Gregg's collapsed format: 'thread;frame;frame count'."""
+    return [
+        ";".join((thread,) + stack) + f" {count}"
+        for (thread, stack), count in sorted(counts.items(), key=lambda item: -item[1])
+    ]
+
+
+def speedscope_profile(counts: Counter, interval: float, name: str) -> Dict[str, Any]:
+    """speedscope file (one sampled profile per thread, weights in seconds)."""
+    frames: List[Dict[str, Any]] = []
+    index: Dict[str, int] = {}
+    threads: Dict[str, Dict[str, Any]] = {}
+
+    for (thread, stack), count in counts.items():
+        profile = threads.setdefault(thread, {"samples": [], "weights": []})
+        sample = []
+        for label in stack:
+            if label not in index:
+                index[label] = len(frames)
+                func, _, location = label.partition(" (")
+                file, _, line = location.rstrip(")").rpartition(":")
+                frames.append({"name": func, "file": file, "line": int(line) if line.isdigit() else None})
+            sample.append(index[label])
+        profile["samples"].append(sample)
+        profile["weights"].append(round(count * interval, 6))
+
+    return {
+        "$schema": "https://www.speedscope.app/file-format-schema.json",
+        "name": name,
+        "exporter": "DocuSearch_AI profiler",
+        "shared": {"frames": frames},
+        "profiles": [
+            {
+                "type": "sampled",
+                "name": thread,
+                "unit": "seconds",
+                "startValue": 0,
+                "endValue": round(sum(profile["weights"]), 6),
+                "samples": profile["samples"],
+                "weights": profile["weights"]
+            }
+            for thread, profile in sorted(threads.items())
+        ]
+    }
+
+
+def top_frames(counts: Counter, top_n: int = 25) -> Dict[str, List[Dict[str, Any]]]:
+    """
+    Hottest frames of a sampled profile.
+
+    Returns:
+        'self' (frame on top of the stack) and 'total' (frame anywhere in
+        the stack) rankings with sample counts and percentages
+    """
+    total = sum(counts.values()) or 1
+    own: Counter = Counter()
+    cumulative: Counter = Counter()
+    for (_, stack), count in counts.items():
+        if stack:
+            own[stack[-1]] += count
+        for label in set(stack):
+            cumulative[label] += count
+
+    def ranking(counter: Counter) -> List[Dict[str, Any]]:
+        return [
+            {"frame": label, "samples": count, "percent": round(100.0 * count / total, 1)}
+            for label, count in counter.most_common(top_n)
+        ]
+
+    return {"self": ranking(own), "total": ranking(cumulative)}
+
+
+def top_functions(stats: pstats.Stats, top_n: int = 25) -> List[Dict[str, Any]]:
+    """Hottest functions of a cProfile run by cumulative time."""
+    rows = []
+    for (file, line, func), (_, calls, own, cumulative, _) in stats.stats.items():
+        rows.append({
+            "frame": f"{func} ({os.path.basename(file)}:{line})",
+            "calls": calls,
+            "self_s": round(own, 4),
+            "total_s": round(cumulative, 4)
+        })
+    rows.sort(key=lambda row: -row["total_s"])
+    return rows[:top_n]
+
+
+class Profiler:
+    """Profiling sessions of a running process (one at a time)."""
+
+    def __init__(
+        self,
+        output_dir: str = "profiles",
+        interval: float = 0.01,
+        top_n: int = 25,
+        log: Optional[Callable[[Dict[str, Any]], None]] = None
+    ):
+        """
+        Initialize profiler.
+
+        Args:
+            output_dir: Directory for profile files
+            interval: Sampling interval in seconds
+            top_n: Frames listed in the summary
+            log: Called with every session summary (default: JSON line on stderr)
+        """
+        self.output_dir = output_dir
+        self.interval = interval
+        self.top_n = top_n
+        self.log = log or (lambda summary: print(json.dumps(summary, ensure_ascii=False), file=sys.stderr))
+        self.last: Optional[Dict[str, Any]] = None
+
+        self._busy = threading.Lock()
+        # Read by call() on every job; only written while a cprofile session runs
+        self._cprofile: Optional[pstats.Stats] = None
+        self._cprofile_lock = threading.Lock()
+        self._cprofile_jobs = 0
+
+    @property
+    def busy(self) -> bool:
+        """Whether a session is running."""
+        return self._busy.locked()
+
+    def call(self, fn: Callable, *args, **kwargs):
+        """
+        Run fn, under cProfile while a cprofile session is active.
+
+        Idle cost is one attribute check.
+        """
+        if self._cprofile is None:
+            return fn(*args, **kwargs)
+
+        profile = cProfile.Profile()
+        try:
+            return profile.runcall(fn, *args, **kwargs)
+        finally:
+            with self._cprofile_lock:
+                # Jobs finishing after the session ended are dropped
+                if self._cprofile is not None:
+                    self._cprofile.add(profile)
+                    self._cprofile_jobs += 1
+
+    def profile(self, seconds: float, mode: str = "sample") -> Dict[str, Any]:
+        """
+        Run a session and write its files (blocks for `seconds`).
+
+        Args:
+            seconds: Session length
+            mode: 'sample' or 'cprofile'
+
+        Returns:
+            Summary: files, sample/job counts and top-N frames
+
+        Raises:
+            ValueError: Unknown mode or bad duration
+            RuntimeError: Another session is running
+        """
+        if mode not in MODES:
+            raise ValueError(f"Unknown mode '{mode}' (expected one of {', '.join(MODES)})")
+        if not 0 < seconds <= MAX_SECONDS:
+            raise ValueError(f"seconds must be in (0, {MAX_SECONDS:.0f}]")
+        if not self._busy.acquire(blocking=False):
+            raise RuntimeError("A profiling session is already running")
+
+        try:
+            os.makedirs(self.output_dir, exist_ok=True)
+            stem = os.path.join(
+                self.output_dir,
+                f"profile-{socket.gethostname()}-{os.getpid()}-{time.strftime('%Y%m%d-%H%M%S')}"
+            )
+            started = time.time()
+            if mode == "sample":
+                summary = self._sample(seconds, stem)
+            else:
+                summary = self._run_cprofile(seconds, stem)
+            summary = {"mode": mode, "started": round(started, 3), "seconds": seconds, **summary}
+
+            with open(f"{stem}.summary.json", "w", encoding="utf-8") as f:
+                json.dump(summary, f, ensure_ascii=False, indent=2)
+            summary["files"]["summary"] = f"{stem}.summary.json"
+            self.last = summary
+            self.log(summary)
+            return summary
+        finally:
+            self._busy.release()
+
+    def _sample(self, seconds: float, stem: str) -> Dict[str, Any]:
+        sampler = StackSampler(self.interval)
+        counts, snapshots = sampler.sample(seconds)
+
+        with open(f"{stem}.collapsed.txt", "w", encoding="utf-8") as f:
+            f.write("\n".join(collapsed_stacks(counts)) + "\n")
+        with open(f"{stem}.speedscope.json", "w", encoding="utf-8") as f:
+            json.dump(speedscope_profile(counts, self.interval, os.path.basename(stem)), f)
+
+        return {
+            "snapshots": snapshots,
+            "threads": len({thread for thread, _ in counts}),
+            "files": {"collapsed": f"{stem}.collapsed.txt", "speedscope": f"{stem}.speedscope.json"},
+            "top": top_frames(counts, self.top_n)
+        }
+
+    def _run_cprofile(self, seconds: float, stem: str) -> Dict[str, Any]:
+        with self._cprofile_lock:
+            self._cprofile = pstats.Stats()
+            self._cprofile_jobs = 0
+        time.sleep(seconds)
+        with self._cprofile_lock:
+            stats, jobs = self._cprofile, self._cprofile_jobs
+            self._cprofile = None
+
+        files = {}
+        top = []
+        if jobs:
+            stats.dump_stats(f"{stem}.pstats")
+            files["pstats"] = f"{stem}.pstats"
+            top = top_functions(stats, self.top_n)
+        return {"jobs": jobs, "files": files, "top": top}
+
+    def start(self, seconds: float, mode: str = "sample") -> threading.Thread:
+        """Run a session in the background (errors are logged, not raised)."""
+        def run():
+            try:
+                self.profile(seconds, mode)
+            except (ValueError, RuntimeError, OSError) as e:
+                self.log({"error": f"Profiling not started: {e}"})
+
+        thread = threading.Thread(target=run, name="profiler", daemon=True)
+        thread.start()
+        return thread
+
+    def install_signal(self, seconds: float = 30.0, signum: int = signal.SIGUSR2):
+        """
+        Start a sampling session whenever the process receives signum.
+
+        Must be called from the main thread.
+        """
+        signal.signal(signum, lambda *_: self.start(seconds))
+
+    def serve(self, port: int, host: str = "0.0.0.0") -> ThreadingHTTPServer:
+        """
+        Serve the profiling endpoint in a daemon thread.
+
+        GET /profile?seconds=30&mode=sample&format=summary|collapsed|speedscope
+            runs a session and returns its summary (or one of its files)
+        GET /profile/last
+            summary of the last session
+        """
+        server = ThreadingHTTPServer((host, port), type("ProfileHandler", (ProfileHandler,), {"profiler": self}))
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, name="profiler-http", daemon=True).start()
+        return server
+
+
+class ProfileHandler(BaseHTTPRequestHandler):
+    """HTTP front end of a Profiler."""
+
+    profiler: Profiler = None
+
+    def log_message(self, format, *args):
+        """Silence per-request logging."""
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == "/profile/last":
+            self._send_json(200, self.profiler.last or {})
+            return
+        if url.path != "/profile":
+            self._send_json(404, {"error": "Not found"})
+            return
+
+        query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        output = query.get("format", "summary")
+        try:
+            summary = self.profiler.profile(float(query.get("seconds", 30)), query.get("mode", "sample"))
+        except ValueError as e:
+            self._send_json(400, {"error": str(e)})
+            return
+        except RuntimeError as e:
+            self._send_json(409, {"error": str(e)})
+            return
+
+        path = summary["files"].get(output)
+        if output == "summary" or path is None:
+            self._send_json(200, summary)
+            return
+        with open(path, "rb") as f:
+            content = f.read()
+        content_type = "text/plain; charset=utf-8" if output == "collapsed" else "application/json"
+        self._send(200, content, content_type)
+
+    def _send(self, status: int, content: bytes, content_type: str):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def _send_json(self, status: int, data: Dict[str, Any]):
+        self._send(status, json.dumps(data, ensure_ascii=False).encode("utf-8"), "application/json")
+
+
+def find_processes(pattern: str) -> List[int]:
+    """PIDs of Python processes whose arguments contain pattern (read from /proc)."""
+    pids = []
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit() or int(entry) == os.getpid():
+            continue
+        try:
+            with open(f"/proc/{entry}/cmdline", "rb") as f:
+                argv = f.read().decode("utf-8", "replace").split("\0")
+        except OSError:
+            continue
+        # Not the 'sh -c "... python job_queue.py worker"' wrapper: SIGUSR2 would kill it
+        if os.path.basename(argv[0]).startswith("python") and any(pattern in arg for arg in argv[1:]):
+            pids.append(int(entry))
+    return pids
+
+
+def get_profiler() -> Profiler:
+    """
+    Factory function to create Profiler instance.
+
+    Uses PROFILE_DIR (default: profiles), PROFILE_INTERVAL_MS (default: 10)
+    and PROFILE_TOP_N (default: 25).
+
+    Returns:
+        Profiler instance
+    """
+    return Profiler(
+        output_dir=os.environ.get('PROFILE_DIR', 'profiles'),
+        interval=float(os.environ.get('PROFILE_INTERVAL_MS', 10)) / 1000.0,
+        top_n=int(os.environ.get('PROFILE_TOP_N', 25))
+    )
+
+
+# For standalone usage
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else ""
+
+    if command == "signal":
+        # The worker is not PID 1 in its container (sh -c), so look it up
+        pattern = sys.argv[2] if len(sys.argv) > 2 else "job_queue.py"
+        pids = find_processes(pattern)
+        for pid in pids:
+            os.kill(pid, signal.SIGUSR2)
+        print(json.dumps({"signalled": pids}))
+        sys.exit(0 if pids else 1)
+    elif command == "fetch" and len(sys.argv) > 2:
+        import requests
+
+        url = sys.argv[2]
+        seconds = float(dict(parse_qs(urlparse(url).query)).get("seconds", ["30"])[-1])
+        response = requests.get(url, timeout=seconds + 60)
+        sys.stdout.write(response.text)
+        sys.exit(0 if response.ok else 1)
+    else:
+        print("Usage: python profiler.py signal [cmdline_pattern]")
+        print("       python profiler.py fetch 'http://localhost:9099/profile?seconds=30&mode=sample&format=summary'")
+        print("\nWorkers (job_queue.py worker/enrich) start a sampling session on SIGUSR2.")
+        print("\nEnvironment variables:")
+        print("  PROFILE_SECONDS - Session length started by SIGUSR2 (default: 30)")
+        print("  PROFILE_PORT - Serve GET /profile on this port (disabled if unset)")
+        print("  PROFILE_DIR - Output directory (default: profiles)")
+        print("  PROFILE_INTERVAL_MS - Sampling interval (default: 10)")
+        print("  PROFILE_TOP_N - Frames in the summary (default: 25)")
+        sys.exit(1)
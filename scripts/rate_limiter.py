@@ -0,0 +1,104 @@
+"""
+Shared Rate Limiter for DocuSearch_AI
+Token bucket in Redis, so all worker threads, processes and containers
+together stay within a provider's request rate (Nominatim: 1 request/s).
+
+- Capacity one: each request reserves the next free slot, interval
+  seconds after the previous one, in a WATCH/MULTI transaction on one key
+- Slots are timed by the Redis server clock, so worker hosts need not agree
+- A caller whose slot would come after its deadline reserves nothing
+"""
+
+import os
+import time
+from typing import Optional
+
+import redis
+from dotenv import load_dotenv
+
+from deadline import Deadline, DeadlineExceeded
+
+
+# Load environment variables
+load_dotenv()
+
+KEY_PREFIX = "docusearch:ratelimit:"
+
+
+class SharedRateLimiter:
+    """Spaces requests interval seconds apart across every client of a Redis key."""
+
+    def __init__(self, redis_client: redis.Redis, name: str, interval: float):
+        """
+        Initialize rate limiter.
+
+        Args:
+            redis_client: Redis connection shared by the workers
+            name: Limited resource (e.g. 'nominatim')
+            interval: Minimum seconds between two requests
+        """
+        self.redis = redis_client
+        self.key = KEY_PREFIX + name
+        self.interval = interval
+
+    def acquire(self, deadline: Optional[Deadline] = None) -> float:
+        """
+        Reserve the next request slot and sleep until it.
+
+        Args:
+            deadline: Latency budget the wait has to fit in
+
+        Returns:
+            Seconds waited
+
+        Raises:
+            DeadlineExceeded: The slot would come after the deadline
+        """
+        with self.redis.pipeline() as pipe:
+            while True:
+                try:
+                    pipe.watch(self.key)
+                    seconds, microseconds = pipe.time()
+                    now = seconds + microseconds / 1e6
+                    wait = max(float(pipe.get(self.key) or 0) - now, 0.0)
+                    if deadline and not deadline.allows(wait):
+                        raise DeadlineExceeded("Deadline exceeded waiting for rate limit")
+                    pipe.multi()
+                    # The key only has to outlive the reserved slots
+                    pipe.set(self.key, now + wait + self.interval, px=int((wait + self.interval) * 1000) + 1000)
+                    pipe.execute()
+                    break
+                except redis.WatchError:
+                    # Another client took a slot meanwhile
+                    continue
+
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+
+def get_rate_limiter(name: str, interval: float) -> Optional[SharedRateLimiter]:
+    """
+    Factory function to create SharedRateLimiter instance.
+
+    Uses REDIS_HOST, REDIS_PORT, REDIS_PASSWORD and REDIS_QUEUE_DB
+    (default 2, the queue's database).
+
+    Args:
+        name: Limited resource (e.g. 'nominatim')
+        interval: Minimum seconds between two requests
+
+    Returns:
+        SharedRateLimiter instance, or None without REDIS_HOST (callers
+        then limit per process)
+    """
+    if not os.environ.get('REDIS_HOST'):
+        return None
+    client = redis.Redis(
+        host=os.environ['REDIS_HOST'],
+        port=int(os.environ.get('REDIS_PORT', 6379)),
+        password=os.environ.get('REDIS_PASSWORD') or None,
+        db=int(os.environ.get('REDIS_QUEUE_DB', 2)),
+        decode_responses=True
+    )
+    return SharedRateLimiter(client, name, interval)
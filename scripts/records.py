@@ -0,0 +1,415 @@
+"""
+Compact Result Records for DocuSearch_AI
+Slotted GeoResult / ImageRecord classes for long-running workers and
+catalogs holding many results.
+
+- __slots__ instead of per-result dicts; coordinates are two floats
+- Repeated strings (country, prefecture, city, town, camera) are interned
+- Compact binary serialization (varints, length-prefixed UTF-8, doubles);
+  dump_records() shares one string table across a whole list
+- to_dict() returns the same dictionaries as before for existing callers
+- hash_cache.HashCache stores processing results as ImageRecord bytes
+"""
+
+import sys
+import struct
+from typing import Optional, Dict, Any, List, Tuple, Iterable
+
+
+# Version 2 added thumbnails; version 1 data is still read
+FORMAT_VERSION = 2
+BULK_MAGIC = b"DSR1"
+
+_DOUBLES = struct.Struct("<dd")
+
+
+def _intern(value: Optional[str]) -> Optional[str]:
+    return sys.intern(value) if value else value
+
+
+def _check_version(version: int):
+    if not 1 <= version <= FORMAT_VERSION:
+        raise ValueError(f"Unsupported record format version: {version}")
+
+
+class _Writer:
+    """Binary writer with an optional shared string table."""
+
+    __slots__ = ("out", "table")
+
+    def __init__(self, table: Optional[Dict[str, int]] = None):
+        self.out = bytearray()
+        self.table = table
+
+    def varint(self, value: int):
+        while value >= 0x80:
+            self.out.append((value & 0x7F) | 0x80)
+            value >>= 7
+        self.out.append(value)
+
+    def string(self, value: str):
+        if self.table is not None:
+            index = self.table.get(value)
+            if index is None:
+                index = self.table[value] = len(self.table)
+            self.varint(index)
+            return
+        data = value.encode('utf-8')
+        self.varint(len(data))
+        self.out += data
+
+
+class _Reader:
+    """Counterpart of _Writer."""
+
+    __slots__ = ("data", "pos", "table")
+
+    def __init__(self, data: bytes, pos: int = 0, table: Optional[List[str]] = None):
+        self.data = data
+        self.pos = pos
+        self.table = table
+
+    def byte(self) -> int:
+        value = self.data[self.pos]
+        self.pos += 1
+        return value
+
+    def varint(self) -> int:
+        result = 0
+        shift = 0
+        while True:
+            byte = self.data[self.pos]
+            self.pos += 1
+            result |= (byte & 0x7F) << shift
+            if byte < 0x80:
+                return result
+            shift += 7
+
+    def string(self) -> str:
+        if self.table is not None:
+            return self.table[self.varint()]
+        length = self.varint()
+        value = self.data[self.pos:self.pos + length].decode('utf-8')
+        self.pos += length
+        return value
+
+    def doubles(self) -> Tuple[float, float]:
+        value = _DOUBLES.unpack_from(self.data, self.pos)
+        self.pos += _DOUBLES.size
+        return value
+
+
+class GeoResult:
+    """Reverse geocoding result (dict view: see Geocoder.reverse_geocode)."""
+
+    __slots__ = ("full_address", "country", "prefecture", "city", "town", "landmark", "formatted", "raw")
+
+    # Serialized in this order, one presence bit each
+    _FIELDS = ("full_address", "country", "prefecture", "city", "town", "landmark", "formatted")
+    _INTERNED = ("country", "prefecture", "city", "town")
+
+    def __init__(
+        self,
+        full_address: str = "",
+        country: str = "",
+        prefecture: str = "",
+        city: str = "",
+        town: str = "",
+        landmark: str = "",
+        formatted: str = "",
+        raw: Optional[Dict[str, Any]] = None
+    ):
+        self.full_address = full_address
+        self.country = _intern(country)
+        self.prefecture = _intern(prefecture)
+        self.city = _intern(city)
+        self.town = _intern(town)
+        self.landmark = landmark
+        self.formatted = formatted
+        self.raw = raw
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any], keep_raw: bool = False) -> "GeoResult":
+        """
+        Build from a provider result dictionary.
+
+        Args:
+            data: Result of Geocoder._nominatim_reverse / _google_reverse
+            keep_raw: Keep the raw provider response (dropped by default)
+        """
+        return cls(
+            *(data.get(name) or "" for name in cls._FIELDS),
+            raw=data.get("raw") if keep_raw else None
+        )
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Dictionary view in the original reverse_geocode format."""
+        result = {name: getattr(self, name) for name in self._FIELDS}
+        result["raw"] = self.raw if self.raw is not None else {}
+        return result
+
+    def _write(self, writer: _Writer):
+        present = [getattr(self, name) for name in self._FIELDS]
+        mask = 0
+        for bit, value in enumerate(present):
+            if value:
+                mask |= 1 << bit
+        writer.varint(mask)
+        for value in present:
+            if value:
+                writer.string(value)
+
+    @classmethod
+    def _read(cls, reader: _Reader) -> "GeoResult":
+        mask = reader.varint()
+        values = [reader.string() if mask & (1 << bit) else "" for bit in range(len(cls._FIELDS))]
+        return cls(*values)
+
+    def to_bytes(self) -> bytes:
+        """Serialize (raw is not included)."""
+        writer = _Writer()
+        writer.out.append(FORMAT_VERSION)
+        self._write(writer)
+        return bytes(writer.out)
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "GeoResult":
+        """Deserialize the output of to_bytes."""
+        _check_version(data[0])
+        return cls._read(_Reader(data, 1))
+
+    def __eq__(self, other):
+        return isinstance(other, GeoResult) and all(
+            getattr(self, name) == getattr(other, name) for name in self._FIELDS
+        )
+
+    def __repr__(self):
+        return f"GeoResult({self.formatted!r})"
+
+
+class ImageRecord:
+    """
+    Image processing result (dict view: see ImageProcessor.process_image).
+
+    metadata_text and full_document_text are derived on demand instead of
+    being stored.
+    """
+
+    __slots__ = ("filename", "datetime", "location", "lat", "lon", "camera",
+                 "vision_caption", "success", "errors", "content_hash", "thumbnails")
+
+    # Optional string fields, one presence bit each; bit 5 = thumbnails,
+    # bit 6 = coordinates, bit 7 = success
+    _STRINGS = ("datetime", "location", "camera", "vision_caption", "content_hash")
+    _THUMBNAILS_BIT = 1 << 5
+    _COORDS_BIT = 1 << 6
+    _SUCCESS_BIT = 1 << 7
+
+    def __init__(
+        self,
+        filename: str,
+        datetime: Optional[str] = None,
+        location: Optional[str] = None,
+        lat: Optional[float] = None,
+        lon: Optional[float] = None,
+        camera: Optional[str] = None,
+        vision_caption: Optional[str] = None,
+        success: bool = True,
+        errors: Iterable[str] = (),
+        content_hash: Optional[str] = None,
+        thumbnails: Optional[Dict[str, str]] = None
+    ):
+        self.filename = filename
+        self.datetime = datetime
+        self.location = _intern(location)
+        self.lat = lat
+        self.lon = lon
+        self.camera = _intern(camera)
+        self.vision_caption = vision_caption
+        self.success = success
+        self.errors = tuple(errors)
+        self.content_hash = content_hash
+        # Thumbnail store keys by longest edge (see thumbnail_store; not
+        # part of the indexed text)
+        self.thumbnails = thumbnails or None
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "ImageRecord":
+        """Build from a process_image result dictionary."""
+        coords = data.get("coordinates") or {}
+        return cls(
+            filename=data["filename"],
+            datetime=data.get("datetime"),
+            location=data.get("location"),
+            lat=coords.get("lat"),
+            lon=coords.get("lon"),
+            camera=data.get("camera"),
+            vision_caption=data.get("vision_caption"),
+            success=data.get("success", True),
+            errors=data.get("errors") or (),
+            content_hash=data.get("content_hash"),
+            thumbnails=data.get("thumbnails")
+        )
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Dictionary view in the original process_image format."""
+        result = {
+            "filename": self.filename,
+            "datetime": self.datetime,
+            "location": self.location,
+            "coordinates": {"lat": self.lat, "lon": self.lon} if self.lat is not None else None,
+            "camera": self.camera,
+            "vision_caption": self.vision_caption,
+            "metadata_text": "",
+            "full_document_text": "",
+            "success": self.success,
+            "errors": list(self.errors),
+            "warnings": []
+        }
+        if self.content_hash:
+            result["content_hash"] = self.content_hash
+        if self.thumbnails:
+            result["thumbnails"] = dict(self.thumbnails)
+        result["metadata_text"] = build_metadata_text(result)
+        result["full_document_text"] = build_document_text(result)
+        return result
+
+    def _write(self, writer: _Writer):
+        mask = self._SUCCESS_BIT if self.success else 0
+        values = [getattr(self, name) for name in self._STRINGS]
+        for bit, value in enumerate(values):
+            if value:
+                mask |= 1 << bit
+        if self.thumbnails:
+            mask |= self._THUMBNAILS_BIT
+        if self.lat is not None:
+            mask |= self._COORDS_BIT
+
+        writer.out.append(mask)
+        writer.string(self.filename)
+        for value in values:
+            if value:
+                writer.string(value)
+        if self.lat is not None:
+            writer.out += _DOUBLES.pack(self.lat, self.lon)
+        writer.varint(len(self.errors))
+        for error in self.errors:
+            writer.string(error)
+        if self.thumbnails:
+            writer.varint(len(self.thumbnails))
+            for size, key in self.thumbnails.items():
+                writer.string(size)
+                writer.string(key)
+
+    @classmethod
+    def _read(cls, reader: _Reader) -> "ImageRecord":
+        mask = reader.byte()
+        filename = reader.string()
+        values = {
+            name: reader.string() if mask & (1 << bit) else None
+            for bit, name in enumerate(cls._STRINGS)
+        }
+        lat, lon = reader.doubles() if mask & cls._COORDS_BIT else (None, None)
+        errors = [reader.string() for _ in range(reader.varint())]
+        thumbnails = None
+        if mask & cls._THUMBNAILS_BIT:
+            thumbnails = {reader.string(): reader.string() for _ in range(reader.varint())}
+        return cls(
+            filename, lat=lat, lon=lon, success=bool(mask & cls._SUCCESS_BIT), errors=errors,
+            thumbnails=thumbnails, **values
+        )
+
+    def to_bytes(self) -> bytes:
+        """Serialize a single record."""
+        writer = _Writer()
+        writer.out.append(FORMAT_VERSION)
+        self._write(writer)
+        return bytes(writer.out)
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "ImageRecord":
+        """Deserialize the output of to_bytes."""
+        _check_version(data[0])
+        return cls._read(_Reader(data, 1))
+
+    def __eq__(self, other):
+        return isinstance(other, ImageRecord) and all(
+            getattr(self, name) == getattr(other, name) for name in self.__slots__
+        )
+
+    def __repr__(self):
+        return f"ImageRecord({self.filename!r})"
+
+
+def dump_records(records: Iterable[ImageRecord]) -> bytes:
+    """
+    Serialize many records with one shared string table.
+
+    Repeated strings (locations, cameras, dates) are stored once.
+    """
+    table: Dict[str, int] = {}
+    body = _Writer(table)
+    count = 0
+    for record in records:
+        record._write(body)
+        count += 1
+
+    header = _Writer()
+    header.out += BULK_MAGIC
+    header.out.append(FORMAT_VERSION)
+    header.varint(len(table))
+    for value in table:
+        header.string(value)
+    header.varint(count)
+    return bytes(header.out + body.out)
+
+
+def load_records(data: bytes) -> List[ImageRecord]:
+    """Deserialize the output of dump_records."""
+    if data[:4] != BULK_MAGIC:
+        raise ValueError("Not a record dump")
+    _check_version(data[4])
+    reader = _Reader(data, 5)
+    table = [sys.intern(reader.string()) for _ in range(reader.varint())]
+    count = reader.varint()
+    reader.table = table
+    return [ImageRecord._read(reader) for _ in range(count)]
+
+
+def build_metadata_text(result: Dict[str, Any]) -> str:
+    """Build structured metadata text from extracted data."""
+    parts = [f"■ファイル名: {result['filename']}"]
+
+    if result.get("datetime"):
+        parts.append(f"■撮影日時: {result['datetime']}")
+
+    if result.get("location"):
+        parts.append(f"■撮影場所: {result['location']}")
+    elif result.get("coordinates"):
+        coords = result["coordinates"]
+        parts.append(f"■座標: 緯度{coords['lat']}, 経度{coords['lon']}")
+
+    if result.get("camera"):
+        parts.append(f"■カメラ: {result['camera']}")
+
+    return "\n".join(parts)
+
+
+def build_document_text(result: Dict[str, Any]) -> str:
+    """
+    Build the full document text for Dify Knowledge Base indexing.
+
+    Format:
+    ■ファイル名: IMG_1234.jpg
+    ■撮影場所: 芝公園, 港区, 東京都, 日本
+    ■撮影日時: 2025-01-15 14:30:00
+    ■画像内容の説明:
+    [Vision AI generated caption]
+    """
+    parts = [result["metadata_text"]]
+
+    if result.get("vision_caption"):
+        parts.append("■画像内容の説明:")
+        parts.append(result["vision_caption"])
+
+    return "\n".join(parts)
@@ -0,0 +1,512 @@
+"""
+Caching Retrieval Proxy for DocuSearch_AI
+Sits between nginx and the Dify API and caches dataset retrieval
+responses.
+
+- Cache key: normalized query + dataset + retrieval settings (+ API key)
+- App endpoints (chat/completion) are passed through uncached: their
+  answers belong to one end user and conversation
+- Eviction: LRU with TTL
+- Invalidation: per-dataset generation counters bumped by the sync
+  pipeline (POST /proxy/invalidate or CacheInvalidator listener); the
+  endpoint requires PROXY_ADMIN_TOKEN as a bearer token
+- Stats: GET /proxy/stats (hit rate, p50/p99 upstream and saved latency)
+- Sharded datasets: retrieval on the SHARD_ALIAS dataset ID fans out to
+  every shard in parallel and merges the records (see shard_router)
+"""
+
+import os
+import re
+import json
+import time
+import hmac
+import hashlib
+import threading
+import unicodedata
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional, Dict, Any, List, Tuple
+
+import requests
+from dotenv import load_dotenv
+
+from shard_router import merge_records, parse_pairs
+
+
+# Load environment variables
+load_dotenv()
+
+RETRIEVE_PATH = re.compile(r"^/v1/datasets/([^/]+)/retrieve$")
+
+# Fan-out retrieval reads from every shard, so it follows every invalidation
+ALL_DATASETS = "*"
+
+HOP_BY_HOP_HEADERS = {
+    "connection", "keep-alive", "proxy-authenticate", "proxy-authorization",
+    "te", "trailers", "transfer-encoding", "upgrade", "content-length",
+    "content-encoding", "host"
+}
+
+
+def normalize_query(query: str) -> str:
+    """
+    Normalize a query so trivially different phrasings share a cache entry.
+
+    NFKC (全角/半角), lowercase, collapsed whitespace and trailing
+    question marks / periods removed.
+    """
+    query = unicodedata.normalize("NFKC", query).lower()
+    query = " ".join(query.split())
+    return query.rstrip("?？。.!！ ")
+
+
+def _percentile(samples, pct: float) -> Optional[float]:
+    """Nearest-rank percentile of a sample collection."""
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100.0 * len(ordered))) - 1))
+    return round(ordered[index], 2)
+
+
+class ResponseCache:
+    """Thread-safe LRU + TTL cache with per-dataset generation invalidation."""
+
+    def __init__(self, max_entries: int = 10000, ttl: float = 600.0, sample_size: int = 10000):
+        """
+        Initialize cache.
+
+        Args:
+            max_entries: Maximum number of cached responses (LRU beyond this)
+            ttl: Seconds a response stays valid
+            sample_size: Number of latency samples kept for percentiles
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, Tuple[float, float, int, bytes, str]]" = OrderedDict()
+        self._generations: Dict[str, int] = {}
+        self._global_generation = 0
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.saved_ms_total = 0.0
+        self._upstream_ms = deque(maxlen=sample_size)
+        self._saved_ms = deque(maxlen=sample_size)
+
+    def generation(self, dataset_id: str) -> int:
+        """Current generation of a dataset (part of every cache key)."""
+        with self._lock:
+            return self._global_generation + self._generations.get(dataset_id, 0)
+
+    def make_key(self, dataset_id: str, parts: Dict[str, Any]) -> str:
+        """
+        Build a cache key.
+
+        Args:
+            dataset_id: Dataset ID (or ALL_DATASETS for shard fan-out)
+            parts: Normalized request parts (query, settings, API key hash)
+        """
+        raw = json.dumps(
+            {"dataset": dataset_id, "generation": self.generation(dataset_id), **parts},
+            sort_keys=True,
+            ensure_ascii=False
+        )
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[Tuple[int, bytes, str]]:
+        """
+        Look up a response.
+
+        Returns:
+            (status, body, content_type) or None on miss/expiry
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < now:
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            self._saved_ms.append(entry[1])
+            self.saved_ms_total += entry[1]
+            return entry[2], entry[3], entry[4]
+
+    def put(self, key: str, status: int, body: bytes, content_type: str, upstream_ms: float):
+        """Store a response with the upstream latency it took to produce."""
+        with self._lock:
+            self._entries[key] = (time.time() + self.ttl, upstream_ms, status, body, content_type)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def record_upstream(self, upstream_ms: float):
+        """Record the latency of a forwarded request."""
+        with self._lock:
+            self._upstream_ms.append(upstream_ms)
+
+    def invalidate(self, dataset_id: Optional[str] = None):
+        """
+        Invalidate cached responses of a dataset (all datasets if None).
+
+        Entries are not scanned: bumping the generation makes old keys
+        unreachable, and LRU/TTL reclaims them.
+        """
+        with self._lock:
+            if dataset_id:
+                self._generations[dataset_id] = self._generations.get(dataset_id, 0) + 1
+                # Fan-out responses may have used this dataset too
+                self._generations[ALL_DATASETS] = self._generations.get(ALL_DATASETS, 0) + 1
+            else:
+                self._global_generation += 1
+            self.invalidations += 1
+
+    def stats(self) -> Dict[str, Any]:
+        """Return hit rate and latency statistics."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "invalidations": self.invalidations,
+                "upstream_ms": {
+                    "p50": _percentile(self._upstream_ms, 50),
+                    "p99": _percentile(self._upstream_ms, 99)
+                },
+                "saved_ms": {
+                    "p50": _percentile(self._saved_ms, 50),
+                    "p99": _percentile(self._saved_ms, 99),
+                    "total": round(self.saved_ms_total, 2)
+                }
+            }
+
+
+def cache_target(path: str, body: Dict[str, Any], authorization: str) -> Optional[Tuple[str, Dict[str, Any]]]:
+    """
+    Decide whether a request is cacheable.
+
+    Only dataset retrieval is cached. App endpoints (chat-messages,
+    completion-messages) return per-user answers with their own
+    conversation and message IDs and are never replayed.
+
+    Args:
+        path: Request path
+        body: Parsed JSON body
+        authorization: Authorization header (distinguishes apps/keys)
+
+    Returns:
+        (dataset_id, key_parts) or None if the request must not be cached
+    """
+    key_hash = hashlib.sha256(authorization.encode("utf-8")).hexdigest()[:16]
+
+    match = RETRIEVE_PATH.match(path)
+    if match:
+        return match.group(1), {
+            "query": normalize_query(str(body.get("query", ""))),
+            "retrieval_model": body.get("retrieval_model"),
+            "auth": key_hash
+        }
+
+    return None
+
+
+class ProxyHandler(BaseHTTPRequestHandler):
+    """HTTP handler forwarding to Dify with response caching."""
+
+    upstream = "http://dify-api:5001"
+    cache: ResponseCache = None
+    timeout = 300
+    # Shard name -> dataset ID, virtual dataset ID that fans out to them
+    shards: Dict[str, str] = {}
+    shard_alias = "shards"
+    pool: ThreadPoolExecutor = None
+    # Bearer token for POST /proxy/invalidate (empty: endpoint disabled)
+    admin_token = ""
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        """Silence per-request logging."""
+
+    def do_GET(self):
+        if self.path == "/proxy/stats":
+            self._send_json(200, self.cache.stats())
+        else:
+            self._forward("GET", self._read_body())
+
+    def do_DELETE(self):
+        self._forward("DELETE", self._read_body())
+
+    def do_PATCH(self):
+        self._forward("PATCH", self._read_body())
+
+    def do_PUT(self):
+        self._forward("PUT", self._read_body())
+
+    def do_POST(self):
+        raw_body = self._read_body()
+
+        if self.path == "/proxy/invalidate":
+            if not self._is_admin():
+                self._send_json(401, {"error": "Invalid or missing proxy admin token"})
+                return
+            try:
+                dataset_id = json.loads(raw_body or b"{}").get("dataset_id")
+            except ValueError:
+                dataset_id = None
+            self.cache.invalidate(dataset_id)
+            self._send_json(200, {"invalidated": dataset_id or ALL_DATASETS})
+            return
+
+        try:
+            body = json.loads(raw_body) if raw_body else {}
+        except ValueError:
+            body = {}
+
+        target = cache_target(self.path, body, self.headers.get("Authorization", "")) if isinstance(body, dict) else None
+        if target is None:
+            self._forward("POST", raw_body)
+            return
+
+        dataset_id, parts = target
+        fan_out = self.shards and dataset_id == self.shard_alias
+        if fan_out:
+            # Every shard's invalidation bumps the ALL_DATASETS generation
+            dataset_id = ALL_DATASETS
+            parts["shards"] = body.get("shards")
+        key = self.cache.make_key(dataset_id, parts)
+        cached = self.cache.get(key)
+        if cached:
+            status, content, content_type = cached
+            self._send(status, content, content_type, {"X-Proxy-Cache": "HIT"})
+            return
+
+        if fan_out:
+            self._fan_out(key, body)
+            return
+
+        try:
+            response, upstream_ms = self._upstream_request("POST", raw_body, stream=False)
+        except requests.exceptions.RequestException as e:
+            self._send_json(502, {"error": str(e)})
+            return
+
+        content_type = response.headers.get("Content-Type", "application/json")
+        if response.status_code == 200:
+            self.cache.put(key, response.status_code, response.content, content_type, upstream_ms)
+        self._send(response.status_code, response.content, content_type, {"X-Proxy-Cache": "MISS"})
+
+    def _fan_out(self, key: str, body: Dict[str, Any]):
+        """
+        Retrieve from the shards in parallel and answer with the merged records.
+
+        The optional body field 'shards' (list of shard names) limits the
+        shards queried. A shard that fails is reported in 'failed_shards'
+        and the partial answer is not cached.
+        """
+        names = body.get("shards") or list(self.shards)
+        unknown = [name for name in names if name not in self.shards]
+        if unknown:
+            self._send_json(400, {"error": f"Unknown shards: {', '.join(map(str, unknown))}"})
+            return
+
+        payload = {k: v for k, v in body.items() if k != "shards"}
+        headers = {k: v for k, v in self.headers.items() if k.lower() not in HOP_BY_HOP_HEADERS}
+
+        def retrieve(name: str) -> Tuple[str, Optional[Dict[str, Any]], Optional[str]]:
+            try:
+                response = requests.post(
+                    f"{self.upstream}/v1/datasets/{self.shards[name]}/retrieve",
+                    headers=headers,
+                    json=payload,
+                    timeout=self.timeout
+                )
+                if response.status_code != 200:
+                    return name, None, f"HTTP {response.status_code}: {response.text[:200]}"
+                return name, response.json(), None
+            except (requests.exceptions.RequestException, ValueError) as e:
+                return name, None, str(e)
+
+        start = time.perf_counter()
+        results = list(self.pool.map(retrieve, names))
+        upstream_ms = (time.perf_counter() - start) * 1000
+        self.cache.record_upstream(upstream_ms)
+
+        responses: List[Tuple[str, Dict[str, Any]]] = [(name, data) for name, data, error in results if error is None]
+        failed = {name: error for name, _, error in results if error is not None}
+        if not responses:
+            self._send_json(502, {"error": "All shards failed", "failed_shards": failed})
+            return
+
+        top_k = (body.get("retrieval_model") or {}).get("top_k")
+        merged = merge_records(responses, top_k)
+        if failed:
+            merged["failed_shards"] = failed
+        content = json.dumps(merged, ensure_ascii=False).encode("utf-8")
+        if not failed:
+            self.cache.put(key, 200, content, "application/json", upstream_ms)
+        self._send(200, content, "application/json", {"X-Proxy-Cache": "MISS"})
+
+    def _read_body(self) -> bytes:
+        length = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(length) if length else b""
+
+    def _upstream_request(self, method: str, body: bytes, stream: bool) -> Tuple[requests.Response, float]:
+        """Send the request to Dify and measure latency."""
+        headers = {k: v for k, v in self.headers.items() if k.lower() not in HOP_BY_HOP_HEADERS}
+        start = time.perf_counter()
+        response = requests.request(
+            method,
+            f"{self.upstream}{self.path}",
+            headers=headers,
+            data=body or None,
+            stream=stream,
+            timeout=self.timeout
+        )
+        upstream_ms = (time.perf_counter() - start) * 1000
+        self.cache.record_upstream(upstream_ms)
+        return response, upstream_ms
+
+    def _forward(self, method: str, body: bytes):
+        """Pass a request through uncached, streaming the response."""
+        try:
+            response, _ = self._upstream_request(method, body, stream=True)
+        except requests.exceptions.RequestException as e:
+            self._send_json(502, {"error": str(e)})
+            return
+
+        self.send_response(response.status_code)
+        for name, value in response.headers.items():
+            if name.lower() not in HOP_BY_HOP_HEADERS:
+                self.send_header(name, value)
+        self.send_header("Transfer-Encoding", "chunked")
+        self.send_header("X-Proxy-Cache", "BYPASS")
+        self.end_headers()
+
+        for chunk in response.raw.stream(8192, decode_content=True):
+            if chunk:
+                self.wfile.write(f"{len(chunk):X}\r\n".encode("ascii") + chunk + b"\r\n")
+                self.wfile.flush()
+        self.wfile.write(b"0\r\n\r\n")
+
+    def _send(self, status: int, content: bytes, content_type: str, extra_headers: Dict[str, str]):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(content)))
+        for name, value in extra_headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(content)
+
+    def _send_json(self, status: int, data: Dict[str, Any]):
+        self._send(status, json.dumps(data, ensure_ascii=False).encode("utf-8"), "application/json", {})
+
+    def _is_admin(self) -> bool:
+        """Check the bearer token of an admin request (always refused without a token set)."""
+        if not self.admin_token:
+            return False
+        supplied = self.headers.get("Authorization", "")
+        return hmac.compare_digest(supplied.encode("utf-8"), f"Bearer {self.admin_token}".encode("utf-8"))
+
+
+class CacheInvalidator:
+    """
+    Sync pipeline listener that invalidates the proxy cache of a dataset
+    whenever a document is added, deleted or renamed (see job_queue.Worker).
+    """
+
+    def __init__(
+        self,
+        proxy_url: Optional[str] = None,
+        dataset_id: Optional[str] = None,
+        admin_token: Optional[str] = None
+    ):
+        """
+        Initialize invalidator.
+
+        Args:
+            proxy_url: Proxy base URL (e.g. http://retrieval-proxy:8090)
+            dataset_id: Dataset the worker writes to (all datasets when
+                        DIFY_SHARDS is set: a worker writes to every shard)
+            admin_token: Proxy admin token (PROXY_ADMIN_TOKEN if None)
+        """
+        self.proxy_url = (proxy_url or os.environ.get('RETRIEVAL_PROXY_URL', 'http://retrieval-proxy:8090')).rstrip('/')
+        self.admin_token = admin_token or os.environ.get('PROXY_ADMIN_TOKEN', '')
+        if dataset_id is None and not os.environ.get('DIFY_SHARDS'):
+            dataset_id = os.environ.get('DIFY_DATASET_ID')
+        self.dataset_id = dataset_id
+
+    def invalidate(self):
+        """Ask the proxy to drop cached responses for the dataset."""
+        response = requests.post(
+            f"{self.proxy_url}/proxy/invalidate",
+            headers={"Authorization": f"Bearer {self.admin_token}"},
+            json={"dataset_id": self.dataset_id},
+            timeout=5
+        )
+        response.raise_for_status()
+
+    def document_added(self, name: str, text: str, document_id: Optional[str] = None):
+        self.invalidate()
+
+    def document_deleted(self, name: str, document_id: Optional[str] = None):
+        self.invalidate()
+
+    def document_renamed(self, old_name: str, new_name: str, document_id: Optional[str] = None):
+        self.invalidate()
+
+
+def create_server(
+    host: str = "0.0.0.0",
+    port: int = 8090,
+    upstream: Optional[str] = None,
+    cache: Optional[ResponseCache] = None,
+    shards: Optional[Dict[str, str]] = None,
+    admin_token: Optional[str] = None
+) -> ThreadingHTTPServer:
+    """
+    Factory function to create the proxy server.
+
+    Args:
+        host: Bind address
+        port: Bind port
+        upstream: Dify API base URL (without /v1)
+        cache: ResponseCache instance (created from env if None)
+        shards: Shard name -> dataset ID (parsed from DIFY_SHARDS if None)
+        admin_token: Token required by POST /proxy/invalidate
+                     (PROXY_ADMIN_TOKEN if None; invalidation is refused
+                     when neither is set)
+
+    Returns:
+        ThreadingHTTPServer ready for serve_forever()
+    """
+    handler = type("DifyProxyHandler", (ProxyHandler,), {
+        "upstream": (upstream or os.environ.get('DIFY_UPSTREAM_URL', 'http://dify-api:5001')).rstrip('/'),
+        "cache": cache or ResponseCache(
+            max_entries=int(os.environ.get('PROXY_CACHE_MAX_ENTRIES', 10000)),
+            ttl=float(os.environ.get('PROXY_CACHE_TTL', 600))
+        ),
+        "shards": shards if shards is not None else dict(parse_pairs(os.environ.get('DIFY_SHARDS', ''))),
+        "shard_alias": os.environ.get('SHARD_ALIAS', 'shards'),
+        "admin_token": admin_token if admin_token is not None else os.environ.get('PROXY_ADMIN_TOKEN', ''),
+        "pool": ThreadPoolExecutor(
+            max_workers=int(os.environ.get('PROXY_FANOUT_WORKERS', 16)), thread_name_prefix="fanout"
+        )
+    })
+    return ThreadingHTTPServer((host, port), handler)
+
+
+# For standalone usage
+if __name__ == "__main__":
+    port = int(os.environ.get('PROXY_PORT', 8090))
+    server = create_server(port=port)
+    print(f"Retrieval proxy listening on :{port} -> {server.RequestHandlerClass.upstream}")
+    server.serve_forever()
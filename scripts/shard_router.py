@@ -0,0 +1,328 @@
+"""
+Dataset Shard Router for DocuSearch_AI
+Spreads documents over several Dify datasets (shards).
+
+- Shard key per document: media type, top-level folder, capture year
+  (EXIF, file mtime as fallback) or the full path
+- Ordered rules (glob on the key or relative path -> shard) pin documents
+  to a shard; everything else is placed by rendezvous hashing, so adding
+  a shard moves only ~1/(N+1) of the documents
+- The shard of every submitted path is kept in the sync manifest
+  (hash_cache 'indexed' table); 'rebalance' moves only misplaced documents
+- Retrieval fans out to the shards in parallel and merges the records by
+  score (see retrieval_proxy, SHARD_ALIAS)
+"""
+
+import os
+import json
+import time
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from fnmatch import fnmatchcase
+from typing import Optional, Dict, Any, List, Tuple
+
+from dotenv import load_dotenv
+
+from dify_client import DifyClient, get_dify_client
+from folder_sync import IMAGE_EXTENSIONS, WATCH_ROOT, top_level_folder
+from dir_scanner import has_extension
+from hash_cache import HashCache
+
+
+# Load environment variables
+load_dotenv()
+
+SHARD_KEYS = ("media", "folder", "year", "path")
+DEFAULT_SHARD_KEY = "folder"
+
+
+def parse_pairs(value: str) -> List[Tuple[str, str]]:
+    """Parse 'left=right,left=right' into an ordered list of pairs."""
+    pairs = []
+    for item in value.split(','):
+        left, _, right = item.strip().partition('=')
+        if left and right:
+            pairs.append((left.strip(), right.strip()))
+    return pairs
+
+
+def media_type(relative_path: str) -> str:
+    """Media type of a document name ('image' or 'document')."""
+    if relative_path.startswith("images/") or has_extension(relative_path, IMAGE_EXTENSIONS):
+        return "image"
+    return "document"
+
+
+def capture_year(path: str) -> str:
+    """
+    Year a file was taken (images: EXIF capture date) or last modified.
+
+    Returns:
+        Four-digit year, or 'unknown' if the file cannot be read
+    """
+    if has_extension(path, IMAGE_EXTENSIONS):
+        try:
+            from exif_extractor import extract_exif_from_file
+            taken = extract_exif_from_file(path).get("datetime")
+            if taken and taken[:4].isdigit():
+                return taken[:4]
+        except Exception:
+            pass
+    try:
+        return str(datetime.fromtimestamp(os.stat(path).st_mtime).year)
+    except OSError:
+        return "unknown"
+
+
+def rendezvous_score(shard: str, key: str) -> int:
+    """Highest-random-weight score of a key on a shard."""
+    digest = hashlib.blake2b(f"{shard}\0{key}".encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "big")
+
+
+def merge_records(responses: List[Tuple[str, Dict[str, Any]]], top_k: Optional[int] = None) -> Dict[str, Any]:
+    """
+    Merge retrieve responses of several shards.
+
+    Records are ordered by score across shards (the shards share the
+    embedding and rerank settings, so scores are comparable) and cut to
+    top_k, or to the largest per-shard result when top_k is not given.
+
+    Args:
+        responses: (shard name, Dify retrieve response) pairs
+        top_k: Records to keep
+
+    Returns:
+        Retrieve response with 'query' and 'records' (each tagged with 'shard')
+    """
+    records = []
+    for shard, data in responses:
+        for record in data.get("records") or []:
+            records.append({**record, "shard": shard})
+    records.sort(key=lambda record: record.get("score") or 0.0, reverse=True)
+
+    limit = top_k or max((len(data.get("records") or []) for _, data in responses), default=0)
+    query = next((data["query"] for _, data in responses if data.get("query")), None)
+    return {"query": query, "records": records[:limit]}
+
+
+class ShardRouter:
+    """Assigns documents to datasets and keeps sync actions on the right shard."""
+
+    def __init__(
+        self,
+        shards: Dict[str, str],
+        key: str = DEFAULT_SHARD_KEY,
+        rules: Optional[List[Tuple[str, str]]] = None,
+        manifest: Optional[HashCache] = None,
+        watch_root: str = WATCH_ROOT
+    ):
+        """
+        Initialize router.
+
+        Args:
+            shards: Shard name -> Dify dataset ID
+            key: Shard key ('media', 'folder', 'year' or 'path')
+            rules: Ordered (glob, shard name) pairs; a glob matches the shard
+                   key or the relative path, the first match wins
+            manifest: HashCache whose sync manifest records each path's shard
+            watch_root: Watch root used to build absolute paths
+
+        Raises:
+            ValueError: No shards, unknown key or a rule naming an unknown shard
+        """
+        if not shards:
+            raise ValueError("At least one shard required. Set DIFY_SHARDS (name=dataset_id,...).")
+        if key not in SHARD_KEYS:
+            raise ValueError(f"Unknown shard key '{key}' (expected one of {', '.join(SHARD_KEYS)})")
+        self.rules = rules or []
+        unknown = [shard for _, shard in self.rules if shard not in shards]
+        if unknown:
+            raise ValueError(f"Shard rules name unknown shards: {', '.join(unknown)}")
+
+        self.shards = dict(shards)
+        self.key = key
+        self.manifest = manifest
+        self.watch_root = watch_root.rstrip('/')
+        self.names = {dataset_id: name for name, dataset_id in self.shards.items()}
+        # Shards that rules fill are kept out of hashing (unless rules name them all)
+        pinned = {shard for _, shard in self.rules}
+        self.pool = [name for name in self.shards if name not in pinned] or list(self.shards)
+
+    def shard_key(self, relative_path: str, path: Optional[str] = None) -> str:
+        """Shard key of a document (path is read for the 'year' key)."""
+        if self.key == "media":
+            return media_type(relative_path)
+        if self.key == "folder":
+            return top_level_folder(relative_path)
+        if self.key == "year":
+            return capture_year(path or f"{self.watch_root}/{relative_path}")
+        return relative_path
+
+    def route(self, relative_path: str, path: Optional[str] = None) -> str:
+        """
+        Shard a document belongs on.
+
+        Returns:
+            Shard name
+        """
+        key = self.shard_key(relative_path, path)
+        for pattern, shard in self.rules:
+            if fnmatchcase(key, pattern) or fnmatchcase(relative_path, pattern):
+                return shard
+        return max(self.pool, key=lambda shard: rendezvous_score(shard, key))
+
+    def dataset_for(self, relative_path: str, path: Optional[str] = None) -> str:
+        """Dataset ID a document belongs in."""
+        return self.shards[self.route(relative_path, path)]
+
+    def locate(self, relative_path: str, path: Optional[str] = None) -> str:
+        """Dataset ID a document was submitted to (manifest), else where it belongs."""
+        recorded = self.manifest.indexed_dataset(relative_path) if self.manifest else None
+        return recorded or self.dataset_for(relative_path, path)
+
+    def list_documents(self, client: DifyClient) -> List[Dict[str, Any]]:
+        """
+        List the documents of every shard in parallel.
+
+        Returns:
+            Document dictionaries with 'dataset_id' set to their shard's dataset
+        """
+        def fetch(dataset_id: str) -> List[Dict[str, Any]]:
+            return [{**doc, "dataset_id": dataset_id} for doc in client.list_documents(dataset_id)]
+
+        with ThreadPoolExecutor(max_workers=len(self.shards)) as pool:
+            return [doc for docs in pool.map(fetch, self.shards.values()) for doc in docs]
+
+    def assign(self, actions: List[Dict[str, Any]], existing_docs: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Attach the target dataset to sync actions (datasetId).
+
+        Adds go where the document belongs; deletes, updates and renames
+        stay on the dataset that holds the document.
+
+        Args:
+            actions: Actions from FolderSync.plan()
+            existing_docs: Documents from list_documents()
+
+        Returns:
+            The same actions
+        """
+        held_by = {doc.get("id"): doc.get("dataset_id") for doc in existing_docs}
+        for action in actions:
+            if action.get("documentId") in held_by:
+                action["datasetId"] = held_by[action["documentId"]]
+            elif action["action"] == "add":
+                action["datasetId"] = self.dataset_for(action["relativePath"], action["path"])
+        return actions
+
+    def rebalance(self, existing_docs: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Plan moves of documents that are not on the shard they belong on.
+
+        Only misplaced documents move (after adding a shard: ~1/(N+1) of
+        them). A move is a forced 'update' that uploads the file into the
+        new dataset and deletes the old document (oldDatasetId).
+
+        Args:
+            existing_docs: Documents from list_documents()
+
+        Returns:
+            update actions (same shape as FolderSync.plan())
+        """
+        marker = f"{time.time():.6f}"
+        actions = []
+
+        for doc in existing_docs:
+            name = doc.get("name") or ""
+            path = f"{self.watch_root}/{name}"
+            if not os.path.exists(path):
+                # Gone locally: the next sync deletes it
+                continue
+
+            target = self.dataset_for(name, path)
+            if doc.get("dataset_id") == target:
+                continue
+
+            actions.append({
+                "path": path,
+                "name": os.path.basename(name),
+                "relativePath": name,
+                "type": media_type(name),
+                "action": "update",
+                "documentId": doc.get("id"),
+                "datasetId": target,
+                "oldDatasetId": doc.get("dataset_id"),
+                # The content is already indexed once: bypass the done check
+                "reindex": marker
+            })
+        return actions
+
+    def stats(self, existing_docs: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """Documents per shard and how many of them are misplaced."""
+        shards = {name: {"dataset_id": dataset_id, "documents": 0} for name, dataset_id in self.shards.items()}
+        for doc in existing_docs:
+            name = self.names.get(doc.get("dataset_id"))
+            if name:
+                shards[name]["documents"] += 1
+        return {
+            "key": self.key,
+            "shards": shards,
+            "misplaced": len(self.rebalance(existing_docs))
+        }
+
+
+def get_shard_router(manifest: Optional[HashCache] = None) -> ShardRouter:
+    """
+    Factory function to create ShardRouter instance.
+
+    Uses DIFY_SHARDS (name=dataset_id,...), SHARD_KEY (media, folder,
+    year or path; default folder) and SHARD_RULES (glob=shard,...).
+
+    Args:
+        manifest: HashCache holding the sync manifest
+
+    Returns:
+        ShardRouter instance
+    """
+    return ShardRouter(
+        shards=dict(parse_pairs(os.environ.get('DIFY_SHARDS', ''))),
+        key=os.environ.get('SHARD_KEY', DEFAULT_SHARD_KEY),
+        rules=parse_pairs(os.environ.get('SHARD_RULES', '')),
+        manifest=manifest,
+        watch_root=WATCH_ROOT
+    )
+
+
+# For standalone usage
+if __name__ == "__main__":
+    import sys
+
+    command = sys.argv[1] if len(sys.argv) > 1 else ""
+
+    if command == "route" and len(sys.argv) > 2:
+        router = get_shard_router()
+        print(json.dumps({path: router.route(path) for path in sys.argv[2:]}, ensure_ascii=False, indent=2))
+    elif command == "stats":
+        router = get_shard_router()
+        print(json.dumps(router.stats(router.list_documents(get_dify_client())), ensure_ascii=False, indent=2))
+    elif command == "rebalance":
+        from hash_cache import get_hash_cache
+        from job_queue import enqueue_actions, get_queue
+
+        hash_cache = get_hash_cache()
+        router = get_shard_router(manifest=hash_cache)
+        actions = router.rebalance(router.list_documents(get_dify_client()))
+        if "--dry-run" in sys.argv[2:]:
+            print(json.dumps(actions, ensure_ascii=False, indent=2))
+        else:
+            print(json.dumps(enqueue_actions(get_queue(), actions, hash_cache), ensure_ascii=False))
+    else:
+        print("Usage: python shard_router.py <route <relative_path>...|stats|rebalance [--dry-run]>")
+        print("\nEnvironment variables:")
+        print("  DIFY_SHARDS - Shard datasets (e.g. photos=<dataset_id>,docs=<dataset_id>)")
+        print("  SHARD_KEY - media, folder, year or path (default: folder)")
+        print("  SHARD_RULES - Pinned shards, first match wins (e.g. documents*=docs,201?=archive)")
+        print("  HASH_CACHE_PATH - Sync manifest recording each path's shard")
+        sys.exit(1)
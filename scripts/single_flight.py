@@ -0,0 +1,151 @@
+"""
+Single-Flight Request Coalescing for DocuSearch_AI
+Concurrent callers asking for the same key share one in-flight call.
+
+The first caller (leader) executes the function; callers arriving while
+it runs wait for the leader's result (or exception) instead of issuing a
+duplicate request. Used for rate-limited geocoding and Gemini captions.
+
+Works from threads (do) and from asyncio (do_async). Async callers
+coalesce among themselves without blocking threads, and the async leader
+joins the threaded flight, so both modes share one request per key.
+"""
+
+import asyncio
+import threading
+from typing import Any, Callable, Dict, Hashable, Optional
+
+
+class _Call:
+    """In-flight call shared by the leader and its waiters."""
+
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: BaseException = None
+
+
+class SingleFlight:
+    """Coalesce concurrent calls with identical keys."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[Hashable, _Call] = {}
+        self._async_calls: Dict[Any, Dict[Hashable, asyncio.Future]] = {}
+
+        self.executed = 0
+        self.deduplicated = 0
+
+    def do(
+        self,
+        key: Hashable,
+        fn: Callable[..., Any],
+        *args,
+        timeout: Optional[float] = None
+    ) -> Any:
+        """
+        Execute fn once for all concurrent callers with the same key.
+
+        Args:
+            key: Request identity (e.g. rounded coordinates, content hash)
+            fn: Function performing the request
+            *args: Passed to fn
+            timeout: Maximum seconds a waiter blocks on another caller's request
+
+        Returns:
+            Result of fn (exceptions are re-raised in every waiter)
+
+        Raises:
+            TimeoutError: Waited longer than timeout
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                self.deduplicated += 1
+                leader = False
+            else:
+                call = self._calls[key] = _Call()
+                self.executed += 1
+                leader = True
+
+        if not leader:
+            if not call.done.wait(timeout):
+                raise TimeoutError(f"Timed out waiting for in-flight request {key!r}")
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn(*args)
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+        return call.result
+
+    async def do_async(
+        self,
+        key: Hashable,
+        fn: Callable[..., Any],
+        *args,
+        timeout: Optional[float] = None
+    ) -> Any:
+        """
+        Async variant of do() for blocking functions.
+
+        The leader runs fn in the default executor through do(), so it also
+        coalesces with threaded callers; async waiters await a future.
+
+        Args:
+            key: Request identity
+            fn: Blocking function performing the request
+            *args: Passed to fn
+            timeout: Maximum seconds a waiter blocks on another caller's request
+
+        Returns:
+            Result of fn
+        """
+        loop = asyncio.get_running_loop()
+        calls = self._async_calls.setdefault(loop, {})
+
+        future = calls.get(key)
+        if future is not None:
+            with self._lock:
+                self.deduplicated += 1
+            # shield: a cancelled waiter must not cancel the shared call
+            return await asyncio.wait_for(asyncio.shield(future), timeout)
+
+        future = calls[key] = loop.create_future()
+        try:
+            result = await loop.run_in_executor(None, lambda: self.do(key, fn, *args, timeout=timeout))
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            # Retrieve once so an unawaited failure is not logged as an error
+            future.exception()
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            del calls[key]
+            if not calls:
+                self._async_calls.pop(loop, None)
+
+    def in_flight(self) -> int:
+        """Number of keys currently being executed."""
+        with self._lock:
+            return len(self._calls)
+
+    def stats(self) -> Dict[str, int]:
+        """Executed and deduplicated call counts."""
+        with self._lock:
+            return {"executed": self.executed, "deduplicated": self.deduplicated}
@@ -0,0 +1,449 @@
+"""
+Soak Test Harness for DocuSearch_AI
+Pushes a long synthetic image corpus through ImageProcessor against local
+Nominatim/Gemini stubs and tracks memory growth.
+
+- Images are generated in memory (small JPEG + EXIF with GPS, camera, date)
+- Stubs run in a separate process, so only the pipeline is measured
+- Every interval: gc, RSS sample, tracemalloc snapshot, live object counts
+- Report: growth per 10k images (least squares over samples) and the top
+  allocation growth sites between the first and last snapshot
+- Exit status 1 when growth per 10k images exceeds --max-growth-mb
+"""
+
+import io
+import gc
+import os
+import sys
+import json
+import time
+import struct
+import sysconfig
+import tracemalloc
+import multiprocessing
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+from typing import Optional, Dict, Any, List, Tuple
+
+from PIL import Image
+
+from geocoder import Geocoder
+from image_processor import ImageProcessor
+from records import GeoResult
+
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+STDLIB_DIR = sysconfig.get_paths()["stdlib"]
+
+# Frames excluded from growth sites (the harness itself and tracemalloc)
+IGNORED_FILES = (os.path.abspath(__file__), tracemalloc.__file__)
+
+PREFECTURES = ["東京都", "神奈川県", "大阪府", "京都府", "愛知県", "福岡県", "北海道", "沖縄県"]
+CAMERAS = [("Apple", "iPhone 15 Pro"), ("SONY", "ILCE-7M4"), ("Canon", "EOS R6"), ("FUJIFILM", "X-T5")]
+
+
+# ---- Synthetic corpus ----
+
+def _tiff_ifd(entries: List[Tuple[int, int, int, bytes]], offset: int) -> bytes:
+    """
+    Encode one little-endian TIFF IFD located at offset.
+
+    Args:
+        entries: (tag, type, count, payload) sorted by tag
+        offset: Absolute position of the IFD in the TIFF stream
+    """
+    data_offset = offset + 2 + len(entries) * 12 + 4
+    head = [struct.pack("<H", len(entries))]
+    data = bytearray()
+
+    for tag, value_type, count, payload in entries:
+        if len(payload) <= 4:
+            head.append(struct.pack("<HHI", tag, value_type, count) + payload.ljust(4, b"\0"))
+        else:
+            head.append(struct.pack("<HHII", tag, value_type, count, data_offset + len(data)))
+            data += payload
+            if len(data) % 2:
+                data.append(0)
+
+    head.append(struct.pack("<I", 0))
+    return b"".join(head) + bytes(data)
+
+
+def _ascii(value: str) -> Tuple[int, int, bytes]:
+    encoded = value.encode("ascii") + b"\0"
+    return 2, len(encoded), encoded
+
+
+def _dms(value: float) -> Tuple[int, int, bytes]:
+    degrees = int(value)
+    minutes = int((value - degrees) * 60)
+    millis = round(((value - degrees) * 60 - minutes) * 60 * 1000)
+    return 5, 3, struct.pack("<6I", degrees, 1, minutes, 1, millis, 1000)
+
+
+def build_exif(lat: float, lon: float, make: str, model: str, taken: str) -> bytes:
+    """
+    Build a TIFF-structured EXIF payload with camera, datetime and GPS tags.
+
+    Written by hand so the harness does not allocate through Pillow's EXIF
+    code, which is itself under test.
+    """
+    gps = [
+        (0x0001, *_ascii("N" if lat >= 0 else "S")),
+        (0x0002, *_dms(abs(lat))),
+        (0x0003, *_ascii("E" if lon >= 0 else "W")),
+        (0x0004, *_dms(abs(lon))),
+    ]
+
+    def ifd0(gps_offset: int) -> bytes:
+        return _tiff_ifd([
+            (0x010F, *_ascii(make)),
+            (0x0110, *_ascii(model)),
+            (0x0132, *_ascii(taken)),
+            (0x8825, 4, 1, struct.pack("<I", gps_offset)),
+        ], 8)
+
+    gps_offset = 8 + len(ifd0(0))
+    return b"II*\0" + struct.pack("<I", 8) + ifd0(gps_offset) + _tiff_ifd(gps, gps_offset)
+
+
+class SyntheticCorpus:
+    """Deterministic stream of small JPEGs with distinct EXIF."""
+
+    def __init__(self, locations: int = 0):
+        """
+        Args:
+            locations: Number of distinct GPS points to cycle through
+                       (0 = every image has its own point)
+        """
+        self.locations = locations
+        buffer = io.BytesIO()
+        Image.new("RGB", (64, 48), (120, 160, 200)).save(buffer, "JPEG", quality=80)
+        self.base_jpeg = buffer.getvalue()
+
+    def coordinates(self, index: int) -> Tuple[float, float]:
+        point = index % self.locations if self.locations else index
+        return 33.0 + (point // 2000) * 0.0005, 130.0 + (point % 2000) * 0.0005
+
+    def image(self, index: int) -> Tuple[str, bytes]:
+        """Filename and JPEG bytes of image number index."""
+        lat, lon = self.coordinates(index)
+        make, model = CAMERAS[index % len(CAMERAS)]
+        taken = time.strftime("%Y:%m:%d %H:%M:%S", time.gmtime(1700000000 + index * 37))
+
+        payload = b"Exif\0\0" + build_exif(lat, lon, make, model, taken)
+        segment = b"\xff\xe1" + struct.pack(">H", len(payload) + 2) + payload
+        return f"IMG_{index:07d}.jpg", self.base_jpeg[:2] + segment + self.base_jpeg[2:]
+
+
+# ---- Local stubs ----
+
+class _StubHandler(BaseHTTPRequestHandler):
+    """Nominatim reverse and Gemini generateContent look-alikes."""
+
+    latency = 0.0
+    disable_nagle_algorithm = True
+
+    def _reply(self, body: Dict[str, Any]):
+        if self.latency:
+            time.sleep(self.latency)
+        data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        query = parse_qs(urlparse(self.path).query)
+        lat = float(query.get("lat", ["0"])[0])
+        lon = float(query.get("lon", ["0"])[0])
+        block = int(lat * 2000) * 2000 + int(lon * 2000)
+        prefecture = PREFECTURES[block % len(PREFECTURES)]
+        address = {
+            "country": "日本",
+            "state": prefecture,
+            "city": f"第{block % 97}市",
+            "suburb": f"{block % 1013}丁目",
+            "amenity": f"施設{block}"
+        }
+        self._reply({"display_name": f"施設{block}, {address['suburb']}, {address['city']}, {prefecture}, 日本",
+                     "address": address})
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        self.rfile.read(length)
+        caption = "屋外で撮影された写真。晴れた日の街並みと建物が写っている。" * 4
+        self._reply({"candidates": [{"content": {"parts": [{"text": caption}]}}]})
+
+    def log_message(self, format, *args):
+        pass
+
+
+def _serve_stubs(port_queue, latency: float):
+    _StubHandler.latency = latency
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _StubHandler)
+    server.daemon_threads = True
+    port_queue.put(server.server_address[1])
+    server.serve_forever()
+
+
+def start_stubs(latency: float = 0.0) -> Tuple[multiprocessing.Process, str]:
+    """Start the stub server in a child process and return it with its base URL."""
+    port_queue = multiprocessing.Queue()
+    process = multiprocessing.Process(target=_serve_stubs, args=(port_queue, latency), daemon=True)
+    process.start()
+    return process, f"http://127.0.0.1:{port_queue.get(timeout=10)}"
+
+
+# ---- Measurement ----
+
+def rss_bytes() -> int:
+    """Current resident set size (peak RSS where /proc is unavailable)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def live_objects() -> Dict[str, int]:
+    """Live instances of the types suspected of accumulating."""
+    import requests
+
+    watched = {"PIL.Image": Image.Image, "requests.Response": requests.Response, "GeoResult": GeoResult}
+    counts = dict.fromkeys(watched, 0)
+    for obj in gc.get_objects():
+        for name, cls in watched.items():
+            if isinstance(obj, cls):
+                counts[name] += 1
+    return counts
+
+
+def growth_per_10k(samples: List[Dict[str, Any]], field: str) -> float:
+    """Least-squares slope of field (MB) over images, scaled to 10k images."""
+    if len(samples) < 2:
+        return 0.0
+    xs = [s["images"] for s in samples]
+    ys = [s[field] for s in samples]
+    mean_x = sum(xs) / len(xs)
+    mean_y = sum(ys) / len(ys)
+    denominator = sum((x - mean_x) ** 2 for x in xs)
+    if not denominator:
+        return 0.0
+    slope = sum((x - mean_x) * (y - mean_y) for x, y in zip(xs, ys)) / denominator
+    return round(slope * 10000, 3)
+
+
+def _site(frame) -> str:
+    path = frame.filename
+    if path.startswith(SCRIPTS_DIR):
+        path = os.path.relpath(path, SCRIPTS_DIR)
+    elif "site-packages" in path:
+        path = path.split("site-packages" + os.sep, 1)[1]
+    elif path.startswith(STDLIB_DIR):
+        path = os.path.relpath(path, STDLIB_DIR)
+    return f"{path}:{frame.lineno}"
+
+
+def top_growth(
+    baseline: tracemalloc.Snapshot,
+    final: tracemalloc.Snapshot,
+    limit: int = 15
+) -> List[Dict[str, Any]]:
+    """Allocation sites that grew the most between two snapshots."""
+    filters = [tracemalloc.Filter(False, path) for path in IGNORED_FILES]
+    filters.append(tracemalloc.Filter(False, "<frozen importlib._bootstrap*>"))
+    key_type = "traceback" if tracemalloc.get_traceback_limit() > 1 else "lineno"
+
+    stats = final.filter_traces(filters).compare_to(baseline.filter_traces(filters), key_type)
+    sites = []
+    for stat in stats:
+        if stat.size_diff <= 0:
+            continue
+        sites.append({
+            "site": _site(stat.traceback[0]) if key_type == "lineno" else [_site(f) for f in stat.traceback],
+            "size_diff_kb": round(stat.size_diff / 1024, 1),
+            "count_diff": stat.count_diff,
+            "size_kb": round(stat.size / 1024, 1)
+        })
+        if len(sites) >= limit:
+            break
+    return sites
+
+
+class SoakRun:
+    """One soak run over a synthetic corpus."""
+
+    def __init__(
+        self,
+        processor: ImageProcessor,
+        corpus: SyntheticCorpus,
+        interval: int = 10000,
+        warmup: int = 1000,
+        trace: bool = True,
+        count_objects: bool = True
+    ):
+        """
+        Args:
+            processor: ImageProcessor wired to the stubs
+            corpus: Image source
+            interval: Images between samples
+            warmup: Images processed before the baseline sample
+            trace: Take tracemalloc snapshots (slower, gives allocation sites)
+            count_objects: Count live watched objects at each sample
+        """
+        self.processor = processor
+        self.corpus = corpus
+        self.interval = interval
+        self.warmup = warmup
+        self.trace = trace
+        self.count_objects = count_objects
+        self.samples: List[Dict[str, Any]] = []
+        self.failures = 0
+        self._baseline: Optional[tracemalloc.Snapshot] = None
+        self._final: Optional[tracemalloc.Snapshot] = None
+        self._started = 0.0
+
+    def _process(self, index: int):
+        filename, data = self.corpus.image(index)
+        result = self.processor.process_image(data, filename)
+        if result["errors"] or result["warnings"]:
+            self.failures += 1
+
+    def _sample(self, images: int):
+        gc.collect()
+        sample = {
+            "images": images,
+            "elapsed_s": round(time.monotonic() - self._started, 1),
+            "rss_mb": round(rss_bytes() / 2**20, 2),
+            "geocode_cache": len(self.processor.geocoder._cache)
+        }
+        if self.trace:
+            sample["traced_mb"] = round(tracemalloc.get_traced_memory()[0] / 2**20, 2)
+            snapshot = tracemalloc.take_snapshot()
+            if self._baseline is None:
+                self._baseline = snapshot
+            self._final = snapshot
+        if self.count_objects:
+            sample["objects"] = live_objects()
+        self.samples.append(sample)
+        print(json.dumps(sample, ensure_ascii=False), file=sys.stderr)
+
+    def run(self, images: int, frames: int = 1) -> Dict[str, Any]:
+        """
+        Process images after the warm-up and sample every interval.
+
+        Args:
+            images: Images to process after the warm-up
+            frames: Traceback depth recorded by tracemalloc
+
+        Returns:
+            Report dictionary
+        """
+        for index in range(self.warmup):
+            self._process(index)
+
+        if self.trace:
+            tracemalloc.start(frames)
+        self._started = time.monotonic()
+        self._sample(0)
+
+        for done in range(1, images + 1):
+            self._process(self.warmup + done)
+            if done % self.interval == 0 or done == images:
+                self._sample(done)
+
+        elapsed = time.monotonic() - self._started
+        report = {
+            "images": images,
+            "warmup": self.warmup,
+            "elapsed_s": round(elapsed, 1),
+            "images_per_sec": round(images / elapsed, 1) if elapsed else None,
+            "failures": self.failures,
+            "growth_per_10k_mb": {"rss": growth_per_10k(self.samples, "rss_mb")},
+            "samples": self.samples,
+            "dedup": self.processor.dedup_stats()
+        }
+        if self.trace:
+            report["growth_per_10k_mb"]["traced"] = growth_per_10k(self.samples, "traced_mb")
+            report["top_growth"] = top_growth(self._baseline, self._final)
+            tracemalloc.stop()
+        return report
+
+
+def get_soak_run(stub_url: str, locations: int = 0, **kwargs) -> SoakRun:
+    """
+    Factory function to create a SoakRun against stub endpoints.
+
+    Args:
+        stub_url: Base URL of the stub server (see start_stubs)
+        locations: Distinct GPS points in the corpus (0 = all distinct)
+        **kwargs: Passed to SoakRun
+
+    Returns:
+        SoakRun instance
+    """
+    geocoder = Geocoder(provider="nominatim")
+    geocoder.nominatim_endpoint = f"{stub_url}/reverse"
+    geocoder.rate_limit_delay = 0
+
+    processor = ImageProcessor(gemini_api_key="soak-test", geocoder=geocoder)
+    processor.gemini_endpoint = f"{stub_url}/generateContent"
+
+    return SoakRun(processor, SyntheticCorpus(locations), **kwargs)
+
+
+# For standalone usage
+if __name__ == "__main__":
+    def option(name: str, default=None, cast=str):
+        """Value following --name on the command line."""
+        if name in sys.argv[:-1]:
+            return cast(sys.argv[sys.argv.index(name) + 1])
+        return default
+
+    if len(sys.argv) >= 2 and sys.argv[1].isdigit():
+        trace = "--no-trace" not in sys.argv
+        metric = option("--metric", "traced" if trace else "rss")
+        max_growth = option("--max-growth-mb", cast=float)
+
+        stub, stub_url = start_stubs(option("--stub-latency", 0.0, float))
+        try:
+            soak = get_soak_run(
+                stub_url,
+                locations=option("--locations", 0, int),
+                interval=option("--interval", 10000, int),
+                warmup=option("--warmup", 1000, int),
+                trace=trace,
+                count_objects="--no-objects" not in sys.argv
+            )
+            report = soak.run(int(sys.argv[1]), frames=option("--frames", 1, int))
+        finally:
+            stub.terminate()
+
+        growth = report["growth_per_10k_mb"][metric]
+        report["threshold"] = {"metric": metric, "max_growth_mb": max_growth, "growth_mb": growth}
+        report["passed"] = max_growth is None or growth <= max_growth
+
+        output = json.dumps(report, ensure_ascii=False, indent=2)
+        if option("--report"):
+            with open(option("--report"), "w", encoding="utf-8") as f:
+                f.write(output)
+        print(output)
+        sys.exit(0 if report["passed"] else 1)
+    else:
+        print("Usage: python soak_test.py <images> [options]")
+        print("Example: python soak_test.py 300000 --max-growth-mb 5")
+        print("\nOptions:")
+        print("  --interval N        Images between samples (default: 10000)")
+        print("  --warmup N          Images before the baseline sample (default: 1000)")
+        print("  --locations N       Distinct GPS points in the corpus (default: 0 = all distinct)")
+        print("  --stub-latency S    Stub response delay in seconds (default: 0)")
+        print("  --frames N          tracemalloc traceback depth (default: 1)")
+        print("  --no-trace          RSS samples only, no tracemalloc overhead")
+        print("  --no-objects        Skip live object counts")
+        print("  --max-growth-mb X   Exit 1 when growth per 10k images exceeds X MB")
+        print("  --metric M          traced (default) or rss; rss is the default with --no-trace")
+        print("  --report PATH       Also write the JSON report to PATH")
+        sys.exit(1)
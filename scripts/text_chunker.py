@@ -0,0 +1,468 @@
+"""
+Streaming Text Chunker for DocuSearch_AI
+Extracts text from txt/md/mdx/html/htm/csv/vtt/properties files
+incrementally, normalizes Japanese text and splits it into overlapping
+chunks on sentence and heading boundaries.
+
+Chunks are uploaded pre-segmented (custom process rule with a private
+separator), so the Dify worker does not re-parse and re-split the file.
+Memory stays bounded by the block size and the upload batch size.
+"""
+
+import os
+import re
+import csv
+import time
+import codecs
+import json
+import unicodedata
+from html.parser import HTMLParser
+from typing import Optional, Dict, Any, List, Iterator, Iterable
+
+from dedup_index import DedupIndex
+from dify_client import DifyClient, get_dify_client
+
+
+TEXT_EXTENSIONS = ('txt', 'md', 'mdx', 'html', 'htm', 'csv', 'vtt', 'properties')
+
+READ_BLOCK_SIZE = 64 * 1024
+
+# Separator placed between pre-built chunks; never appears in normalized text
+CHUNK_SEPARATOR = "\n\n<<<DOCUSEARCH_CHUNK>>>\n\n"
+
+# Sentence ends (Japanese and ASCII) followed by an optional closing bracket
+SENTENCE_END = re.compile(r"(?<=[。！？!?．])[」』）)]?|\n")
+HEADING = re.compile(r"^(#{1,6}\s|■|【)")
+VTT_TIMING = re.compile(r"^\d{2}:\d{2}(:\d{2})?[.,]\d{3}\s+-->")
+
+# Zero-width characters and BOM
+INVISIBLE = dict.fromkeys(map(ord, "\u200b\u200c\u200d\u2060\ufeff"), None)
+
+
+def normalize_japanese(text: str) -> str:
+    """
+    Normalize text for indexing.
+
+    NFKC (全角英数 -> 半角, 半角カナ -> 全角), invisible characters removed,
+    CRLF unified and runs of spaces collapsed.
+    """
+    text = unicodedata.normalize("NFKC", text).translate(INVISIBLE)
+    text = text.replace("\r\n", "\n").replace("\r", "\n")
+    return re.sub(r"[ \t　]+", " ", text)
+
+
+def iter_decoded(file_path: str, block_size: int = READ_BLOCK_SIZE) -> Iterator[str]:
+    """
+    Read a text file incrementally as str blocks.
+
+    UTF-8 is tried first; files that are not valid UTF-8 in the first
+    block are decoded as CP932 (Shift_JIS), common for Japanese CSVs.
+    """
+    with open(file_path, 'rb') as f:
+        head = f.read(block_size)
+        encoding = 'utf-8-sig'
+        try:
+            codecs.getincrementaldecoder(encoding)().decode(head, final=False)
+        except UnicodeDecodeError:
+            encoding = 'cp932'
+
+        decoder = codecs.getincrementaldecoder(encoding)(errors='replace')
+        block = head
+        while block:
+            text = decoder.decode(block)
+            if text:
+                yield text
+            block = f.read(block_size)
+
+        tail = decoder.decode(b'', final=True)
+        if tail:
+            yield tail
+
+
+def iter_lines(blocks: Iterable[str], max_line: int = 1024 * 1024) -> Iterator[str]:
+    """
+    Split a stream of str blocks into lines without loading the whole file.
+
+    Lines longer than max_line are emitted in pieces to keep memory bounded.
+    """
+    pending = ""
+    for block in blocks:
+        pending += block
+        lines = pending.split("\n")
+        pending = lines.pop()
+        yield from lines
+        while len(pending) > max_line:
+            yield pending[:max_line]
+            pending = pending[max_line:]
+    if pending:
+        yield pending
+
+
+class _HTMLTextExtractor(HTMLParser):
+    """Incremental HTML to text converter (script/style dropped)."""
+
+    BLOCK_TAGS = {"p", "div", "br", "li", "tr", "h1", "h2", "h3", "h4", "h5", "h6", "section", "article"}
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts: List[str] = []
+        self._skip = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in ("script", "style"):
+            self._skip += 1
+        elif tag in self.BLOCK_TAGS:
+            self.parts.append("\n")
+            if tag[0] == "h" and tag[1:].isdigit():
+                self.parts.append("#" * int(tag[1:]) + " ")
+
+    def handle_endtag(self, tag):
+        if tag in ("script", "style") and self._skip:
+            self._skip -= 1
+        elif tag in self.BLOCK_TAGS:
+            self.parts.append("\n")
+
+    def handle_data(self, data):
+        if not self._skip:
+            self.parts.append(data)
+
+    def drain(self) -> str:
+        text = "".join(self.parts)
+        self.parts = []
+        return text
+
+
+def iter_text_lines(file_path: str) -> Iterator[str]:
+    """
+    Stream normalized text lines from a supported file.
+
+    Args:
+        file_path: Path to a txt/md/mdx/html/htm/csv/vtt/properties file
+
+    Yields:
+        Normalized lines (CSV rows as 'header: value' pairs)
+    """
+    ext = file_path.rsplit('.', 1)[-1].lower()
+    blocks = iter_decoded(file_path)
+
+    if ext in ('html', 'htm'):
+        parser = _HTMLTextExtractor()
+
+        def html_blocks():
+            for block in blocks:
+                parser.feed(block)
+                yield parser.drain()
+            parser.close()
+            yield parser.drain()
+
+        lines = iter_lines(html_blocks())
+    else:
+        lines = iter_lines(blocks)
+
+    if ext == 'csv':
+        header = None
+        for row in csv.reader(line + "\n" for line in lines):
+            if header is None:
+                header = row
+                continue
+            cells = [
+                f"{header[i] if i < len(header) else i}: {value}"
+                for i, value in enumerate(row) if value.strip()
+            ]
+            if cells:
+                yield normalize_japanese(", ".join(cells))
+        return
+
+    for line in lines:
+        if ext == 'vtt' and (VTT_TIMING.match(line) or line.strip() in ("WEBVTT", "") or line.strip().isdigit()):
+            continue
+        line = normalize_japanese(line).strip()
+        if line:
+            yield line
+
+
+def split_sentences(line: str) -> List[str]:
+    """Split a line after Japanese/ASCII sentence terminators."""
+    sentences = []
+    start = 0
+    for match in SENTENCE_END.finditer(line):
+        end = match.end()
+        if end > start:
+            sentences.append(line[start:end])
+            start = end
+    if start < len(line):
+        sentences.append(line[start:])
+    return [s.strip() for s in sentences if s.strip()]
+
+
+def iter_chunks(
+    file_path: str,
+    chunk_size: int = 800,
+    overlap: int = 100,
+    header: Optional[str] = None
+) -> Iterator[str]:
+    """
+    Stream overlapping chunks from a text file.
+
+    Sentences are accumulated until chunk_size characters; a heading always
+    starts a new chunk. Each new chunk repeats trailing sentences of the
+    previous one up to overlap characters. Sentences longer than chunk_size
+    are hard-split.
+
+    Args:
+        file_path: Path to the text file
+        chunk_size: Target maximum characters per chunk
+        overlap: Characters carried over from the previous chunk
+        header: Optional text prepended to the first chunk
+
+    Yields:
+        Chunk texts
+    """
+    # Pieces keep their own leading "\n" when they start a new line
+    current: List[str] = [header] if header else []
+    size = len(header) if header else 0
+
+    def emit(pieces: List[str]) -> str:
+        return "".join(pieces).lstrip("\n")
+
+    def tail(pieces: List[str]) -> List[str]:
+        carried = []
+        total = 0
+        for piece in reversed(pieces):
+            if total + len(piece) > overlap:
+                break
+            carried.insert(0, piece)
+            total += len(piece)
+        return carried
+
+    for line in iter_text_lines(file_path):
+        if HEADING.match(line) and size:
+            yield emit(current)
+            current, size = [], 0
+
+        for i, sentence in enumerate(split_sentences(line)):
+            while len(sentence) > chunk_size:
+                head, sentence = sentence[:chunk_size], sentence[chunk_size - overlap:]
+                if current:
+                    yield emit(current)
+                yield head
+                current, size = [], 0
+
+            piece = f"\n{sentence}" if i == 0 else sentence
+            if size + len(piece) > chunk_size and current:
+                yield emit(current)
+                current = tail(current)
+                size = sum(len(p) for p in current)
+
+            current.append(piece)
+            size += len(piece)
+
+    if current:
+        yield emit(current)
+
+
+def build_process_rule(chunk_size: int, overlap: int) -> Dict[str, Any]:
+    """
+    Custom Dify process rule that only splits on CHUNK_SEPARATOR.
+
+    max_tokens is set above the chunk size, so Dify keeps our chunks as-is.
+    """
+    return {
+        "mode": "custom",
+        "rules": {
+            "pre_processing_rules": [
+                {"id": "remove_extra_spaces", "enabled": False},
+                {"id": "remove_urls_emails", "enabled": False}
+            ],
+            "segmentation": {
+                "separator": CHUNK_SEPARATOR.strip(),
+                "max_tokens": min(4000, chunk_size + overlap + 200)
+            }
+        }
+    }
+
+
+def document_header(relative_path: str) -> str:
+    """Header block of the document-processing workflow."""
+    return "\n".join([
+        f"■ファイル名: {os.path.basename(relative_path)}",
+        f"■ファイルパス: {relative_path}",
+        f"■ファイルURL: http://localhost/docs/{relative_path}",
+        "■内容:"
+    ])
+
+
+def upload_text_document(
+    file_path: str,
+    relative_path: str,
+    client: Optional[DifyClient] = None,
+    chunk_size: int = 800,
+    overlap: int = 100,
+    batch_chars: int = 1024 * 1024,
+    segment_batch: int = 100,
+    dedup: Optional[DedupIndex] = None,
+    content_hash: Optional[str] = None,
+    dataset_id: Optional[str] = None
+) -> Dict[str, Any]:
+    """
+    Chunk a text file and upload it to Dify as one document.
+
+    The first batch_chars of chunks create the document (pre-segmented);
+    remaining chunks are appended through the segments API in batches, so
+    huge files never have to be held in memory at once. With a dedup index,
+    chunks already present in the dataset are not uploaded (embedded) again.
+
+    If appending fails after the document was created, the partial
+    document is deleted before the error is raised, so the job's retry
+    (another create) does not leave a second document with the same name.
+
+    Args:
+        file_path: Path to the text file
+        relative_path: Dify document name (path relative to /watch)
+        client: DifyClient instance (auto-created if None)
+        chunk_size: Target maximum characters per chunk
+        overlap: Characters carried over between chunks
+        batch_chars: Characters sent in the initial create-by-text request
+        segment_batch: Chunks per add-segments request
+        dedup: DedupIndex used to skip repeated chunks (disabled if None)
+        content_hash: Content hash recorded in the dedup index
+        dataset_id: Dataset ID (defaults to client dataset)
+
+    Returns:
+        Dictionary with document_id, batch, chunks and indexing_seconds;
+        with dedup also 'dedup' (chunks, suppressed, tokens_saved,
+        similar_to) and 'dependents' (documents to re-index)
+    """
+    client = client or get_dify_client()
+    header = document_header(relative_path)
+    chunks = iter_chunks(file_path, chunk_size, overlap, header=header)
+    dedup_stats: Dict[str, Any] = {}
+    if dedup:
+        chunks = dedup.filter_chunks(relative_path, chunks, prefix=header, stats=dedup_stats)
+
+    try:
+        first: List[str] = []
+        size = 0
+        for chunk in chunks:
+            first.append(chunk)
+            size += len(chunk)
+            if size >= batch_chars:
+                break
+
+        response = client.create_by_text(
+            relative_path,
+            CHUNK_SEPARATOR.join(first) or header,
+            process_rule=build_process_rule(chunk_size, overlap),
+            dataset_id=dataset_id
+        )
+        document_id = response.get("document", {}).get("id")
+        batch = response.get("batch")
+        total = len(first)
+        indexing_seconds = None
+
+        try:
+            pending: List[str] = []
+            for chunk in chunks:
+                if indexing_seconds is None:
+                    # Segments can only be added once the document is indexed
+                    indexing_seconds = client.wait_for_indexing(batch, dataset_id)
+                pending.append(chunk)
+                if len(pending) >= segment_batch:
+                    client.add_segments(document_id, pending, dataset_id)
+                    total += len(pending)
+                    pending = []
+
+            if pending:
+                client.add_segments(document_id, pending, dataset_id)
+                total += len(pending)
+        except Exception:
+            if document_id:
+                try:
+                    client.delete_document(document_id, dataset_id)
+                except Exception:
+                    # Left for the next sync to delete (no local file matches it)
+                    pass
+            raise
+    except Exception:
+        if dedup:
+            # Nothing of a failed upload enters the dedup index
+            dedup.discard(relative_path)
+        raise
+
+    result = {
+        "document_id": document_id,
+        "batch": batch,
+        "chunks": total,
+        "indexing_seconds": indexing_seconds
+    }
+    if dedup:
+        dedup.set_document(relative_path, document_id, file_path, content_hash, dedup_stats)
+        result["dependents"] = dedup_stats.pop("dependents")
+        result["dedup"] = dedup_stats
+    return result
+
+
+def benchmark_indexing(
+    file_path: str,
+    relative_path: str,
+    client: Optional[DifyClient] = None,
+    dataset_id: Optional[str] = None
+) -> Dict[str, Any]:
+    """
+    Compare Dify indexing time of the whole text (automatic process rule,
+    as test_dify_create_by_text.py uploads it) with the pre-chunked upload.
+
+    Both documents are uploaded under a '#bench' name and deleted again.
+    The automatic upload holds the file in memory; use a representative
+    file, not the largest one.
+
+    Returns:
+        Seconds from create to indexing completed, per upload mode
+    """
+    client = client or get_dify_client()
+    results = {}
+
+    def timed(mode: str, upload):
+        start = time.time()
+        response = upload()
+        try:
+            client.wait_for_indexing(response["batch"], dataset_id)
+            results[mode] = round(time.time() - start, 2)
+        finally:
+            client.delete_document(response["document_id"], dataset_id)
+
+    def automatic():
+        text = document_header(relative_path) + "\n" + "".join(iter_decoded(file_path))
+        response = client.create_by_text(f"{relative_path}#bench-automatic", text, dataset_id=dataset_id)
+        return {"document_id": response["document"]["id"], "batch": response["batch"]}
+
+    timed("automatic", automatic)
+    timed("chunked", lambda: upload_text_document(
+        file_path, f"{relative_path}#bench-chunked", client=client, dataset_id=dataset_id
+    ))
+    if results.get("chunked"):
+        results["speedup"] = round(results["automatic"] / results["chunked"], 2)
+    return results
+
+
+# For standalone usage
+if __name__ == "__main__":
+    import sys
+
+    if len(sys.argv) >= 3 and sys.argv[1] == "chunks":
+        for i, chunk in enumerate(iter_chunks(sys.argv[2])):
+            print(f"--- chunk {i} ({len(chunk)} chars) ---")
+            print(chunk)
+    elif len(sys.argv) >= 4 and sys.argv[1] == "upload":
+        client = get_dify_client()
+        result = upload_text_document(sys.argv[2], sys.argv[3], client=client)
+        if result["indexing_seconds"] is None:
+            result["indexing_seconds"] = client.wait_for_indexing(result["batch"])
+        print(json.dumps(result, ensure_ascii=False, indent=2))
+    elif len(sys.argv) >= 4 and sys.argv[1] == "bench":
+        print(json.dumps(benchmark_indexing(sys.argv[2], sys.argv[3]), ensure_ascii=False, indent=2))
+    else:
+        print("Usage: python text_chunker.py chunks <file>")
+        print("       python text_chunker.py upload <file> <relative_path>")
+        print("       python text_chunker.py bench <file> <relative_path>   # indexing time: automatic vs chunked")
+        sys.exit(1)
@@ -0,0 +1,190 @@
+"""
+Thumbnail Store for DocuSearch_AI
+Content-addressed image thumbnails served by nginx (/thumbs/).
+
+- One JPEG per size, keyed by the content hash (BLAKE2b-256, same digest
+  as hash_cache): <hash[:2]>/<hash[2:4]>/<hash>-<size>.jpg
+- Thumbnails exist once per content: moved, renamed or copied files point
+  at the same keys, and existing files are never decoded again
+- JPEGs are decoded at reduced size (DCT scaling, Image.draft) instead of
+  at full resolution; EXIF orientation is applied before scaling
+- Files are written atomically (temp file + rename) and never change, so
+  nginx serves them with immutable cache headers
+- HEIC/HEIF (iPhone photos) are decoded through pillow-heif
+"""
+
+import os
+import json
+import tempfile
+from typing import Optional, Dict, List, Union, BinaryIO
+
+from PIL import Image, ImageOps
+from dotenv import load_dotenv
+from pillow_heif import register_heif_opener
+
+from single_flight import SingleFlight
+
+
+# Load environment variables
+load_dotenv()
+
+# Image.open decodes HEIC/HEIF
+register_heif_opener()
+
+DEFAULT_SIZES = (256, 1024)
+DEFAULT_QUALITY = 82
+DEFAULT_BASE_URL = "http://localhost/thumbs/"
+
+
+def thumbnail_key(digest: str, size: int) -> str:
+    """Store key (relative path) of a content hash's thumbnail at one size."""
+    return f"{digest[:2]}/{digest[2:4]}/{digest}-{size}.jpg"
+
+
+def parse_sizes(value: str) -> List[int]:
+    """Parse '256,1024' into sizes (longest edge in pixels)."""
+    return sorted({int(item) for item in value.split(',') if item.strip()})
+
+
+class ThumbnailStore:
+    """Writes and locates thumbnails in a sharded, content-addressed directory."""
+
+    def __init__(
+        self,
+        root: str,
+        sizes: Optional[List[int]] = None,
+        quality: int = DEFAULT_QUALITY,
+        base_url: str = DEFAULT_BASE_URL
+    ):
+        """
+        Initialize thumbnail store.
+
+        Args:
+            root: Store directory (served by nginx as /thumbs/)
+            sizes: Longest edges in pixels, one thumbnail each
+            quality: JPEG quality
+            base_url: URL prefix the store is served under
+        """
+        self.root = root.rstrip('/')
+        self.sizes = sorted(sizes or DEFAULT_SIZES)
+        self.quality = quality
+        self.base_url = base_url.rstrip('/') + '/'
+        # Worker threads handling the same content render it once
+        self.single_flight = SingleFlight()
+        self.generated = 0
+        self.reused = 0
+
+    def path(self, key: str) -> str:
+        """Absolute path of a store key."""
+        return f"{self.root}/{key}"
+
+    def url(self, key: str) -> str:
+        """Public URL of a store key."""
+        return self.base_url + key
+
+    def keys(self, digest: str) -> Dict[str, str]:
+        """Store keys of a content hash, by size."""
+        return {str(size): thumbnail_key(digest, size) for size in self.sizes}
+
+    def missing(self, digest: str) -> List[int]:
+        """Sizes not yet stored for a content hash."""
+        return [size for size in self.sizes if not os.path.exists(self.path(thumbnail_key(digest, size)))]
+
+    def ensure(self, digest: str, source: Union[str, BinaryIO]) -> Dict[str, str]:
+        """
+        Store the thumbnails of an image unless they already exist.
+
+        Args:
+            digest: Content hash of the image
+            source: Image file path or file object (read only when a size is missing)
+
+        Returns:
+            Store keys by size (see keys)
+        """
+        if self.missing(digest):
+            self.single_flight.do(digest, self._generate, digest, source)
+        else:
+            self.reused += 1
+        return self.keys(digest)
+
+    def _generate(self, digest: str, source: Union[str, BinaryIO]):
+        sizes = self.missing(digest)
+        if not sizes:
+            self.reused += 1
+            return
+
+        with Image.open(source) as image:
+            # JPEG: decode at the smallest DCT scale still covering the largest size
+            image.draft('RGB', (sizes[-1], sizes[-1]))
+            image = ImageOps.exif_transpose(image)
+            if image.mode != 'RGB':
+                image = image.convert('RGB')
+
+            # Largest first: each size is scaled down from the previous one
+            for size in reversed(sizes):
+                image.thumbnail((size, size), Image.LANCZOS)
+                self._write(thumbnail_key(digest, size), image)
+        self.generated += 1
+
+    def _write(self, key: str, image: Image.Image):
+        """Save atomically, so nginx never serves a partial file."""
+        path = self.path(key)
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                image.save(f, 'JPEG', quality=self.quality, optimize=True, progressive=True)
+            os.chmod(tmp_path, 0o644)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    def stats(self) -> Dict[str, int]:
+        """Thumbnail sets generated and reused since start."""
+        return {"generated": self.generated, "reused": self.reused}
+
+
+def get_thumbnail_store(root: Optional[str] = None) -> ThumbnailStore:
+    """
+    Factory function to create ThumbnailStore instance.
+
+    Uses THUMBNAIL_DIR, THUMBNAIL_SIZES (default 256,1024),
+    THUMBNAIL_QUALITY (default 82) and THUMBNAIL_BASE_URL.
+
+    Args:
+        root: Store directory (uses env var if not provided)
+
+    Returns:
+        ThumbnailStore instance
+    """
+    return ThumbnailStore(
+        root=root or os.environ.get('THUMBNAIL_DIR', 'thumbnails'),
+        sizes=parse_sizes(os.environ.get('THUMBNAIL_SIZES', '')) or None,
+        quality=int(os.environ.get('THUMBNAIL_QUALITY', DEFAULT_QUALITY)),
+        base_url=os.environ.get('THUMBNAIL_BASE_URL', DEFAULT_BASE_URL)
+    )
+
+
+# For standalone usage
+if __name__ == "__main__":
+    import sys
+
+    if len(sys.argv) >= 2:
+        from hash_cache import hash_file
+
+        store = get_thumbnail_store()
+        output = {}
+        for file_path in sys.argv[1:]:
+            keys = store.ensure(hash_file(file_path), file_path)
+            output[file_path] = {size: store.url(key) for size, key in keys.items()}
+        print(json.dumps(output, ensure_ascii=False, indent=2))
+    else:
+        print("Usage: python thumbnail_store.py <image_file>...")
+        print("\nEnvironment variables:")
+        print("  THUMBNAIL_DIR - Store directory (default: thumbnails)")
+        print("  THUMBNAIL_SIZES - Longest edges in pixels (default: 256,1024)")
+        print("  THUMBNAIL_QUALITY - JPEG quality (default: 82)")
+        print("  THUMBNAIL_BASE_URL - URL the store is served under (default: http://localhost/thumbs/)")
+        sys.exit(1)
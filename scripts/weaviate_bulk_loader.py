@@ -0,0 +1,380 @@
+"""
+Weaviate Bulk Loader for DocuSearch_AI
+Writes precomputed chunks and embeddings straight into the Weaviate
+collection of a Dify dataset using the batch object API, for full
+rebuilds/backfills that would take days through Dify's per-document API.
+
+- Same schema as Dify: class Vector_index_<dataset_id>_Node with
+  text, doc_id, document_id, dataset_id and doc_hash properties
+- Only vectors are written: documents and segments must already exist
+  in Dify (e.g. created without embedding, or exported from another
+  instance), so the input carries their real document_id and segment
+  index_node_id. Nodes Dify has no rows for would be dropped from
+  retrieval, be unmanageable and be uploaded again by folder_sync
+- Batches are sent concurrently (tunable batch size and concurrency)
+- The document -> node mapping is recorded in SQLite so loaded
+  documents can be listed and deleted afterwards; reloading a document
+  replaces all of its previous nodes
+
+Input is JSON Lines, one document per line:
+    {"name": "images/2025/IMG_1234.jpg", "document_id": "<Dify document ID>",
+     "chunks": [{"index_node_id": "<Dify segment index_node_id>", "text": "...",
+                 "vector": [0.1, ...]}, ...]}
+"""
+
+import os
+import json
+import time
+import uuid
+import sqlite3
+import hashlib
+import threading
+import requests
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Optional, Dict, Any, List, Iterable, Iterator, Tuple
+from dotenv import load_dotenv
+
+
+# Load environment variables
+load_dotenv()
+
+DEFAULT_MAP_PATH = os.environ.get('BULK_MAP_PATH', 'weaviate_bulk_map.sqlite3')
+
+
+def collection_name(dataset_id: str) -> str:
+    """Weaviate class name Dify uses for a dataset."""
+    return f"Vector_index_{dataset_id.replace('-', '_')}_Node"
+
+
+def text_hash(text: str) -> str:
+    """Segment hash in Dify's format (sha256 of text + 'None')."""
+    return hashlib.sha256(f"{text}None".encode('utf-8')).hexdigest()
+
+
+class BulkLoader:
+    """Concurrent Weaviate batch writer for Dify dataset collections."""
+
+    def __init__(
+        self,
+        weaviate_url: Optional[str] = None,
+        api_key: Optional[str] = None,
+        dataset_id: Optional[str] = None,
+        batch_size: int = 200,
+        concurrency: int = 4,
+        map_path: str = DEFAULT_MAP_PATH,
+        timeout: float = 60
+    ):
+        """
+        Initialize bulk loader.
+
+        Args:
+            weaviate_url: Weaviate REST URL (e.g. http://localhost:8080)
+            api_key: Weaviate API key (optional)
+            dataset_id: Dify dataset ID whose collection is written
+            batch_size: Objects per batch request
+            concurrency: Batch requests in flight
+            map_path: SQLite path of the document mapping
+            timeout: Request timeout in seconds
+        """
+        self.weaviate_url = (weaviate_url or os.environ.get('WEAVIATE_URL', 'http://weaviate:8080')).rstrip('/')
+        self.api_key = api_key or os.environ.get('WEAVIATE_API_KEY')
+        self.dataset_id = dataset_id or os.environ.get('DIFY_DATASET_ID')
+        if not self.dataset_id:
+            raise ValueError("Dify dataset ID required. Set DIFY_DATASET_ID env var or pass dataset_id parameter.")
+
+        self.class_name = collection_name(self.dataset_id)
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self._local = threading.local()
+
+        self._db = sqlite3.connect(map_path, check_same_thread=False)
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS documents (
+                name TEXT, dataset_id TEXT, document_id TEXT, chunks INTEGER, loaded_at REAL,
+                PRIMARY KEY (dataset_id, name)
+            );
+            CREATE TABLE IF NOT EXISTS nodes (
+                node_id TEXT PRIMARY KEY, document_id TEXT
+            );
+            CREATE INDEX IF NOT EXISTS nodes_document ON nodes (document_id);
+        """)
+
+    def _session(self) -> requests.Session:
+        """Per-thread HTTP session (keep-alive across batches)."""
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = self._local.session = requests.Session()
+            session.headers["Content-Type"] = "application/json"
+            if self.api_key:
+                session.headers["Authorization"] = f"Bearer {self.api_key}"
+        return session
+
+    def ensure_class(self):
+        """Create the dataset collection if Dify has not created it yet."""
+        response = self._session().get(f"{self.weaviate_url}/v1/schema/{self.class_name}", timeout=self.timeout)
+        if response.status_code == 200:
+            return
+        if response.status_code != 404:
+            response.raise_for_status()
+
+        properties = [
+            {"name": name, "dataType": ["text"]}
+            for name in ("text", "doc_id", "document_id", "dataset_id", "doc_hash")
+        ]
+        response = self._session().post(
+            f"{self.weaviate_url}/v1/schema",
+            json={"class": self.class_name, "vectorizer": "none", "properties": properties},
+            timeout=self.timeout
+        )
+        response.raise_for_status()
+
+    def _build_objects(self, document: Dict[str, Any]) -> Tuple[str, List[Dict[str, Any]]]:
+        """
+        Convert one input document into Weaviate objects and record its mapping.
+
+        Nodes of an earlier load of the document are deleted first, so a
+        reload with fewer chunks leaves no orphans.
+
+        Returns:
+            (document_id, objects)
+
+        Raises:
+            ValueError: The document or a chunk lacks its Dify ID
+        """
+        name = document["name"]
+        document_id = document.get("document_id")
+        chunks = document.get("chunks", [])
+        if not document_id or not all(chunk.get("index_node_id") for chunk in chunks):
+            raise ValueError(f"{name}: document_id and index_node_id of every chunk are required (Dify IDs)")
+
+        row = self._db.execute(
+            "SELECT document_id FROM documents WHERE dataset_id = ? AND name = ?",
+            (self.dataset_id, name)
+        ).fetchone()
+        if row:
+            self._delete_objects(row[0])
+
+        objects = []
+        node_ids = []
+        for chunk in chunks:
+            # Dify's node ID: retries and reloads overwrite instead of duplicating
+            node_id = chunk["index_node_id"]
+            node_ids.append((node_id, document_id))
+            objects.append({
+                "class": self.class_name,
+                "id": node_id,
+                "vector": chunk["vector"],
+                "properties": {
+                    "text": chunk["text"],
+                    "doc_id": node_id,
+                    "document_id": document_id,
+                    "dataset_id": self.dataset_id,
+                    "doc_hash": chunk.get("index_node_hash") or text_hash(chunk["text"])
+                }
+            })
+
+        self._db.execute(
+            "INSERT OR REPLACE INTO documents VALUES (?, ?, ?, ?, ?)",
+            (name, self.dataset_id, document_id, len(objects), time.time())
+        )
+        self._db.executemany("INSERT OR REPLACE INTO nodes VALUES (?, ?)", node_ids)
+        return document_id, objects
+
+    def _delete_objects(self, document_id: str) -> int:
+        """Delete a document's objects from the collection and the node mapping."""
+        response = self._session().delete(
+            f"{self.weaviate_url}/v1/batch/objects",
+            json={
+                "match": {
+                    "class": self.class_name,
+                    "where": {"path": ["document_id"], "operator": "Equal", "valueText": document_id}
+                }
+            },
+            timeout=self.timeout
+        )
+        response.raise_for_status()
+        self._db.execute("DELETE FROM nodes WHERE document_id = ?", (document_id,))
+        return response.json().get("results", {}).get("successful", 0)
+
+    def _send(self, objects: List[Dict[str, Any]]) -> int:
+        """
+        Send one batch.
+
+        Returns:
+            Number of objects Weaviate rejected
+        """
+        response = self._session().post(
+            f"{self.weaviate_url}/v1/batch/objects",
+            json={"objects": objects},
+            timeout=self.timeout
+        )
+        response.raise_for_status()
+        return sum(1 for item in response.json() if item.get("result", {}).get("errors"))
+
+    def _batches(self, documents: Iterable[Dict[str, Any]], counts: Dict[str, int]) -> Iterator[List[Dict[str, Any]]]:
+        """Group objects of consecutive documents into batches."""
+        batch: List[Dict[str, Any]] = []
+        for document in documents:
+            _, objects = self._build_objects(document)
+            counts["documents"] += 1
+            for obj in objects:
+                batch.append(obj)
+                if len(batch) >= self.batch_size:
+                    yield batch
+                    batch = []
+        if batch:
+            yield batch
+
+    def load(self, documents: Iterable[Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        Bulk-load documents.
+
+        At most `concurrency` batches are in flight, so memory stays bounded
+        for arbitrarily large inputs.
+
+        Args:
+            documents: Iterable of {"name", "document_id",
+                       "chunks": [{"index_node_id", "text", "vector", ["index_node_hash"]}]}
+
+        Returns:
+            Stats: documents, objects, errors, seconds, objects_per_sec
+        """
+        self.ensure_class()
+        counts = {"documents": 0, "objects": 0, "errors": 0}
+        start = time.time()
+
+        with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+            in_flight = {}
+            for batch in self._batches(documents, counts):
+                if len(in_flight) >= self.concurrency:
+                    done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        counts["errors"] += future.result()
+                        del in_flight[future]
+                in_flight[pool.submit(self._send, batch)] = len(batch)
+                counts["objects"] += len(batch)
+
+            for future in in_flight:
+                counts["errors"] += future.result()
+
+        self._db.commit()
+        seconds = time.time() - start
+        return {
+            **counts,
+            "seconds": round(seconds, 3),
+            "objects_per_sec": round(counts["objects"] / seconds, 1) if seconds else None
+        }
+
+    def delete_document(self, name: str) -> int:
+        """
+        Delete a bulk-loaded document's objects and its mapping.
+
+        Args:
+            name: Document name
+
+        Returns:
+            Number of objects deleted
+        """
+        row = self._db.execute(
+            "SELECT document_id FROM documents WHERE dataset_id = ? AND name = ?",
+            (self.dataset_id, name)
+        ).fetchone()
+        if not row:
+            return 0
+
+        deleted = self._delete_objects(row[0])
+        self._db.execute("DELETE FROM documents WHERE dataset_id = ? AND name = ?", (self.dataset_id, name))
+        self._db.commit()
+        return deleted
+
+    def documents(self) -> List[Dict[str, Any]]:
+        """List bulk-loaded documents of the dataset."""
+        rows = self._db.execute(
+            "SELECT name, document_id, chunks, loaded_at FROM documents WHERE dataset_id = ? ORDER BY name",
+            (self.dataset_id,)
+        )
+        return [
+            {"name": name, "document_id": document_id, "chunks": chunks, "loaded_at": loaded_at}
+            for name, document_id, chunks, loaded_at in rows
+        ]
+
+
+def iter_jsonl(path: str) -> Iterator[Dict[str, Any]]:
+    """Stream documents from a JSON Lines file."""
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def get_bulk_loader(
+    dataset_id: Optional[str] = None,
+    batch_size: Optional[int] = None,
+    concurrency: Optional[int] = None
+) -> BulkLoader:
+    """
+    Factory function to create BulkLoader instance.
+
+    Args:
+        dataset_id: Dify dataset ID (uses env var if not provided)
+        batch_size: Objects per batch (uses BULK_BATCH_SIZE env var if not provided)
+        concurrency: Batches in flight (uses BULK_CONCURRENCY env var if not provided)
+
+    Returns:
+        BulkLoader instance
+    """
+    return BulkLoader(
+        dataset_id=dataset_id,
+        batch_size=batch_size or int(os.environ.get('BULK_BATCH_SIZE', 200)),
+        concurrency=concurrency or int(os.environ.get('BULK_CONCURRENCY', 4))
+    )
+
+
+# For standalone usage
+if __name__ == "__main__":
+    import sys
+    import random
+
+    command = sys.argv[1] if len(sys.argv) > 1 else ""
+
+    if command == "load" and len(sys.argv) >= 3:
+        loader = get_bulk_loader()
+        print(json.dumps(loader.load(iter_jsonl(sys.argv[2])), ensure_ascii=False, indent=2))
+    elif command == "delete" and len(sys.argv) >= 3:
+        loader = get_bulk_loader()
+        print(json.dumps({"deleted": loader.delete_document(sys.argv[2])}, ensure_ascii=False))
+    elif command == "list":
+        print(json.dumps(get_bulk_loader().documents(), ensure_ascii=False, indent=2))
+    elif command == "bench":
+        # Synthetic throughput test against a local Weaviate (random IDs
+        # unknown to Dify: remove the objects with delete bench/doc_<i>.txt)
+        count = int(sys.argv[2]) if len(sys.argv) > 2 else 10000
+        dim = int(sys.argv[3]) if len(sys.argv) > 3 else 768
+        loader = get_bulk_loader()
+        docs = (
+            {
+                "name": f"bench/doc_{i}.txt",
+                "document_id": str(uuid.uuid4()),
+                "chunks": [{
+                    "index_node_id": str(uuid.uuid4()),
+                    "text": f"bench chunk {i}",
+                    "vector": [random.random() for _ in range(dim)]
+                }]
+            }
+            for i in range(count)
+        )
+        print(json.dumps(loader.load(docs), ensure_ascii=False, indent=2))
+    else:
+        print("Usage: python weaviate_bulk_loader.py load <documents.jsonl>")
+        print("       python weaviate_bulk_loader.py delete <name>")
+        print("       python weaviate_bulk_loader.py list")
+        print("       python weaviate_bulk_loader.py bench [count] [dim]")
+        print("\nEnvironment variables:")
+        print("  WEAVIATE_URL - Weaviate REST URL (default: http://weaviate:8080)")
+        print("  WEAVIATE_API_KEY - Weaviate API key (optional)")
+        print("  DIFY_DATASET_ID - Dataset whose collection is written")
+        print("  BULK_BATCH_SIZE - Objects per batch (default: 200)")
+        print("  BULK_CONCURRENCY - Batches in flight (default: 4)")
+        print("  BULK_MAP_PATH - Document mapping SQLite path (default: weaviate_bulk_map.sqlite3)")
+        sys.exit(1)
@@ -0,0 +1,9 @@
+"""
+Shared pytest setup for DocuSearch_AI
+The scripts are flat modules run from scripts/; make them importable.
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "scripts"))
@@ -0,0 +1,115 @@
+"""
+Tests for dedup_index (staged writes, incremental updates, dependents).
+"""
+
+import pytest
+
+from dedup_index import DedupIndex
+from text_chunker import upload_text_document
+
+HEADER = "■ファイル名: {name}\n"
+BOILERPLATE = [
+    "本資料は社外秘です。無断での転載、複製、第三者への開示を禁止します。取り扱いには十分注意してください。",
+    "お問い合わせは総務部までご連絡ください。受付時間は平日の九時から十七時までとなっております。",
+]
+
+
+def _chunks(name, *body):
+    return [HEADER.format(name=name) + f"{name} の概要です。"] + list(body)
+
+
+def _index(index, name, chunks, document_id="doc"):
+    """Upload chunks through the index the way upload_text_document does."""
+    stats = {}
+    kept = list(index.filter_chunks(name, chunks, prefix=HEADER.format(name=name), stats=stats))
+    index.set_document(name, document_id, f"/watch/{name}", "hash", stats)
+    return kept, stats
+
+
+@pytest.fixture
+def index():
+    return DedupIndex(":memory:")
+
+
+def test_repeated_chunks_are_suppressed(index):
+    _index(index, "a.md", _chunks("a.md", *BOILERPLATE))
+    kept, stats = _index(index, "b.md", _chunks("b.md", *BOILERPLATE))
+
+    assert kept == _chunks("b.md")
+    assert stats["suppressed"] == 2
+    assert index.stats()["chunks_suppressed"] == 2
+
+
+def test_failed_upload_writes_nothing(index):
+    stats = {}
+    # The upload fails after the chunks were filtered
+    list(index.filter_chunks("a.md", _chunks("a.md", *BOILERPLATE), stats=stats))
+    index.discard("a.md")
+
+    assert index.stats()["indexed_chunks"] == 0
+    kept, _ = _index(index, "b.md", _chunks("b.md", *BOILERPLATE))
+    assert kept == _chunks("b.md", *BOILERPLATE)
+
+
+def test_update_replaces_previous_version(index):
+    _index(index, "a.md", _chunks("a.md", *BOILERPLATE))
+
+    # The new version is not matched against the one it replaces
+    kept, stats = _index(index, "a.md", _chunks("a.md", BOILERPLATE[0]))
+    assert kept == _chunks("a.md", BOILERPLATE[0])
+    assert stats["suppressed"] == 0
+    assert index.stats()["indexed_chunks"] == 2
+
+
+def test_chunks_repeated_within_a_document(index):
+    kept, stats = _index(index, "a.md", _chunks("a.md", BOILERPLATE[0], BOILERPLATE[0]))
+
+    assert kept == _chunks("a.md", BOILERPLATE[0])
+    assert stats["suppressed"] == 1
+
+
+def test_removal_returns_dependents(index):
+    _index(index, "a.md", _chunks("a.md", *BOILERPLATE), document_id="doc-a")
+    _index(index, "b.md", _chunks("b.md", *BOILERPLATE), document_id="doc-b")
+
+    dependents = index.remove("a.md")
+
+    assert [(d["name"], d["document_id"]) for d in dependents] == [("b.md", "doc-b")]
+    # b.md was forgotten: its re-index uploads the boilerplate again
+    kept, _ = _index(index, "b.md", _chunks("b.md", *BOILERPLATE))
+    assert kept == _chunks("b.md", *BOILERPLATE)
+
+
+def test_update_reindexes_dependents(index):
+    _index(index, "a.md", _chunks("a.md", *BOILERPLATE))
+    _index(index, "b.md", _chunks("b.md", *BOILERPLATE), document_id="doc-b")
+
+    # a.md drops the boilerplate that b.md relied on
+    _, stats = _index(index, "a.md", _chunks("a.md"))
+    assert stats["dependents"] == ["b.md"]
+
+    documents = index.pop_documents(stats["dependents"])
+    assert [d["document_id"] for d in documents] == ["doc-b"]
+
+
+class FakeClient:
+    def __init__(self, fail=False):
+        self.fail = fail
+
+    def create_by_text(self, name, text, process_rule=None, dataset_id=None):
+        if self.fail:
+            raise RuntimeError("Dify unavailable")
+        return {"document": {"id": "doc-1"}, "batch": "batch-1"}
+
+
+def test_upload_failure_leaves_index_untouched(index, tmp_path):
+    path = tmp_path / "a.md"
+    path.write_text("\n\n".join(BOILERPLATE), encoding="utf-8")
+
+    with pytest.raises(RuntimeError):
+        upload_text_document(str(path), "a.md", client=FakeClient(fail=True), dedup=index)
+    assert index.stats() == DedupIndex(":memory:").stats()
+
+    result = upload_text_document(str(path), "a.md", client=FakeClient(), dedup=index)
+    assert result["dedup"]["suppressed"] == 0
+    assert index.stats()["documents"] == 1
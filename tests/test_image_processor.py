@@ -0,0 +1,94 @@
+"""
+Tests for image_processor two-phase processing (no network).
+"""
+
+import pytest
+from PIL import Image
+
+from hash_cache import HashCache
+from image_processor import ImageProcessor
+
+
+class FakeGeocoder:
+    def is_cached(self, lat, lon):
+        return False
+
+    def reverse_geocode(self, lat, lon, deadline=None):
+        return {"formatted": "芝公園, 港区, 東京都, 日本"}
+
+
+@pytest.fixture
+def image(tmp_path):
+    path = tmp_path / "IMG_0001.jpg"
+    exif = Image.Exif()
+    exif[271] = "Canon"
+    exif[272] = "EOS R6"
+    Image.new("RGB", (64, 48), "red").save(path, exif=exif)
+    return str(path)
+
+
+@pytest.fixture
+def processor():
+    processor = ImageProcessor(gemini_api_key="key", geocoder=FakeGeocoder(), hash_cache=HashCache(":memory:"))
+    processor.captions = 0
+
+    def caption(image_binary, deadline=None):
+        processor.captions += 1
+        return "赤い背景の画像"
+
+    processor._generate_vision_caption = caption
+    return processor
+
+
+def test_enrichment_runs_only_the_caption_stage(processor, image):
+    first = processor.process_image_file(image, generate_caption=False)
+    assert first["vision_caption"] is None
+
+    def fail(*args, **kwargs):
+        raise AssertionError("phase one ran again")
+
+    processor.process_image = fail
+    result = processor.caption_image_file(image)
+
+    assert processor.captions == 1
+    assert result["camera"] == "Canon EOS R6"
+    assert result["full_document_text"].endswith("■画像内容の説明:\n赤い背景の画像")
+    # The captioned result replaces the phase-one entry
+    assert processor.process_image_file(image)["vision_caption"] == "赤い背景の画像"
+    assert processor.captions == 1
+
+
+def test_enrichment_without_stored_result_processes_in_full(processor, image):
+    result = processor.caption_image_file(image)
+
+    assert result["vision_caption"] == "赤い背景の画像"
+    assert result["camera"] == "Canon EOS R6"
+
+
+class BrokenThumbnails:
+    def ensure(self, digest, source):
+        raise OSError("No space left on device")
+
+
+def test_thumbnail_failure_is_a_warning(processor, image):
+    processor.thumbnails = BrokenThumbnails()
+    result = processor.process_image_file(image, generate_caption=False)
+
+    assert result["errors"] == []
+    assert result["warnings"] == ["Thumbnails: No space left on device"]
+    # The result is cached all the same
+    assert processor.hash_cache.get_result(result["content_hash"])["camera"] == "Canon EOS R6"
+
+
+def test_images_without_exif_are_cached(processor, tmp_path):
+    path = tmp_path / "screenshot.png"
+    Image.new("RGB", (32, 32), "blue").save(path)
+
+    first = processor.process_image_file(str(path), generate_caption=False)
+    assert first["errors"] == []
+    assert first["warnings"] == ["EXIF extraction: No EXIF data found"]
+
+    # Reused from the cache: phase one does not run again, only the caption stage
+    processor.process_image = None
+    assert processor.process_image_file(str(path))["vision_caption"] == "赤い背景の画像"
+    assert processor.captions == 1
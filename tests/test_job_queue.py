@@ -0,0 +1,237 @@
+"""
+Tests for job_queue on fakeredis.
+"""
+
+import fakeredis
+import pytest
+import requests
+from PIL import Image
+
+from dify_client import DifyClient
+from hash_cache import HashCache
+from image_processor import ImageProcessor
+from job_queue import JobQueue, Worker, enqueue_actions
+
+
+class FakeProcessor:
+    budget_seconds = 60.0
+    gemini_api_key = None
+
+    def process_image_file(self, path, generate_caption=True, deadline=None):
+        return {"success": True, "full_document_text": f"■ファイル名: {path}", "errors": []}
+
+    def caption_image_file(self, path, deadline=None):
+        return self.process_image_file(path)
+
+
+class FakeClient:
+    timeout = 30
+
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.created = []
+
+    def create_by_text(self, name, text, dataset_id=None, timeout=None):
+        if self.fail:
+            raise RuntimeError("Dify unavailable")
+        self.created.append(name)
+        return {"document": {"id": f"doc-{len(self.created)}"}}
+
+    def delete_document(self, document_id, dataset_id=None):
+        pass
+
+
+class FakeDify(DifyClient):
+    """DifyClient over an in-memory dataset; update-by-text can be rejected."""
+
+    def __init__(self, reject_update=False):
+        super().__init__(api_key="dataset-key", dataset_id="ds1")
+        self.reject_update = reject_update
+        self.documents = {}
+        self.created = 0
+
+    def _error(self, status):
+        response = requests.Response()
+        response.status_code = status
+        return requests.HTTPError(response=response)
+
+    def create_by_text(self, name, text, process_rule=None, dataset_id=None, timeout=None):
+        self.created += 1
+        document_id = f"doc-{self.created}"
+        self.documents[document_id] = (name, text)
+        return {"document": {"id": document_id}, "batch": "batch-1"}
+
+    def update_by_text(self, document_id, name, text, process_rule=None, dataset_id=None):
+        if self.reject_update:
+            raise self._error(400)
+        if document_id not in self.documents:
+            raise self._error(404)
+        self.documents[document_id] = (name, text)
+        return {"document": {"id": document_id}}
+
+    def wait_for_indexing(self, batch, dataset_id=None):
+        return 0.1
+
+    def add_segments(self, document_id, segments, dataset_id=None):
+        name, text = self.documents[document_id]
+        self.documents[document_id] = (name, text + "".join(segments))
+
+    def delete_document(self, document_id, dataset_id=None):
+        if self.documents.pop(document_id, None) is None:
+            raise self._error(404)
+        return {}
+
+
+@pytest.fixture
+def queue():
+    return JobQueue(redis_client=fakeredis.FakeRedis(decode_responses=True), max_deliveries=2)
+
+
+def _image_job(relative_path="images/a.jpg", digest="d1"):
+    return {
+        "path": f"/watch/{relative_path}",
+        "name": relative_path.rsplit("/", 1)[-1],
+        "relativePath": relative_path,
+        "type": "image",
+        "action": "add",
+        "content_hash": digest
+    }
+
+
+def test_manifest_written_after_success(queue):
+    manifest = HashCache(":memory:")
+    enqueue_actions(queue, [_image_job()], manifest)
+    assert manifest.indexed_digest("images/a.jpg") is None
+
+    worker = Worker(queue, processor=FakeProcessor(), client=FakeClient(), consumer_name="w1", manifest=manifest)
+    worker.run_once(block_ms=1)
+
+    assert manifest.indexed_digest("images/a.jpg") == "d1"
+
+
+def test_manifest_untouched_when_job_dead_letters(queue):
+    manifest = HashCache(":memory:")
+    manifest.set_indexed("images/a.jpg", "old")
+    job = {**_image_job(digest="new"), "action": "update", "documentId": "doc-1"}
+    enqueue_actions(queue, [job], manifest)
+
+    queue.visibility_timeout = 0
+    worker = Worker(queue, processor=FakeProcessor(), client=FakeClient(fail=True), consumer_name="w1", manifest=manifest)
+    worker.run_once(block_ms=1)
+    worker.run_once(block_ms=1)
+
+    assert queue.stats()["dead_letter"] == 1
+    # Still the old digest: the next sync plans the update again
+    assert manifest.indexed_digest("images/a.jpg") == "old"
+
+
+def _rename_job(old, new, type_="image"):
+    return {
+        "path": f"/watch/{new}",
+        "name": new.rsplit("/", 1)[-1],
+        "relativePath": new,
+        "oldRelativePath": old,
+        "type": type_,
+        "action": "rename",
+        "documentId": "doc-1",
+        "content_hash": "d1"
+    }
+
+
+@pytest.mark.parametrize("reject_update", [False, True])
+def test_image_rename_rerenders_text(queue, reject_update):
+    client = FakeDify(reject_update=reject_update)
+    client.create_by_text("images/a.jpg", "■ファイル名: /watch/images/a.jpg")
+    worker = Worker(queue, processor=FakeProcessor(), client=client, consumer_name="w1")
+
+    summary = worker.handle(_rename_job("images/a.jpg", "images/2024/b.jpg"))
+
+    # Without update-by-text the document is deleted and added again
+    assert summary["documentId"] == ("doc-2" if reject_update else "doc-1")
+    assert list(client.documents.values()) == [("images/2024/b.jpg", "■ファイル名: /watch/images/2024/b.jpg")]
+
+
+@pytest.mark.parametrize("cached", [False, True])
+def test_image_rename_keeps_caption_without_cached_result(queue, tmp_path, cached):
+    # A screenshot: no EXIF, captioned in phase two
+    path = tmp_path / "screen.png"
+    Image.new("RGB", (32, 32), "blue").save(path)
+    processor = ImageProcessor(
+        gemini_api_key="key", geocoder=object(), hash_cache=HashCache(":memory:") if cached else None
+    )
+    processor._generate_vision_caption = lambda image_binary, deadline=None: "青い画面"
+    client = FakeDify()
+    client.create_by_text("images/old.png", "■ファイル名: old.png\n■画像内容の説明:\n青い画面")
+    worker = Worker(queue, processor=processor, client=client, consumer_name="w1")
+
+    job = {**_rename_job("images/old.png", "images/screen.png"), "path": str(path)}
+    worker.handle(job)
+
+    assert client.documents["doc-1"] == ("images/screen.png", "■ファイル名: screen.png\n■画像内容の説明:\n青い画面")
+
+
+def test_text_rename_rerenders_header(queue, tmp_path):
+    path = tmp_path / "notes.md"
+    path.write_text("議事録です。", encoding="utf-8")
+    client = FakeDify()
+    client.create_by_text("docs/notes.md", "■ファイルパス: docs/notes.md")
+    worker = Worker(queue, processor=FakeProcessor(), client=client, consumer_name="w1")
+
+    job = {**_rename_job("docs/notes.md", "archive/notes.md", "document"), "path": str(path)}
+    summary = worker.handle(job)
+
+    name, text = client.documents[summary["documentId"]]
+    assert len(client.documents) == 1
+    assert name == "archive/notes.md"
+    assert "■ファイルパス: archive/notes.md" in text and "docs/notes.md" not in text
+
+
+def test_other_renames_delete_the_old_document(queue):
+    job = {**_rename_job("docs/report.pdf", "archive/report.pdf", "document")}
+    enqueue_actions(queue, [job])
+
+    claimed = queue.claim("w1", block_ms=1)
+    assert [(j["action"], j["relativePath"]) for _, j in claimed] == [("delete", "docs/report.pdf")]
+
+
+def test_claim_and_ack(queue):
+    assert queue.enqueue(_image_job())
+    # Identical job while the first is in flight
+    assert queue.enqueue(_image_job()) is None
+
+    [(message_id, job)] = queue.claim("w1", block_ms=1)
+    queue.ack(message_id, job, {"status": "indexed"})
+
+    assert queue.stats() == {"queued": 0, "pending": 0, "dead_letter": 0}
+    assert queue.is_done(job)
+    # Completed work is never redone
+    assert queue.enqueue(_image_job()) is None
+
+
+def test_failed_job_is_retried_after_visibility_timeout(queue):
+    queue.enqueue(_image_job())
+    [(message_id, job)] = queue.claim("w1", block_ms=1)
+
+    assert queue.fail(message_id, job, "timeout") is False
+    # Still invisible to other workers within the visibility timeout
+    assert queue.claim("w2", block_ms=1) == []
+
+    queue.visibility_timeout = 0
+    [(retried_id, retried)] = queue.claim("w2", block_ms=1)
+    assert retried_id == message_id and retried == job
+
+    # The second delivery reaches max_deliveries
+    assert queue.fail(retried_id, retried, "timeout") is True
+    assert queue.stats() == {"queued": 0, "pending": 0, "dead_letter": 1}
+
+
+def test_crashed_worker_jobs_are_reclaimed(queue):
+    queue.enqueue(_image_job())
+    queue.claim("crashed", block_ms=1)
+
+    queue.visibility_timeout = 0
+    worker = Worker(queue, processor=FakeProcessor(), client=FakeClient(), consumer_name="w2")
+    assert worker.run_once(block_ms=1) == 1
+
+    assert worker.client.created == ["images/a.jpg"]
+    assert queue.stats()["pending"] == 0
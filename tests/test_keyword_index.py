@@ -0,0 +1,66 @@
+"""
+Tests for keyword_index (AND queries and the shared store).
+"""
+
+from keyword_index import KeywordIndex, KeywordStore
+
+
+def test_match_all_requires_every_term():
+    index = KeywordIndex()
+    index.add("images/tokyo.jpg", "東京タワーの写真")
+    index.add("images/osaka.jpg", "大阪城の写真")
+
+    # 名古屋 is in no document: an AND query has no answer
+    assert index.search("東京 名古屋", match_all=True) == []
+    assert [r["name"] for r in index.search("東京 名古屋")] == ["images/tokyo.jpg"]
+
+
+def test_match_all_keeps_common_terms():
+    index = KeywordIndex(stop_df_ratio=0.5)
+    index.add("a.md", "東京 会議 議事録")
+    index.add("b.md", "大阪 会議 議事録")
+    index.add("c.md", "東京 報告")
+
+    # 議事録 is in most documents but still has to match
+    assert [r["name"] for r in index.search("東京 議事録", match_all=True)] == ["a.md"]
+
+
+def test_single_character_query():
+    index = KeywordIndex()
+    index.add("images/tokyo.jpg", "東京駅で撮影")
+    index.add("images/shinjuku.jpg", "新宿駅の写真")
+    index.add("images/park.jpg", "芝公園")
+
+    assert sorted(r["name"] for r in index.search("駅")) == ["images/shinjuku.jpg", "images/tokyo.jpg"]
+    assert [r["name"] for r in index.search("東京 駅", match_all=True)] == ["images/tokyo.jpg"]
+
+
+def test_store_merges_concurrent_writers(tmp_path):
+    path = str(tmp_path / "keywords.sqlite3")
+    worker_a = KeywordStore(path)
+    worker_b = KeywordStore(path)
+    reader = KeywordStore(path)
+
+    worker_a.put("images/a.jpg", "芝公園 スターバックス")
+    worker_b.put("images/b.jpg", "名古屋駅 看板")
+    index = reader.load()
+    assert len(index) == 2
+
+    worker_a.rename("images/a.jpg", "images/2024/a.jpg")
+    worker_b.delete("images/b.jpg")
+    reader.refresh(index)
+
+    assert [r["name"] for r in index.search("スターバックス")] == ["images/2024/a.jpg"]
+    assert index.search("名古屋") == []
+
+
+def test_refresh_reloads_when_log_was_pruned(tmp_path):
+    path = str(tmp_path / "keywords.sqlite3")
+    writer = KeywordStore(path, keep_changes=10)
+    reader = KeywordStore(path)
+    index = reader.load()
+
+    for i in range(1000):
+        writer.put(f"doc{i}.md", "テスト文書")
+
+    assert len(reader.refresh(index)) == 1000
@@ -0,0 +1,53 @@
+"""
+Tests for the shared Redis rate limiter on fakeredis.
+"""
+
+import time
+
+import fakeredis
+import pytest
+
+from deadline import Deadline, DeadlineExceeded
+from geocoder import Geocoder
+from rate_limiter import SharedRateLimiter
+
+
+@pytest.fixture
+def server():
+    return fakeredis.FakeServer()
+
+
+def _limiter(server, interval=0.2):
+    return SharedRateLimiter(fakeredis.FakeRedis(server=server, decode_responses=True), "nominatim", interval)
+
+
+def test_slots_are_shared_between_processes(server):
+    # Two workers, each with its own connection, share one rate
+    worker_a, worker_b = _limiter(server), _limiter(server)
+
+    start = time.monotonic()
+    assert worker_a.acquire() == 0
+    worker_b.acquire()
+    worker_a.acquire()
+
+    assert time.monotonic() - start >= 0.38
+
+
+def test_deadline_reserves_nothing(server):
+    limiter = _limiter(server, interval=1.0)
+    limiter.acquire()
+
+    with pytest.raises(DeadlineExceeded):
+        _limiter(server, interval=1.0).acquire(Deadline(0.1))
+    # The refused caller took no slot: the next one waits a single interval
+    assert limiter.acquire() <= 1.0
+
+
+def test_geocoder_uses_shared_limiter(server):
+    limiter = _limiter(server, interval=5.0)
+    geocoder = Geocoder(provider="nominatim", rate_limiter=limiter)
+    limiter.acquire()
+
+    # Another process just used the slot: a short deadline cannot wait for the next one
+    with pytest.raises(DeadlineExceeded):
+        geocoder._rate_limit(Deadline(0.5))
@@ -0,0 +1,60 @@
+"""
+Tests for the compact result records and their use in the hash cache.
+"""
+
+import json
+
+import pytest
+
+from hash_cache import HashCache
+from records import FORMAT_VERSION, GeoResult, ImageRecord, dump_records, load_records
+
+RESULT = {
+    "filename": "IMG_1234.jpg",
+    "datetime": "2025-01-15 14:30:00",
+    "location": "芝公園, 港区, 東京都, 日本",
+    "coordinates": {"lat": 35.6544, "lon": 139.7480},
+    "camera": "Apple iPhone 15 Pro",
+    "vision_caption": "東京タワーの夜景",
+    "success": True,
+    "errors": [],
+    "content_hash": "ab" * 32,
+    "thumbnails": {"256": "ab/ab/abab-256.jpg"}
+}
+
+
+def test_round_trip_keeps_thumbnails():
+    record = ImageRecord.from_dict(RESULT)
+
+    assert ImageRecord.from_bytes(record.to_bytes()) == record
+    assert load_records(dump_records([record, record])) == [record, record]
+    result = record.to_dict()
+    assert result["thumbnails"] == {"256": "ab/ab/abab-256.jpg"}
+    # Store keys are not indexed
+    assert "abab" not in result["full_document_text"]
+
+
+def test_unknown_version_is_rejected():
+    data = bytearray(ImageRecord.from_dict(RESULT).to_bytes())
+    data[0] = FORMAT_VERSION + 1
+
+    with pytest.raises(ValueError):
+        ImageRecord.from_bytes(bytes(data))
+    with pytest.raises(ValueError):
+        GeoResult.from_bytes(bytes([FORMAT_VERSION + 1]))
+
+
+def test_hash_cache_stores_records():
+    cache = HashCache(":memory:")
+    cache.put_result("d1", RESULT)
+
+    result = cache.get_result("d1")
+    assert {key: result[key] for key in RESULT} == RESULT
+    assert result["full_document_text"].endswith("■画像内容の説明:\n東京タワーの夜景")
+
+
+def test_hash_cache_reads_json_results():
+    cache = HashCache(":memory:")
+    cache._db.execute("INSERT INTO results VALUES (?, ?)", ("d1", json.dumps(RESULT, ensure_ascii=False)))
+
+    assert cache.get_result("d1") == RESULT
@@ -0,0 +1,149 @@
+"""
+Tests for retrieval_proxy against a local Dify stand-in.
+"""
+
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+
+from retrieval_proxy import CacheInvalidator, ResponseCache, create_server
+
+
+class FakeDify(BaseHTTPRequestHandler):
+    """Answers retrieve with a call counter and streams chat-messages as SSE."""
+
+    protocol_version = "HTTP/1.1"
+    calls = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length") or 0)) or b"{}")
+        self.calls.append((self.path, body))
+
+        if self.path.endswith("/retrieve"):
+            self._json({"query": {"content": body.get("query")}, "records": [{"score": 0.9, "n": len(self.calls)}]})
+        elif body.get("response_mode") == "streaming":
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            for i in range(3):
+                event = f"data: {json.dumps({'answer': str(i)})}\n\n".encode("utf-8")
+                self.wfile.write(f"{len(event):X}\r\n".encode("ascii") + event + b"\r\n")
+                self.wfile.flush()
+            self.wfile.write(b"0\r\n\r\n")
+        else:
+            self._json({"answer": "ok", "conversation_id": f"conv-{len(self.calls)}", "user": body.get("user")})
+
+    def _json(self, data):
+        content = json.dumps(data).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+
+def _serve(server):
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return f"http://127.0.0.1:{server.server_address[1]}"
+
+
+@pytest.fixture
+def proxy():
+    calls = []
+    dify = ThreadingHTTPServer(("127.0.0.1", 0), type("Dify", (FakeDify,), {"calls": calls}))
+    upstream = _serve(dify)
+    server = create_server(
+        host="127.0.0.1", port=0, upstream=upstream, cache=ResponseCache(), shards={}, admin_token="admin-token"
+    )
+    url = _serve(server)
+    yield url, calls
+    server.shutdown()
+    dify.shutdown()
+
+
+def _retrieve(url, query, dataset="ds1"):
+    return requests.post(
+        f"{url}/v1/datasets/{dataset}/retrieve",
+        headers={"Authorization": "Bearer dataset-key"},
+        json={"query": query, "retrieval_model": {"top_k": 3}},
+        timeout=5
+    )
+
+
+def test_retrieve_hit_and_miss(proxy):
+    url, calls = proxy
+
+    first = _retrieve(url, "東京タワー")
+    second = _retrieve(url, " 東京タワー？ ")
+    other = _retrieve(url, "大阪城")
+
+    assert first.headers["X-Proxy-Cache"] == "MISS"
+    assert second.headers["X-Proxy-Cache"] == "HIT"
+    assert second.json() == first.json()
+    assert other.headers["X-Proxy-Cache"] == "MISS"
+    assert len(calls) == 2
+
+    stats = requests.get(f"{url}/proxy/stats", timeout=5).json()
+    assert stats["hits"] == 1 and stats["misses"] == 2
+
+
+def test_invalidation_on_dataset_write(proxy):
+    url, calls = proxy
+    _retrieve(url, "東京タワー", "ds1")
+    _retrieve(url, "東京タワー", "ds2")
+
+    # A worker writing to ds1 drops only ds1's entries
+    CacheInvalidator(proxy_url=url, dataset_id="ds1", admin_token="admin-token").document_added("images/a.jpg", "text")
+
+    assert _retrieve(url, "東京タワー", "ds1").headers["X-Proxy-Cache"] == "MISS"
+    assert _retrieve(url, "東京タワー", "ds2").headers["X-Proxy-Cache"] == "HIT"
+    assert len(calls) == 3
+
+
+@pytest.mark.parametrize("headers", [{}, {"Authorization": "Bearer dataset-key"}])
+def test_invalidation_requires_admin_token(proxy, headers):
+    url, calls = proxy
+    _retrieve(url, "東京タワー")
+
+    response = requests.post(f"{url}/proxy/invalidate", headers=headers, json={}, timeout=5)
+
+    assert response.status_code == 401
+    assert _retrieve(url, "東京タワー").headers["X-Proxy-Cache"] == "HIT"
+    assert requests.get(f"{url}/proxy/stats", timeout=5).json()["invalidations"] == 0
+
+
+def test_app_endpoints_are_not_cached(proxy):
+    url, calls = proxy
+    payload = {"query": "東京タワー", "inputs": {}, "response_mode": "blocking"}
+
+    alice = requests.post(f"{url}/v1/chat-messages", json={**payload, "user": "alice"}, timeout=5)
+    bob = requests.post(f"{url}/v1/chat-messages", json={**payload, "user": "bob"}, timeout=5)
+
+    assert alice.headers["X-Proxy-Cache"] == "BYPASS"
+    assert bob.json()["user"] == "bob"
+    assert alice.json()["conversation_id"] != bob.json()["conversation_id"]
+    assert len(calls) == 2
+
+
+def test_streaming_passthrough(proxy):
+    url, calls = proxy
+
+    response = requests.post(
+        f"{url}/v1/chat-messages",
+        json={"query": "東京タワー", "inputs": {}, "response_mode": "streaming", "user": "alice"},
+        stream=True,
+        timeout=5
+    )
+    events = [line for line in response.iter_lines() if line]
+
+    assert response.headers["X-Proxy-Cache"] == "BYPASS"
+    assert response.headers["Content-Type"].startswith("text/event-stream")
+    assert [json.loads(event[len(b"data: "):])["answer"] for event in events] == ["0", "1", "2"]
@@ -0,0 +1,53 @@
+"""
+Tests for text_chunker uploads against a fake Dify client.
+"""
+
+import pytest
+
+from text_chunker import upload_text_document
+
+
+class FakeClient:
+    def __init__(self, fail_segments=False):
+        self.fail_segments = fail_segments
+        self.documents = {}
+
+    def create_by_text(self, name, text, process_rule=None, dataset_id=None):
+        document_id = f"doc-{len(self.documents) + 1}"
+        self.documents[document_id] = name
+        return {"document": {"id": document_id}, "batch": "batch-1"}
+
+    def wait_for_indexing(self, batch, dataset_id=None):
+        return 0.5
+
+    def add_segments(self, document_id, segments, dataset_id=None):
+        if self.fail_segments:
+            raise RuntimeError("segments API unavailable")
+
+    def delete_document(self, document_id, dataset_id=None):
+        del self.documents[document_id]
+
+
+@pytest.fixture
+def large_file(tmp_path):
+    path = tmp_path / "minutes.md"
+    path.write_text("\n".join(f"第{i}回の議事録です。内容を確認しました。" for i in range(2000)), encoding="utf-8")
+    return str(path)
+
+
+def test_upload_appends_segments(large_file):
+    client = FakeClient()
+    result = upload_text_document(large_file, "documents/minutes.md", client=client, batch_chars=2000)
+
+    assert result["indexing_seconds"] == 0.5
+    assert list(client.documents.values()) == ["documents/minutes.md"]
+
+
+def test_failed_append_deletes_partial_document(large_file):
+    client = FakeClient(fail_segments=True)
+
+    with pytest.raises(RuntimeError):
+        upload_text_document(large_file, "documents/minutes.md", client=client, batch_chars=2000)
+
+    # The retry creates a fresh document; nothing is orphaned
+    assert client.documents == {}
@@ -0,0 +1,22 @@
+"""
+Tests for thumbnail_store.
+"""
+
+import os
+
+from PIL import Image
+
+from thumbnail_store import ThumbnailStore
+
+
+def test_heif_thumbnails(tmp_path):
+    path = tmp_path / "IMG_0001.HEIC"
+    Image.new("RGB", (640, 480), "green").save(path, format="HEIF")
+    store = ThumbnailStore(str(tmp_path / "thumbs"), sizes=[256])
+
+    keys = store.ensure("ab" * 32, str(path))
+
+    with Image.open(store.path(keys["256"])) as thumbnail:
+        assert thumbnail.format == "JPEG"
+        assert thumbnail.size == (256, 192)
+    assert os.path.basename(keys["256"]) == f"{'ab' * 32}-256.jpg"
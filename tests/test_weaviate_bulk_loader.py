@@ -0,0 +1,84 @@
+"""
+Tests for weaviate_bulk_loader against an in-memory Weaviate stand-in.
+"""
+
+import pytest
+
+from weaviate_bulk_loader import BulkLoader
+
+
+class FakeResponse:
+    def __init__(self, data=None, status_code=200):
+        self.data = data if data is not None else {}
+        self.status_code = status_code
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return self.data
+
+
+class FakeWeaviate:
+    """Stores batch objects by ID; batch delete matches on document_id."""
+
+    def __init__(self):
+        self.objects = {}
+
+    def get(self, url, timeout=None):
+        return FakeResponse()
+
+    def post(self, url, json=None, timeout=None):
+        for obj in json["objects"]:
+            self.objects[obj["id"]] = obj
+        return FakeResponse([{} for _ in json["objects"]])
+
+    def delete(self, url, json=None, timeout=None):
+        document_id = json["match"]["where"]["valueText"]
+        matched = [key for key, obj in self.objects.items() if obj["properties"]["document_id"] == document_id]
+        for key in matched:
+            del self.objects[key]
+        return FakeResponse({"results": {"successful": len(matched)}})
+
+
+@pytest.fixture
+def loader():
+    loader = BulkLoader(weaviate_url="http://weaviate:8080", dataset_id="ds-1", map_path=":memory:")
+    weaviate = FakeWeaviate()
+    loader._session = lambda: weaviate
+    loader.weaviate = weaviate
+    return loader
+
+
+def _document(count):
+    return {
+        "name": "documents/minutes.md",
+        "document_id": "doc-1",
+        "chunks": [{"index_node_id": f"node-{i}", "text": f"議事録 {i}", "vector": [0.1, 0.2]} for i in range(count)]
+    }
+
+
+def test_nodes_use_dify_ids(loader):
+    loader.load([_document(2)])
+
+    node = loader.weaviate.objects["node-0"]
+    assert node["properties"]["doc_id"] == "node-0"
+    assert node["properties"]["document_id"] == "doc-1"
+
+
+def test_documents_without_dify_ids_are_rejected(loader):
+    document = _document(1)
+    del document["chunks"][0]["index_node_id"]
+
+    with pytest.raises(ValueError):
+        loader.load([document])
+    assert loader.weaviate.objects == {}
+
+
+def test_reload_with_fewer_chunks_leaves_no_orphans(loader):
+    loader.load([_document(3)])
+    loader.load([_document(1)])
+
+    assert list(loader.weaviate.objects) == ["node-0"]
+    assert loader._db.execute("SELECT node_id FROM nodes").fetchall() == [("node-0",)]
+    assert loader.documents()[0]["chunks"] == 1